@@ -1,14 +1,94 @@
 from workers.app_worker import AppWorker
-from workers.mercury_worker import MercuryWorker
-from workers.btc_tool_worker import BtcToolsWorker
-from service import log
+from service import log, config
+from tracing import tracer
+from threading import Lock
+from time import perf_counter
+import importlib
+
+# worker classes are imported on the first use, so the startup doesn't load the libraries of all workers
+APPS = {
+    'btctools': 'workers.btc_tool_worker.BtcToolsWorker',
+    'mercury': 'workers.mercury_worker.MercuryWorker'
+}
+
+
+def get_worker_class(program_name: str):
+    if not (path := APPS.get(program_name)):
+        raise ModuleNotFoundError(f'{program_name} class not found')
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class SessionPool:
+    """
+    Keeps applications alive between the scheduled runs ('keep_alive = 1' in the [SESSIONS] section).
+    A session is reused after the health check, otherwise the pool reconnects to the running program
+    and starts it only if it is not running
+    """
+
+    def __init__(self):
+        self.sessions: dict[str, AppWorker] = {}
+        self.stats = []
+        self._lock = Lock()
+
+    @classmethod
+    def from_config(cls):
+        if config.has_section('SESSIONS') and config['SESSIONS'].get('keep_alive') == '1':
+            return cls()
+        return None
+
+    def acquire(self, program_name: str, worker_cls) -> AppWorker:
+        started = perf_counter()
+        with self._lock:
+            worker = self.sessions.pop(program_name, None)
+
+        if worker is not None and worker.is_alive():
+            worker.waiter.history.clear()
+            worker.ui.lookups.clear()
+            start = 'warm'
+        elif (program_obj := worker_cls.find_running()) is not None:
+            worker, start = worker_cls(program_obj), 'reconnect'
+        else:
+            worker, start = worker_cls(), 'cold'
+
+        latency = perf_counter() - started
+        self.stats.append({'program': program_name, 'start': start, 'latency': latency})
+        log.info(f'{program_name}: {start} start in {latency:.2f} s')
+        return worker
+
+    def release(self, program_name: str, worker: AppWorker):
+        with self._lock:
+            self.sessions[program_name] = worker
+
+    def discard(self, program_name: str, worker: AppWorker):
+        with self._lock:
+            self.sessions.pop(program_name, None)
+        if worker.program_obj:
+            worker.program_obj.kill()
+
+    def close(self):
+        for program_name, worker in list(self.sessions.items()):
+            self.discard(program_name, worker)
+
+    def summary(self) -> dict:
+        """Average start latency by the start type"""
+
+        latencies = {}
+        for stat in self.stats:
+            latencies.setdefault(stat['start'], []).append(stat['latency'])
+        return {start: {'count': len(values), 'avg': round(sum(values) / len(values), 3)}
+                for start, values in latencies.items()}
 
 
 class WithAppRunner:
 
-    def __init__(self, program_name):
+    def __init__(self, program_name, pool: SessionPool | None = None):
         self.program_name = program_name
-        self.application = self.invalidate_app(self.program_name)
+        self.pool = pool
+        # set by the caller after the work, a failed session isn't kept alive
+        self.succeeded = False
+        with tracer.span('app.start', program=program_name):
+            self.application = self.invalidate_app(self.program_name, pool)
 
     def __enter__(self) -> AppWorker | None:
         if not self.application:
@@ -23,19 +103,24 @@ class WithAppRunner:
         return self.application
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        with tracer.span('app.close', program=self.program_name):
+            if self.pool and self.application.program_obj and exc_type is None and self.succeeded:
+                self.pool.release(self.program_name, self.application)
+                log.info(f'{self.application.program_name} completed, the session is kept alive')
+            elif self.application.program_obj:
+                if self.pool:
+                    self.pool.discard(self.program_name, self.application)
+                else:
+                    self.application.program_obj.kill()
+                log.info(f'{self.application.program_name} completed')
+        log.info(f'{self.application.program_name} wait profile: {self.application.steps.profile()}')
         if self.application.program_obj:
-            self.application.program_obj.kill()
-            log.info(f'{self.application.program_name} completed')
+            log.info(f'{self.application.program_name} lookup profile: {self.application.ui.profile()}')
 
     @staticmethod
-    def invalidate_app(program_name) -> AppWorker:
+    def invalidate_app(program_name, pool: SessionPool | None = None) -> AppWorker:
 
-        apps_dict = {
-            'btctools': BtcToolsWorker,
-            'mercury': MercuryWorker
-        }
-
-        if apps_dict.get(program_name):
-            return apps_dict[program_name]()
-        else:
-            raise ModuleNotFoundError(f'{program_name} class not found')
+        worker_cls = get_worker_class(program_name)
+        if pool:
+            return pool.acquire(program_name, worker_cls)
+        return worker_cls()
@@ -0,0 +1,48 @@
+"""
+Benchmark suite of the automation pipeline
+run from the src folder: python -m benchmarks [--filter excel] [--baseline benchmarks.json] [--save-baseline]
+results are written as json, the cases slower than the baseline by more than --threshold fail the run
+"""
+from service import log
+from . import harness, suite
+import argparse
+import logging
+import os
+import sys
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', help='run the cases containing the substring')
+    parser.add_argument('--repeat', type=int, help='repeat every case instead of its default count')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown, a share of the baseline')
+    args = parser.parse_args()
+
+    log.setLevel(logging.ERROR)
+    suite.setup()
+    print(f"{'case':<50}{'median, ms':>12}{'min, ms':>12}")
+    results = harness.run_cases(args.filter, args.repeat)
+    harness.save(results, args.output)
+
+    if args.save_baseline:
+        harness.save(results, args.baseline)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'No baseline {args.baseline}, run with --save-baseline to create it')
+        return 0
+
+    regressions = harness.compare(results, harness.load(args.baseline), args.threshold)
+    for r in regressions:
+        print(f"REGRESSION {r['case']}: {r['median'] * 1000:.3f} ms against {r['baseline'] * 1000:.3f} ms "
+              f"(x{r['ratio']})")
+    if not regressions:
+        print(f'No regressions against {args.baseline}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
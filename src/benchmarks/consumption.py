@@ -0,0 +1,65 @@
+"""
+Consumption analytics benchmark on a synthetic workbook of daily readings: the first load parses the workbook,
+the next loads take the .npz cache, then the reports over the whole history are timed
+run from the src folder: python -m benchmarks.consumption --years 5 --meters 300
+"""
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from datetime import date, timedelta
+from workers.excel_append import write_streaming
+from workers.consumption import ConsumptionHistory, SHEETS
+import argparse
+import os
+import random
+
+
+def synthetic_readings(days: int, meters: int, rng: random.Random):
+    """Rows of the cumulative readings: a header with the meter numbers, then one row per day"""
+
+    yield ['date'] + [10000 + m for m in range(meters)]
+    totals = [rng.uniform(0, 1e5) for _ in range(meters)]
+    rates = [rng.uniform(10, 500) for _ in range(meters)]
+    first = date(2000, 1, 1)
+    for d in range(days):
+        for m in range(meters):
+            totals[m] += rates[m] * rng.uniform(0.7, 1.3) * (20 if rng.random() < 0.001 else 1)
+        yield [f'{first + timedelta(days=d):%d.%m.%Y}'] + [round(t, 2) for t in totals]
+
+def timed(function, *args, **kwargs):
+    started = perf_counter()
+    result = function(*args, **kwargs)
+    return perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--meters', type=int, default=300)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'data.xlsx')
+        write_streaming(path, {name: synthetic_readings(args.years * 365, args.meters, random.Random(1))
+                               for name in SHEETS})
+        columns = range(2, args.meters + 2)
+
+        seconds, history = timed(ConsumptionHistory.load, path, 1, columns)
+        series = history.sheets['reset_energy']
+        print(f'workbook load: {series.values.shape[0]} days x {series.values.shape[1]} meters in {seconds:.2f} s')
+        seconds, history = timed(ConsumptionHistory.load, path, 1, columns)
+        print(f'cached load: {seconds * 1000:.1f} ms')
+
+        seconds, daily = timed(history.daily)
+        print(f'daily deltas: {seconds * 1000:.2f} ms')
+        seconds, _ = timed(history.rolling_mean, daily, 30)
+        print(f'30 day rolling mean: {seconds * 1000:.2f} ms')
+        seconds, flags = timed(history.outliers, daily)
+        print(f'outliers: {int(flags.sum())} flags in {seconds * 1000:.2f} ms')
+        seconds, totals = timed(history.totals, daily, 'month')
+        print(f'monthly totals: {len(totals.dates)} months in {seconds * 1000:.2f} ms')
+        seconds, _ = timed(history.report)
+        print(f'full report: {seconds * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Excel write benchmark: full load/save of the workbook against the streaming append with the sidecar index
+run from the src folder: python -m benchmarks.excel_append --rows 10000 100000 1000000
+"""
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from workers.excel_append import WorkbookIndex, XlsxAppender, write_streaming
+import argparse
+import openpyxl
+import os
+
+SHEETS = ['previous_day', 'reset_energy']
+
+
+def synthetic_rows(rows: int, meters: int):
+    yield ['date'] + [1000 + m for m in range(meters)]
+    for r in range(rows):
+        yield [f'{r % 28 + 1:02}.01.2000'] + [float(r + m) for m in range(meters)]
+
+
+def full_write(data_path: str, meters: int):
+    """The workbook load/save path of ExcelWriter.write_workbook_data"""
+
+    wb = openpyxl.load_workbook(data_path)
+    for name in SHEETS:
+        sheet = wb[name]
+        last_row = sheet.max_row
+        sheet.cell(row=last_row + 1, column=1).value = '01.02.2000'
+        for column in range(2, meters + 2):
+            sheet.cell(row=last_row + 1, column=column).value = 1.0
+    wb.save(data_path)
+
+
+def append_write(data_path: str, meters: int):
+    """The append path of ExcelWriter.append_workbook_data"""
+
+    index = WorkbookIndex(data_path)
+    if not index.loaded:
+        index.rebuild(SHEETS, 1, range(2, meters + 2))
+    rows = {}
+    for name in SHEETS:
+        row = index.sheets[name]['last_row'] + 1
+        rows[name] = [(row, {1: '01.02.2000', **{c: 1.0 for c in range(2, meters + 2)}})]
+        index.sheets[name] = {'last_row': row, 'last_date': '01.02.2000'}
+    XlsxAppender(data_path).append(rows)
+    index.save()
+
+
+def timed(function, *args) -> float:
+    started = perf_counter()
+    function(*args)
+    return perf_counter() - started
+
+
+def run(rows: int, meters: int) -> dict:
+    with TemporaryDirectory() as folder:
+        data_path = os.path.join(folder, 'data.xlsx')
+        write_streaming(data_path, {name: synthetic_rows(rows, meters) for name in SHEETS})
+        result = {'rows': rows, 'size_mb': round(os.path.getsize(data_path) / 2 ** 20, 2)}
+        result['append_cold'] = timed(append_write, data_path, meters)
+        result['append_warm'] = timed(append_write, data_path, meters)
+        result['full'] = timed(full_write, data_path, meters)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--meters', type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}{'size, MB':>10}{'append cold':>13}{'append warm':>13}{'full':>10}")
+    for rows in args.rows:
+        r = run(rows, args.meters)
+        print(f"{r['rows']:>10}{r['size_mb']:>10}{r['append_cold']:>13.3f}{r['append_warm']:>13.3f}{r['full']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
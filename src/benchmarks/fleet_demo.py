@@ -0,0 +1,75 @@
+"""
+Fleet of fake agents on one machine: a coordinator on a local port and agents of several plants,
+the agents run simulated programs that sleep and fail with the given probability.
+Prints which agent ran every job and the timings collected by the coordinator
+run from the src folder: python -m benchmarks.fleet_demo --plants 3 --agents 2 --capacity 1,2 --runs 2
+"""
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import sleep
+from fleet import Coordinator, Agent
+import argparse
+import os
+import random
+
+PROGRAM_TIME = {'btctools': 0.3, 'mercury': 0.5, 'scan': 0.2, 'report': 0.1}
+
+
+def fake_runner(fail_rate: float, rng: random.Random):
+    def run(program: str) -> dict:
+        duration = PROGRAM_TIME.get(program, 0.2) * rng.uniform(0.8, 1.2)
+        sleep(duration)
+        failed = rng.random() < fail_rate
+        return {'program': program, 'result': not failed, 'duration': duration,
+                'error': 'simulated failure' if failed else None}
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--plants', type=int, default=3)
+    parser.add_argument('--agents', type=int, default=2, help='agents per plant')
+    parser.add_argument('--capacity', default='1,2', help='capacities of the agents of a plant, comma separated')
+    parser.add_argument('--programs', default='btctools,mercury,scan,report')
+    parser.add_argument('--fail-rate', type=float, default=0.1)
+    parser.add_argument('--runs', type=int, default=2)
+    args = parser.parse_args()
+
+    capacities = [int(c) for c in args.capacity.split(',')]
+    programs = args.programs.split(',')
+    rng = random.Random(1)
+    with TemporaryDirectory() as folder:
+        coordinator = Coordinator(results_path=os.path.join(folder, 'results.jsonl'), agent_timeout=5)
+        server = coordinator.serve('127.0.0.1', 0, token='demo')
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        agents = []
+        for p in range(1, args.plants + 1):
+            for a in range(1, args.agents + 1):
+                agents.append(Agent(url, f'plant{p}-pc{a}', f'plant{p}', programs,
+                                    capacity=capacities[(a - 1) % len(capacities)], poll_interval=0.05,
+                                    token='demo', runner=fake_runner(args.fail_rate, rng), parallel=programs))
+        threads = [Thread(target=agent.run, daemon=True) for agent in agents]
+        for thread in threads:
+            thread.start()
+        while len(coordinator.status()['agents']) < len(agents):
+            sleep(0.05)
+
+        for run in range(1, args.runs + 1):
+            report = coordinator.execute(timeout=60)
+            print(f'run {run}: {len(report.results)} jobs in {report.duration:.2f} s, failed: {report.failed}')
+        for agent in agents:
+            print(f'  {agent.name} (capacity {agent.capacity}): {agent.completed} jobs')
+        with open(coordinator.results_path, encoding='utf-8') as f:
+            print(f'  {sum(1 for _ in f)} job results collected')
+
+        for agent in agents:
+            agent.stop()
+        for thread in threads:
+            thread.join()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
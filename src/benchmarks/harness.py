@@ -0,0 +1,96 @@
+"""
+Benchmark harness: registered cases are timed several times, the results are saved as json
+and compared with a baseline file, a case slower than the baseline by more than the threshold is a regression
+"""
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+import json
+import platform
+import sys
+
+CASES = {}
+
+
+def benchmark(name: str, repeat: int = 5, **params):
+    """
+    Register a benchmark case
+    :param params: {parameter: [values]}, a case is registered for every value as name[parameter=value]
+    The function takes the parameter and returns (run, cleanup) or run, run() is the measured call.
+    Preparation done before returning run isn't measured
+    """
+
+    def decorator(function):
+        if not params:
+            CASES[name] = (function, {}, repeat)
+        for key, values in params.items():
+            for value in values:
+                CASES[f'{name}[{key}={value}]'] = (function, {key: value}, repeat)
+        return function
+    return decorator
+
+
+def measure(function, kwargs: dict, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        prepared = function(**kwargs)
+        run, cleanup = prepared if isinstance(prepared, tuple) else (prepared, None)
+        try:
+            started = perf_counter()
+            run()
+            times.append(perf_counter() - started)
+        finally:
+            if cleanup:
+                cleanup()
+    return {'median': median(times), 'min': min(times), 'max': max(times), 'repeat': repeat}
+
+
+def run_cases(pattern: str | None = None, repeat: int | None = None, report=print) -> dict:
+    results = {}
+    for name, (function, kwargs, default_repeat) in CASES.items():
+        if pattern and pattern not in name:
+            continue
+        try:
+            results[name] = measure(function, kwargs, repeat or default_repeat)
+        except Exception as e:
+            results[name] = {'error': repr(e)}
+        report(format_result(name, results[name]))
+    return {
+        'meta': {'date': datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0],
+                 'platform': platform.platform()},
+        'results': results
+    }
+
+
+def format_result(name: str, result: dict) -> str:
+    if 'error' in result:
+        return f"{name:<50}{'error':>12}  {result['error']}"
+    return f"{name:<50}{result['median'] * 1000:>12.3f}{result['min'] * 1000:>12.3f}"
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2) -> list[dict]:
+    """
+    :param threshold: allowed slowdown of the median, a share of the baseline
+    :return: cases slower than the baseline by more than the threshold
+    """
+
+    regressions = []
+    for name, result in results['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or 'median' not in base or 'median' not in result or not base['median']:
+            continue
+        ratio = result['median'] / base['median']
+        if ratio > 1 + threshold:
+            regressions.append({'case': name, 'baseline': base['median'], 'median': result['median'],
+                                'ratio': round(ratio, 2)})
+    return regressions
+
+
+def load(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save(results: dict, path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,72 @@
+"""
+BtcTools scan ingestion benchmark on synthetic csv exports: ingestion rate, the incremental rerun
+without new files and the diff queries between the last two days
+run from the src folder: python -m benchmarks.scan_ingest --devices 100000 --days 3
+"""
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from datetime import date, timedelta
+from workers.scan_store import ScanStore
+import argparse
+import csv
+import os
+import random
+
+MODELS = ['Antminer S19', 'Antminer S19j Pro', 'Antminer S9', 'Whatsminer M30S', 'Avalon 1246']
+
+
+def synthetic_export(path: str, devices: int, rng: random.Random):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['IP', 'Status', 'Type', 'Working Mode', 'GHS av', 'GHS 5s', 'Temp'])
+        for n in range(devices):
+            ip = f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}'
+            online = rng.random() > 0.02
+            hashrate = rng.uniform(12000, 110000) if online else 0
+            writer.writerow([ip, 'online' if online else 'offline', MODELS[n % len(MODELS)], 'Normal',
+                             f'{hashrate:.2f}', f'{hashrate * rng.uniform(0.9, 1.1):.2f}', rng.randint(50, 80)])
+
+
+def timed(function, *args, **kwargs):
+    started = perf_counter()
+    result = function(*args, **kwargs)
+    return perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=2)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with TemporaryDirectory() as folder:
+        exports = os.path.join(folder, 'exports')
+        os.mkdir(exports)
+        first = date(2000, 1, 1)
+        for d in range(args.days):
+            day = first + timedelta(days=d)
+            synthetic_export(os.path.join(exports, f'scan_{day:%d_%m}.csv'), args.devices, rng)
+        size = sum(os.path.getsize(os.path.join(exports, name)) for name in os.listdir(exports))
+
+        store = ScanStore(os.path.join(folder, 'scans.db'))
+        seconds, ingested = timed(store.ingest_folder, exports)
+        records = sum(ingested.values())
+        print(f'ingest: {len(ingested)} files, {records} records, {size / 2 ** 20:.1f} MB in {seconds:.2f} s '
+              f'({records / seconds:,.0f} records/s)')
+
+        seconds, ingested = timed(store.ingest_folder, exports)
+        print(f'incremental rerun: {len(ingested)} new files in {seconds * 1000:.1f} ms')
+
+        seconds, offline = timed(store.gone_offline)
+        print(f'gone offline since the previous day: {len(offline)} devices in {seconds * 1000:.1f} ms')
+        seconds, drops = timed(store.hashrate_drops, threshold=0.2)
+        print(f'hashrate drops over 20%: {len(drops)} devices in {seconds * 1000:.1f} ms')
+        seconds, history = timed(store.device_history, '10.0.1.1')
+        print(f'device history: {len(history)} days in {seconds * 1000:.2f} ms')
+        store.close()
+        print(f"store size: {os.path.getsize(os.path.join(folder, 'scans.db')) / 2 ** 20:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Startup benchmark: import time of every entry mode, measured in a fresh interpreter
+run from the src folder: python -m benchmarks.startup --repeat 5
+"""
+from statistics import median
+import argparse
+import subprocess
+import sys
+
+# the modules every entry mode imports before its work starts
+MODES = {
+    'menu': 'import main',
+    'schedule': 'import main, scheduling',
+    'one-time': 'import main, app_context; app_context.get_worker_class("btctools"); '
+                'app_context.get_worker_class("mercury")',
+    'notification': 'import main, notifications; import requests',
+}
+
+TEMPLATE = 'import time; t = time.perf_counter(); {code}; print(time.perf_counter() - t)'
+
+
+def measure(code: str, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', TEMPLATE.format(code=code)],
+                                capture_output=True, text=True)
+        if result.returncode:
+            return {'error': result.stderr.strip().splitlines()[-1]}
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return {'median': median(times), 'min': min(times)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for mode, code in MODES.items():
+        r = measure(code, args.repeat)
+        if 'error' in r:
+            print(f"{mode:<15}{r['error']}")
+        else:
+            print(f"{mode:<15}median {r['median'] * 1000:8.1f} ms   min {r['min'] * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
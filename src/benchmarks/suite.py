@@ -0,0 +1,219 @@
+"""Benchmark cases of the automation pipeline, they run without the Windows applications"""
+from tempfile import TemporaryDirectory
+from drivers import set_driver
+from drivers.fake import FakeDriver, btctools_app, mercury_app
+from service import config, Helper
+from workers.excel_append import WorkbookIndex, write_streaming
+from .harness import benchmark
+from .worker_flows import FAKE_CONFIG, replay
+import json
+import os
+import shutil
+
+SHEETS = ['previous_day', 'reset_energy']
+METERS = 30
+
+SUITE_CONFIG = {
+    'Excel': {'meter_index_row': '1', 'meter_index_col_first': '2', 'meter_index_col_last': str(METERS + 2),
+              'write_mode': 'append'},
+    'NOTIFICATIONS': {'tg_recipients': '[]'}
+}
+
+
+def setup():
+    config.read_dict(FAKE_CONFIG)
+    config.read_dict(SUITE_CONFIG)
+    set_driver(FakeDriver({}))
+
+
+def meter_data(meters: int = METERS) -> dict:
+    return {1000 + m: {'previous_day': float(m), 'reset_energy': m * 2.0} for m in range(meters)}
+
+
+def synthetic_workbook(path: str, rows: int):
+    def sheet_rows():
+        yield ['date'] + [1000 + m for m in range(METERS)]
+        for r in range(rows):
+            yield [f'{r % 28 + 1:02}.01.2000'] + [float(r + m) for m in range(METERS)]
+
+    write_streaming(path, {name: sheet_rows() for name in SHEETS})
+
+
+_workbooks = {}
+
+
+def workbook_template(rows: int) -> str:
+    """The workbook of the given size with its sidecar index, made once per run"""
+
+    if rows not in _workbooks:
+        folder = TemporaryDirectory()
+        path = os.path.join(folder.name, 'data.xlsx')
+        synthetic_workbook(path, rows)
+        index = WorkbookIndex(path)
+        index.rebuild(SHEETS, 1, range(2, METERS + 2))
+        index.save()
+        _workbooks[rows] = (folder, path)
+    return _workbooks[rows][1]
+
+
+def excel_case(rows: int, mode: str):
+    from workers.mercury_worker import ExcelWriter
+
+    config['Excel']['write_mode'] = mode
+    folder = TemporaryDirectory()
+    template = workbook_template(rows)
+    path = os.path.join(folder.name, 'data.xlsx')
+    shutil.copy(template, path)
+    shutil.copy(WorkbookIndex(template).path, WorkbookIndex(path).path)
+    config['Mercury']['data_path'] = path
+    writer = ExcelWriter()
+    data = meter_data()
+    return lambda: writer.write_workbook_data(data, path), folder.cleanup
+
+
+@benchmark('excel.append', repeat=5, rows=[100, 1000, 10000])
+def excel_append(rows: int):
+    return excel_case(rows, 'append')
+
+
+@benchmark('excel.rewrite', repeat=3, rows=[100, 1000, 10000])
+def excel_rewrite(rows: int):
+    return excel_case(rows, 'rewrite')
+
+
+@benchmark('notepad.write_data', repeat=20, meters=[10, 1000])
+def notepad_write(meters: int):
+    from workers.mercury_worker import NotepadWriter
+
+    folder = TemporaryDirectory()
+    path = os.path.join(folder.name, 'data.txt')
+    data = meter_data(meters)
+    return lambda: NotepadWriter.write_data(data, path), folder.cleanup
+
+
+@benchmark('helper.get_cur_date', repeat=20)
+def helper_dates():
+    formats = ['dd.mm.yyyy', '_dd_mm', 'hh:mm']
+    return lambda: [Helper.get_cur_date(f) for _ in range(1000) for f in formats]
+
+
+@benchmark('helper.parse_file_path', repeat=20)
+def helper_paths():
+    paths = [f'C:\\Users\\operator\\Documents\\Data {n}\\meters_{n}.xlsx' for n in range(1000)]
+    return lambda: [Helper.parse_file_path(p) for p in paths]
+
+
+@benchmark('helper.convert_str_to_list', repeat=20, items=[100, 10000])
+def helper_lists(items: int):
+    string = json.dumps(list(range(items)))
+    return lambda: Helper.convert_str_to_list(string)
+
+
+@benchmark('sender.form_message', repeat=20, recipients=[10, 10000])
+def sender_message(recipients: int):
+    from notifications import Sender
+
+    config['NOTIFICATIONS']['tg_recipients'] = json.dumps([str(10 ** 9 + r) for r in range(recipients)])
+    programs = ['btctools', 'mercury'] * 50
+    return lambda: Sender('token').form_message(programs)
+
+
+def use_snapshot(program: str, snapshot: bool):
+    config[program]['snapshot'] = str(snapshot)
+
+
+@benchmark('flow.btctools', repeat=3, call_latency=[0.0, 0.001])
+def btctools_flow(call_latency: float, snapshot: bool = False):
+    from workers.btc_tool_worker import BtcToolsWorker
+
+    use_snapshot('BtcTools', snapshot)
+    return lambda: replay(lambda: btctools_app(0.05, call_latency=call_latency), BtcToolsWorker, lambda w: w.work())
+
+
+@benchmark('flow.btctools.snapshot', repeat=3, call_latency=[0.0, 0.001])
+def btctools_snapshot_flow(call_latency: float):
+    return btctools_flow(call_latency, snapshot=True)
+
+
+@benchmark('flow.mercury', repeat=3, call_latency=[0.0, 0.001])
+def mercury_flow(call_latency: float, snapshot: bool = False):
+    from workers.mercury_worker import MercuryWorker
+
+    use_snapshot('Mercury', snapshot)
+    folder = TemporaryDirectory()
+    readings = {m: {'reset_energy': float(m), 'previous_day': m / 2} for m in range(1, 11)}
+    config['Mercury']['meter_indexes'] = str(list(readings))
+    config['Mercury']['journal_path'] = os.path.join(folder.name, 'journal.jsonl')
+    return (lambda: replay(lambda: mercury_app(readings, 0.02, 0.02, call_latency=call_latency),
+                           MercuryWorker, lambda w: w.get_data()),
+            folder.cleanup)
+
+
+@benchmark('flow.mercury.snapshot', repeat=3, call_latency=[0.0, 0.001])
+def mercury_snapshot_flow(call_latency: float):
+    return mercury_flow(call_latency, snapshot=True)
+
+
+@benchmark('logging.emit', repeat=5, handler=['sync', 'queue', 'filtered', 'sync_slow_disk', 'queue_slow_disk'])
+def logging_emit(handler: str):
+    """
+    10000 records of a polling loop, the time spent by the polling thread:
+    sync - the rotating file handler in the thread, queue - the queue handler of logs.py,
+    filtered - debug records below the module level, slow_disk - every write takes 0.1 ms more
+    """
+
+    import logging
+    import time
+    from logging.handlers import QueueListener, RotatingFileHandler
+    from queue import SimpleQueue
+    from logs import RecordQueueHandler, ModuleLevels, TEXT_FORMAT
+
+    folder = TemporaryDirectory()
+    file = RotatingFileHandler(os.path.join(folder.name, 'app.log'), maxBytes=2 ** 20, backupCount=2)
+    if handler.endswith('slow_disk'):
+        emit_file = file.emit
+        file.emit = lambda record: (time.sleep(0.0001), emit_file(record))
+    file.setFormatter(logging.Formatter(TEXT_FORMAT))
+    logger = logging.getLogger(f'benchmark.{handler}')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    listener = None
+    if handler.startswith('sync'):
+        logger.addHandler(file)
+    else:
+        queue = SimpleQueue()
+        queue_handler = RecordQueueHandler(queue)
+        queue_handler.addFilter(ModuleLevels(logging.INFO, {}))
+        logger.addHandler(queue_handler)
+        listener = QueueListener(queue, file)
+        listener.start()
+    emit = logger.debug if handler == 'filtered' else logger.info
+
+    def run():
+        for i in range(10000):
+            emit(f'meter {i}: progress {i % 100}%, waiting for the value')
+
+    def cleanup():
+        if listener:
+            listener.stop()
+        for h in list(logger.handlers):
+            logger.removeHandler(h)
+        file.close()
+        folder.cleanup()
+
+    return run, cleanup
+
+
+@benchmark('consumption.report', repeat=5, meters=[30, 300])
+def consumption_report(meters: int):
+    """Reports over 5 years of daily readings, the history is taken as from the cache"""
+
+    import numpy as np
+    from workers.consumption import ConsumptionHistory, Series
+
+    rng = np.random.default_rng(1)
+    days = 5 * 365
+    dates = np.datetime64('2000-01-01') + np.arange(days)
+    values = np.cumsum(rng.uniform(10, 500, (days, meters)), axis=0)
+    history = ConsumptionHistory({'reset_energy': Series(dates, np.arange(meters).astype(str), values)})
+    return history.report
@@ -0,0 +1,82 @@
+"""
+Replay of the BtcTools and Mercury flows against the fake UI driver.
+waited - time spent in the step waits (the scripted application processes and their detection),
+call latency - simulated latency of the control calls and lookups (inside and outside the waits),
+overhead - wall time outside the waits, with zero call latency it is the cost of the orchestration itself
+snapshot - the wait loops read the controls from one capture of the dialog per check
+run from the src folder: python -m benchmarks.worker_flows --meters 20 --call-latency 0.001 --snapshot
+"""
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from drivers import set_driver
+from drivers.fake import FakeDriver, btctools_app, mercury_app
+from service import config
+import argparse
+import os
+
+FAKE_CONFIG = {
+    'BtcTools': {'program_path': 'C:\\BTCTools\\BTCTools.exe', 'launch_type': 'normal', 'data_folder': 'data',
+                 'wait_interval': '0.01', 'wait_max_interval': '0.05', 'wait_timeout': '30'},
+    'Mercury': {'program_path': 'C:\\Mercury\\Mercury.exe', 'launch_type': 'normal', 'meter_indexes': '[]',
+                'wait_interval': '0.01', 'wait_max_interval': '0.05', 'wait_timeout': '30'},
+    'SUPERVISOR': {'enabled': '0'}
+}
+
+
+def replay(app_factory, worker_cls, flow) -> dict:
+    apps = []
+    program_path = FAKE_CONFIG[worker_cls.__name__.replace('Worker', '')]['program_path']
+    set_driver(FakeDriver({program_path: lambda: apps.append(app_factory()) or apps[-1]}))
+    started = perf_counter()
+    worker = worker_cls()
+    flow(worker)
+    wall = perf_counter() - started
+    app = apps[0]
+    waits = worker.steps.profile()
+    waited = sum(step['total'] for step in waits.values())
+    return {
+        'wall': round(wall, 3),
+        'waited': round(waited, 3),
+        'call_latency': round(app.simulated, 3),
+        'overhead': round(wall - waited, 3),
+        'calls': app.calls,
+        'lookups': app.lookups,
+        'waits': waits
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--meters', type=int, default=10)
+    parser.add_argument('--call-latency', type=float, default=0.0)
+    parser.add_argument('--lookup-latency', type=float, default=0.0)
+    parser.add_argument('--process-time', type=float, default=0.05, help='scan, connect and read time')
+    parser.add_argument('--snapshot', action='store_true')
+    args = parser.parse_args()
+
+    from workers.btc_tool_worker import BtcToolsWorker
+    from workers.mercury_worker import MercuryWorker
+
+    config.read_dict(FAKE_CONFIG)
+    for program in ('BtcTools', 'Mercury'):
+        config[program]['snapshot'] = str(args.snapshot)
+    latency = {'call_latency': args.call_latency, 'lookup_latency': args.lookup_latency}
+    readings = {m: {'reset_energy': float(m), 'previous_day': m / 2} for m in range(1, args.meters + 1)}
+    config['Mercury']['meter_indexes'] = str(list(readings))
+
+    btctools = replay(lambda: btctools_app(args.process_time, **latency),
+                      BtcToolsWorker, lambda w: w.work())
+    with TemporaryDirectory() as folder:
+        config['Mercury']['journal_path'] = os.path.join(folder, 'journal.jsonl')
+        mercury = replay(lambda: mercury_app(readings, args.process_time, args.process_time, **latency),
+                         MercuryWorker, lambda w: w.get_data())
+
+    for name, r in (('btctools', btctools), ('mercury', mercury)):
+        print(f"{name}: wall {r['wall']} s, waited {r['waited']} s, call latency {r['call_latency']} s, "
+              f"overhead {r['overhead']} s, "
+              f"{r['calls']} calls, {r['lookups']} lookups")
+        print(f"  waits: {r['waits']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+from .base import UiDriver
+
+_driver = None
+
+
+def get_driver() -> UiDriver:
+    """UI driver of the process: pywinauto with 'backend' of the [DRIVER] config section (uia by default)"""
+
+    global _driver
+    if _driver is None:
+        from service import config
+        backend = config['DRIVER'].get('backend', 'uia') if config.has_section('DRIVER') else 'uia'
+        from .pywinauto_driver import PywinautoDriver
+        _driver = PywinautoDriver(backend)
+    return _driver
+
+
+def set_driver(driver: UiDriver):
+    """Replace the UI driver, e.g. with the fake one for headless runs and benchmarks"""
+
+    global _driver
+    _driver = driver
@@ -0,0 +1,45 @@
+from .snapshot import UiSnapshot, ControlState
+
+
+class UiDriver:
+    """
+    Interface between the workers and the UI automation library.
+    An application object returned by the driver supports app['Dialog'], kill() and is_process_running(),
+    dialogs and controls follow the pywinauto window specification methods used by the workers
+    """
+
+    # exceptions of the failed program start
+    start_errors: tuple = ()
+
+    def start(self, command: str):
+        raise NotImplementedError
+
+    def connect(self, path: str):
+        """Connect to the running program, the driver start error is raised if it isn't running"""
+        raise NotImplementedError
+
+    def try_connect(self, path: str):
+        """Connect to the running program, None if it isn't running"""
+
+        try:
+            return self.connect(path)
+        except self.start_errors + (FileNotFoundError,):
+            return None
+
+    def element_key(self, wrapper):
+        """Identity of the control, the key of its state in the snapshots"""
+        return getattr(wrapper, 'handle', None) or id(wrapper)
+
+    def capture(self, dialog) -> UiSnapshot:
+        """
+        Snapshot of the dialog subtree. This generic walk reads every control separately,
+        the drivers override it with one batched call
+        """
+
+        wrapper = dialog.wrapper_object() if hasattr(dialog, 'wrapper_object') else dialog
+        controls = {}
+        for element in wrapper.descendants():
+            controls[self.element_key(element)] = ControlState(element.element_info.name,
+                                                               element.element_info.control_type,
+                                                               element.window_text(), element.is_enabled())
+        return UiSnapshot(controls)
@@ -0,0 +1,280 @@
+from time import monotonic, sleep
+from threading import Lock
+from .base import UiDriver
+from .snapshot import UiSnapshot, ControlState
+
+
+class FakeStartError(Exception):
+    pass
+
+
+class ElementNotFound(Exception):
+    pass
+
+
+def _value(value):
+    return value() if callable(value) else value
+
+
+class FakeControl:
+    """
+    In-memory control. text, visible and enabled can be callables to script their changes in time,
+    on_click(control) is called by the clicks
+    """
+
+    def __init__(self, dialog, name: str, text='', visible=True, enabled=True, on_click=None):
+        self.dialog = dialog
+        self.name = name
+        self.text = text
+        self.visible = visible
+        self.enabled = enabled
+        self.on_click = on_click
+        self.handle = id(self)
+
+    def __check(self):
+        self.dialog.app.call()
+        if not _value(self.visible):
+            raise ElementNotFound(f'{self.name} not found')
+
+    def exists(self, timeout=None, retry_interval=None) -> bool:
+        self.dialog.app.call()
+        return bool(_value(self.visible))
+
+    def wrapper_object(self):
+        self.dialog.app.lookup()
+        self.__check()
+        return self
+
+    def window_text(self) -> str:
+        self.__check()
+        return str(_value(self.text))
+
+    def is_enabled(self) -> bool:
+        self.__check()
+        return bool(_value(self.enabled))
+
+    def click_input(self, *args, **kwargs):
+        self.__check()
+        if self.on_click:
+            self.on_click(self)
+
+    click = click_input
+
+    def set_text(self, text: str):
+        self.__check()
+        self.text = text
+
+    def type_keys(self, keys: str, *args, **kwargs):
+        self.__check()
+        self.text = f'{_value(self.text)}{keys}'
+
+
+class FakeDialog(FakeControl):
+    """Dialog with controls added by add(), other controls don't exist"""
+
+    def __init__(self, app, name: str):
+        self.app = app
+        super().__init__(self, name)
+        self.controls = {}
+
+    def add(self, name: str, **kwargs) -> FakeControl:
+        self.controls[name] = FakeControl(self, name, **kwargs)
+        return self.controls[name]
+
+    def __getitem__(self, name: str) -> FakeControl:
+        if name not in self.controls:
+            return FakeControl(self, name, visible=False)
+        return self.controls[name]
+
+    def __getattr__(self, name: str) -> FakeControl:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def child_window(self, **criteria) -> FakeControl:
+        return self[criteria.get('best_match') or criteria.get('title')]
+
+    def capture(self) -> UiSnapshot:
+        """States of the visible controls for the cost of one call"""
+
+        self.app.call()
+        return UiSnapshot({control.handle: ControlState(name, name, str(_value(control.text)), bool(_value(control.enabled)))
+                           for name, control in self.controls.items() if _value(control.visible)})
+
+
+class FakeApplication:
+    """
+    Simulated application
+    :param call_latency: seconds of every control call, as a cross-process UIA call
+    :param lookup_latency: seconds of every control search
+    """
+
+    def __init__(self, call_latency: float = 0.0, lookup_latency: float = 0.0):
+        self.call_latency = call_latency
+        self.lookup_latency = lookup_latency
+        self.dialogs = {}
+        self.running = True
+        self.calls = 0
+        self.lookups = 0
+        self.simulated = 0.0
+        self._lock = Lock()
+
+    def __delay(self, seconds: float):
+        if seconds:
+            sleep(seconds)
+            with self._lock:
+                self.simulated += seconds
+
+    def call(self):
+        self.calls += 1
+        self.__delay(self.call_latency)
+
+    def lookup(self):
+        self.lookups += 1
+        self.__delay(self.lookup_latency)
+
+    def __getitem__(self, name: str) -> FakeDialog:
+        if name not in self.dialogs:
+            self.dialogs[name] = FakeDialog(self, name)
+        return self.dialogs[name]
+
+    def kill(self):
+        self.running = False
+
+    def is_process_running(self) -> bool:
+        return self.running
+
+
+class FakeDriver(UiDriver):
+    """
+    Driver of simulated applications
+    :param apps: {program path or file name: factory returning FakeApplication}
+    """
+
+    start_errors = (FakeStartError,)
+
+    def __init__(self, apps: dict, start_latency: float = 0.0):
+        self.apps = apps
+        self.start_latency = start_latency
+        self.running = {}
+
+    def __key(self, command: str) -> str:
+        for key in self.apps:
+            if command == key or command.endswith(key) or key.endswith(command):
+                return key
+        raise FakeStartError(f'{command} not found')
+
+    def start(self, command: str) -> FakeApplication:
+        key = self.__key(command)
+        sleep(self.start_latency)
+        self.running[key] = self.apps[key]()
+        return self.running[key]
+
+    def connect(self, path: str) -> FakeApplication:
+        app = self.running.get(self.__key(path))
+        if app is None or not app.running:
+            raise FakeStartError(f'{path} is not running')
+        return app
+
+    def element_key(self, wrapper):
+        return wrapper.handle
+
+    def capture(self, dialog) -> UiSnapshot:
+        return dialog.capture()
+
+
+def btctools_app(scan_time: float = 1.0, data_folder: str = 'data', **latency) -> FakeApplication:
+    """BtcTools main window: the scan progress reaches 100% in scan_time seconds after the Scan click"""
+
+    app = FakeApplication(**latency)
+    dlg = app['Dialog']
+    state = {'started': None, 'confirmed': False}
+
+    def percent() -> int:
+        if state['started'] is None:
+            return 0
+        return min(100, int((monotonic() - state['started']) / scan_time * 100)) if scan_time else 100
+
+    def scan(_):
+        state.update(started=monotonic(), confirmed=False)
+
+    def confirm(_):
+        state['confirmed'] = True
+
+    no_button = dlg.add('NoButton')
+    no_button.on_click = lambda control: setattr(control, 'visible', False)
+    dlg.add('ScanButton', on_click=scan)
+    dlg.add('Progress', text=lambda: f'{percent()}%')
+    dlg.add('Dialog', visible=lambda: percent() >= 100 and not state['confirmed'])
+    dlg.add('OKButton', on_click=confirm)
+    dlg.add('ExportButton', enabled=lambda: percent() >= 100)
+    for name in ('Header5', data_folder, 'ComboBox0', 'SaveButton', 'YesButton'):
+        dlg.add(name)
+    return app
+
+
+def mercury_app(readings: dict, connect_time: float = 0.5, read_time: float = 0.5, fields: dict | None = None,
+                **latency) -> FakeApplication:
+    """
+    Mercury main window
+    :param readings: {meter: {value type: value}}, the connection to other meters fails
+    :param fields: {value type: (radio button, value field)}
+    """
+
+    fields = fields or {'reset_energy': ('RadioButton0', 'Static86'), 'previous_day': ('RadioButton10', 'Static74')}
+    app = FakeApplication(**latency)
+    dlg = app['Dialog']
+    state = {'connect': None, 'meter': None, 'connected': None, 'type': None, 'read': None}
+
+    def connecting() -> float:
+        return (monotonic() - state['connect']) / connect_time if state['connect'] and connect_time else 1.0
+
+    def progress() -> str:
+        if state['connect'] is None:
+            return '0%'
+        limit = 100 if state['meter'] in readings else 50
+        return f'{min(limit, int(connecting() * 100))}%'
+
+    def connect(_):
+        try:
+            state['meter'] = int(_value(dlg['СчетчикEdit'].text))
+        except ValueError:
+            state['meter'] = None
+        state.update(connect=monotonic(), connected=None)
+
+    def data_link(_):
+        if state['meter'] in readings and connecting() >= 1:
+            state['connected'] = state['meter']
+
+    def select(value_type):
+        return lambda _: state.update(type=value_type)
+
+    def read(_):
+        state['read'] = (monotonic(), state['type'])
+
+    def field_text(value_type):
+        def text():
+            if not state['read'] or state['read'][1] != value_type or state['connected'] is None:
+                return ''
+            if monotonic() - state['read'][0] < read_time:
+                return ''
+            return readings[state['connected']][value_type]
+        return text
+
+    def close_error(_):
+        state['connect'] = None
+
+    dlg.add('Параметры связиHyperlink')
+    dlg.add('СчетчикEdit')
+    dlg.add('Уровень доступаEdit')
+    dlg.add('\xa0Соединить\xa0', on_click=connect)
+    dlg.add('Static3', text=progress)
+    dlg.add('Ошибка!', visible=lambda: state['connect'] is not None and state['meter'] not in readings
+            and connecting() >= 1)
+    dlg.add('OKButton', on_click=close_error)
+    dlg.add('Hyperlink9', on_click=data_link)
+    dlg.add('Button1', on_click=read)
+    for value_type, (button, field) in fields.items():
+        dlg.add(button, on_click=select(value_type))
+        dlg.add(field, text=field_text(value_type))
+    return app
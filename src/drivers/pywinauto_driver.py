@@ -0,0 +1,56 @@
+from pywinauto.application import Application, AppStartError, ProcessNotFoundError
+from pywinauto.findbestmatch import MatchError
+from .base import UiDriver
+from .snapshot import UiSnapshot, ControlState
+
+# UI Automation property ids
+RUNTIME_ID = 30000
+CONTROL_TYPE = 30003
+NAME = 30005
+IS_ENABLED = 30010
+VALUE = 30045
+
+
+class PywinautoDriver(UiDriver):
+
+    start_errors = (AppStartError, ProcessNotFoundError, MatchError)
+
+    def __init__(self, backend: str = 'uia'):
+        self.backend = backend
+
+    def start(self, command: str) -> Application:
+        return Application(backend=self.backend).start(command)
+
+    def connect(self, path: str) -> Application:
+        return Application(backend=self.backend).connect(path=path)
+
+    def element_key(self, wrapper):
+        if self.backend == 'uia':
+            return tuple(wrapper.element_info.runtime_id)
+        return wrapper.handle
+
+    def capture(self, dialog) -> UiSnapshot:
+        """UIA: the properties of the whole subtree are fetched by one FindAllBuildCache call"""
+
+        if self.backend != 'uia':
+            return super().capture(dialog)
+
+        from pywinauto.uia_defines import IUIA
+
+        uia = IUIA()
+        request = uia.iuia.CreateCacheRequest()
+        for property_id in (RUNTIME_ID, CONTROL_TYPE, NAME, IS_ENABLED, VALUE):
+            request.AddProperty(property_id)
+        wrapper = dialog.wrapper_object()
+        elements = wrapper.element_info.element.FindAllBuildCache(uia.tree_scope['descendants'],
+                                                                  uia.true_condition, request)
+        controls = {}
+        for i in range(elements.Length):
+            element = elements.GetElement(i)
+            name = element.GetCachedPropertyValue(NAME)
+            # edit controls keep their text in the value, the other controls in the name
+            value = element.GetCachedPropertyValue(VALUE)
+            controls[tuple(element.GetCachedPropertyValue(RUNTIME_ID))] = ControlState(
+                name, element.GetCachedPropertyValue(CONTROL_TYPE), value or name,
+                bool(element.GetCachedPropertyValue(IS_ENABLED)))
+        return UiSnapshot(controls)
@@ -0,0 +1,50 @@
+from collections import namedtuple
+from time import monotonic
+
+ControlState = namedtuple('ControlState', 'name control_type text enabled')
+
+
+class SnapshotDiff:
+
+    def __init__(self, added: set, removed: set, changed: set):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    @property
+    def structural(self) -> bool:
+        """Controls appeared or disappeared, e.g. a pop-up window was shown"""
+        return bool(self.added or self.removed)
+
+    def __repr__(self):
+        return f'SnapshotDiff(added={len(self.added)}, removed={len(self.removed)}, changed={len(self.changed)})'
+
+
+class UiSnapshot:
+    """
+    State of the controls of a dialog subtree taken in one walk, {element key: ControlState}.
+    The element key is the identity of the control given by the driver (runtime id or handle)
+    """
+
+    def __init__(self, controls: dict, taken_at: float | None = None):
+        self.controls = controls
+        self.taken_at = monotonic() if taken_at is None else taken_at
+
+    def __contains__(self, key) -> bool:
+        return key in self.controls
+
+    def __len__(self) -> int:
+        return len(self.controls)
+
+    def get(self, key) -> ControlState | None:
+        return self.controls.get(key)
+
+    def diff(self, previous: 'UiSnapshot | None') -> SnapshotDiff:
+        if previous is None:
+            return SnapshotDiff(set(self.controls), set(), set())
+        keys, previous_keys = self.controls.keys(), previous.controls.keys()
+        changed = {key for key in keys & previous_keys if self.controls[key] != previous.controls[key]}
+        return SnapshotDiff(keys - previous_keys, previous_keys - keys, changed)
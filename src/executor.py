@@ -0,0 +1,178 @@
+from contextvars import copy_context
+from threading import Lock
+from time import perf_counter
+from service import log, config, get_logger, ERRORS
+from tracing import tracer
+from supervisor import get_supervisor
+
+
+_sessions = None
+_sessions_lock = Lock()
+
+
+def session_pool():
+    """Session pool of the current process, None if the sessions are not kept alive"""
+
+    global _sessions
+    # the threads of the pool ask for it at the same time, only one pool is created
+    with _sessions_lock:
+        if _sessions is None:
+            from app_context import SessionPool
+            _sessions = SessionPool.from_config() or False
+    return _sessions or None
+
+
+def close_session_pool():
+    """Close the applications kept alive by the session pool, if the pool was created"""
+
+    if _sessions:
+        _sessions.close()
+
+
+def init_com():
+    """Initialize COM in a pool thread, pywinauto's UIA backend calls COM from the thread that runs the worker"""
+
+    try:
+        import pythoncom
+    except ImportError:
+        # not Windows, there is no COM
+        return
+    import sys
+    # the apartment model chosen by pywinauto for the main thread
+    pythoncom.CoInitializeEx(getattr(sys, 'coinit_flags', pythoncom.COINIT_APARTMENTTHREADED))
+
+
+def run_program(program_name: str, focus_lock=None) -> dict:
+    """
+    Run one automation program in the current thread or process
+    :param program_name: key of the program in config['AUTOMATIONS']
+    :param focus_lock: lock shared by concurrently running workers for the foreground input
+    :return: program result with its duration, the spans recorded in a pool process are returned with it
+    """
+
+    from multiprocessing import parent_process
+    from app_context import WithAppRunner
+    from workers.app_worker import AppWorker
+
+    get_logger(config)
+    if focus_lock is not None:
+        AppWorker.focus_lock = focus_lock
+
+    started = perf_counter()
+    result, error = False, None
+    supervisor = get_supervisor()
+    with tracer.span('program', program=program_name):
+        if supervisor and not supervisor.allow(f'app.{program_name}'):
+            error = ERRORS.get('circuit_skipped').format(key=f'app.{program_name}')
+            log.warning(error)
+        else:
+            try:
+                runner = WithAppRunner(program_name, session_pool())
+                with runner as application:
+                    if application:
+                        runner.succeeded = result = bool(application.work())
+            except Exception as e:
+                log.exception(f'{program_name}: automation exception: {e}')
+                error = repr(e)
+            if supervisor:
+                supervisor.outcome(f'app.{program_name}', result)
+                supervisor.save()
+        if not result:
+            tracer.fail(error or 'automation failed')
+
+    result = {'program': program_name, 'result': result, 'duration': perf_counter() - started, 'error': error}
+    if parent_process() is not None:
+        result['spans'] = tracer.pop_spans()
+    return result
+
+
+class ExecutionReport:
+
+    def __init__(self, results: list[dict], duration: float):
+        self.results = results
+        self.duration = duration
+
+    @property
+    def failed(self) -> list:
+        return [r['program'] for r in self.results if not r['result']]
+
+    def summary(self) -> str:
+        lines = [f"{'program':<15}{'result':<10}{'duration, s':>12}"]
+        for r in self.results:
+            lines.append(f"{r['program']:<15}{'ok' if r['result'] else 'failed':<10}{r['duration']:>12.1f}")
+        lines.append(f"{'total':<25}{self.duration:>12.1f}")
+        return '\n'.join(lines)
+
+
+class ProgramExecutor:
+    """
+    Runs automation programs one after another or in a thread/process pool.
+    Only programs listed as 'parallel' run concurrently, the rest run alone after them.
+    """
+
+    MODES = ('sequential', 'thread', 'process')
+
+    def __init__(self, mode: str = 'sequential', max_workers: int = 1, parallel=(), runner=run_program):
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown execution mode {mode}, expected one of {self.MODES}')
+        self.mode = mode
+        self.max_workers = max(1, max_workers)
+        self.parallel = set(parallel)
+        self.runner = runner
+
+    @classmethod
+    def from_config(cls, configuration, runner=run_program):
+        if not configuration.has_section('EXECUTION'):
+            return cls(runner=runner)
+        conf = configuration['EXECUTION']
+        return cls(mode=conf.get('mode', 'sequential'),
+                   max_workers=conf.getint('max_workers', fallback=1),
+                   parallel=configuration.json_list('EXECUTION', 'parallel'),
+                   runner=runner)
+
+    def execute(self, programs: list) -> ExecutionReport:
+        with tracer.span('execute', mode=self.mode, programs=len(programs)):
+            return self.__execute(programs)
+
+    def __execute(self, programs: list) -> ExecutionReport:
+        started = perf_counter()
+        concurrent = [p for p in programs if p in self.parallel]
+        if self.mode == 'sequential' or self.max_workers == 1 or len(concurrent) < 2:
+            concurrent = []
+
+        results = {}
+        if concurrent:
+            results.update(self.__run_pool(concurrent))
+        for program in programs:
+            if program not in results:
+                results[program] = self.runner(program)
+
+        report = ExecutionReport([results[p] for p in programs], perf_counter() - started)
+        log.info(f'Execution report:\n{report.summary()}')
+        return report
+
+    def __run_pool(self, programs: list) -> dict:
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        from multiprocessing import Manager
+
+        workers = min(self.max_workers, len(programs))
+        if self.mode == 'process':
+            with Manager() as manager, ProcessPoolExecutor(workers) as pool:
+                return self.__collect(pool, programs, manager.RLock())
+        with ThreadPoolExecutor(workers, initializer=init_com) as pool:
+            return self.__collect(pool, programs, None)
+
+    def __collect(self, pool, programs: list, focus_lock) -> dict:
+        if self.mode == 'process':
+            futures = {p: pool.submit(self.runner, p, focus_lock) for p in programs}
+        else:
+            futures = {p: pool.submit(copy_context().run, self.runner, p, focus_lock) for p in programs}
+        results = {}
+        for program, future in futures.items():
+            try:
+                results[program] = future.result()
+                tracer.adopt(results[program].pop('spans', []))
+            except Exception as e:
+                log.exception(f'{program}: execution exception: {e}')
+                results[program] = {'program': program, 'result': False, 'duration': 0.0, 'error': repr(e)}
+        return results
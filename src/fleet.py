@@ -0,0 +1,409 @@
+"""
+Fleet mode: one coordinator hands out the automation jobs to the agents of the plants over HTTP
+and collects their results, FLEET section of config.ini:
+    role = coordinator | agent
+    token = <shared secret>                       - X-Fleet-Token header of every request, optional
+  coordinator:
+    host = 0.0.0.0, port = 8470
+    plants = ["plant1", "plant2"]                 - expected plants, a plant without agents is reported as failed
+    results_path = fleet_results.jsonl            - results and timings of all jobs
+    round_timeout = 7200, agent_timeout = 60      - seconds of one run / since the last request of a live agent
+  agent:
+    url = http://coordinator:8470
+    name = plant1-pc1, plant = plant1, capacity = 1, poll_interval = 5
+The agent runs the programs enabled in its own AUTOMATIONS section, only the programs of EXECUTION 'parallel'
+run at the same time, every job is traced to the agent's run log and its spans are sent with the result. Jobs of a plant are leased to the agents
+of that plant only, the least loaded agent by its capacity gets the job first.
+Protocol (json bodies): POST /register, POST /lease, POST /result, GET /status
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Event, Thread
+from itertools import count
+from time import time, perf_counter
+from service import log
+from tracing import tracer
+import json
+
+TOKEN_HEADER = 'X-Fleet-Token'
+
+
+class FleetError(Exception):
+    pass
+
+
+class Coordinator:
+    """
+    Job queue of the fleet. execute() creates the jobs of one run for all live plants and waits for their results,
+    the agents take the jobs by lease() and report them by result().
+    Jobs of an agent that stopped calling are queued again once, then they are failed
+    """
+
+    def __init__(self, plants=(), results_path: str | None = 'fleet_results.jsonl', agent_timeout: float = 60.0,
+                 round_timeout: float = 7200.0, clock=time):
+        self.plants = list(plants)
+        self.results_path = results_path
+        self.agent_timeout = agent_timeout
+        self.round_timeout = round_timeout
+        self.clock = clock
+        self.agents = {}
+        self.jobs = {}
+        self._ids = count(1)
+        self._changed = Condition()
+
+    @classmethod
+    def from_config(cls, configuration):
+        conf = configuration['FLEET']
+        return cls(plants=configuration.json_list('FLEET', 'plants'),
+                   results_path=conf.get('results_path', 'fleet_results.jsonl'),
+                   agent_timeout=conf.getfloat('agent_timeout', fallback=60.0),
+                   round_timeout=conf.getfloat('round_timeout', fallback=7200.0))
+
+    def register(self, agent: str, plant: str, programs: list, capacity: int = 1) -> dict:
+        with self._changed:
+            running = self.agents.get(agent, {}).get('running', set())
+            self.agents[agent] = {'plant': plant, 'programs': list(programs), 'capacity': max(1, int(capacity)),
+                                  'seen': self.clock(), 'running': running}
+        log.info(f'Fleet: agent {agent} of {plant} is registered, capacity {capacity}, programs {programs}')
+        return {'registered': agent}
+
+    def __alive(self, agent: dict) -> bool:
+        return self.clock() - agent['seen'] < self.agent_timeout
+
+    @staticmethod
+    def __load(agent: dict) -> float:
+        return len(agent['running']) / agent['capacity']
+
+    def __eligible(self, job: dict, agent: dict) -> bool:
+        return agent['plant'] == job['plant'] and job['program'] in agent['programs'] and self.__alive(agent)
+
+    def __expire(self):
+        """Queue again the jobs of the lost agents"""
+
+        for name, agent in self.agents.items():
+            if agent['running'] and not self.__alive(agent):
+                for job_id in list(agent['running']):
+                    job = self.jobs[job_id]
+                    if job['attempts'] < 2:
+                        log.warning(f"Fleet: agent {name} is lost, {job['plant']}/{job['program']} is queued again")
+                        job.update(state='queued', agent=None)
+                    else:
+                        self.__finish(job, {'result': False, 'error': f'agent {name} is lost'})
+                agent['running'] = set()
+
+    def lease(self, agent: str, free: int) -> dict:
+        """
+        Jobs for the agent, also its heartbeat. A job is left for another agent of the plant
+        if that agent has a free slot and a lower load
+        """
+
+        with self._changed:
+            if agent not in self.agents:
+                raise FleetError(f'Agent {agent} is not registered')
+            me = self.agents[agent]
+            me['seen'] = self.clock()
+            self.__expire()
+            leased = []
+            for job in self.jobs.values():
+                if free <= 0:
+                    break
+                if job['state'] != 'queued' or not self.__eligible(job, me):
+                    continue
+                others = [a for name, a in self.agents.items() if name != agent and self.__eligible(job, a)
+                          and len(a['running']) < a['capacity']]
+                if any(self.__load(a) < self.__load(me) for a in others):
+                    continue
+                job.update(state='leased', agent=agent, leased_at=self.clock(), attempts=job['attempts'] + 1)
+                me['running'].add(job['id'])
+                leased.append({'id': job['id'], 'program': job['program']})
+                free -= 1
+            return {'jobs': leased}
+
+    def result(self, agent: str, job_id: int, result: bool, duration: float, error: str | None = None,
+               spans: list | None = None) -> dict:
+        """:param spans: timing spans of the job recorded by the agent, added to the run of the coordinator"""
+
+        with self._changed:
+            job = self.jobs.get(job_id)
+            if job is None or job['state'] == 'done':
+                return {'accepted': False}
+            job['agent'] = agent
+            self.__finish(job, {'result': bool(result), 'duration': duration, 'error': error, 'spans': spans or []})
+            return {'accepted': True}
+
+    def __finish(self, job: dict, outcome: dict):
+        job.update(state='done', finished_at=self.clock(), **outcome)
+        for agent in self.agents.values():
+            agent['running'].discard(job['id'])
+        self._changed.notify_all()
+
+    def plan(self, programs: list | None = None) -> dict:
+        """{plant: programs} of the run: the programs of the live agents of every plant"""
+
+        plan = {plant: [] for plant in self.plants}
+        for agent in self.agents.values():
+            if self.__alive(agent):
+                plant = plan.setdefault(agent['plant'], [])
+                for program in agent['programs']:
+                    if program not in plant and (not programs or program in programs):
+                        plant.append(program)
+        return plan
+
+    def execute(self, programs: list | None = None, timeout: float | None = None):
+        """
+        Run the programs on all plants and wait for the results
+        :param programs: programs to run, default - all programs of the agents
+        :return: ExecutionReport with the 'plant/program' names
+        """
+
+        from executor import ExecutionReport
+
+        started = perf_counter()
+        deadline = self.clock() + (timeout or self.round_timeout)
+        with self._changed:
+            run_jobs = []
+            for plant, plant_programs in self.plan(programs).items():
+                if not plant_programs:
+                    log.warning(f'Fleet: no live agents of {plant}')
+                    job = self.__job(plant, '*')
+                    self.__finish(job, {'result': False, 'error': 'no live agents'})
+                    run_jobs.append(job)
+                run_jobs.extend(self.__job(plant, program) for program in plant_programs)
+
+            while not all(job['state'] == 'done' for job in run_jobs):
+                self.__expire()
+                if (left := deadline - self.clock()) <= 0:
+                    break
+                self._changed.wait(min(left, self.agent_timeout / 2))
+
+            for job in run_jobs:
+                if job['state'] != 'done':
+                    self.__finish(job, {'result': False, 'error': f"timeout in the state {job['state']}"})
+                self.jobs.pop(job['id'])
+                tracer.adopt(job.pop('spans', []))
+
+        self.save(run_jobs)
+        results = [{'program': f"{job['plant']}/{job['program']}", 'result': job['result'],
+                    'duration': job.get('duration') or 0.0, 'error': job.get('error'), 'agent': job['agent']}
+                   for job in run_jobs]
+        report = ExecutionReport(results, perf_counter() - started)
+        log.info(f'Fleet execution report:\n{report.summary()}')
+        return report
+
+    def __job(self, plant: str, program: str) -> dict:
+        job = {'id': next(self._ids), 'plant': plant, 'program': program, 'state': 'queued', 'agent': None,
+               'attempts': 0, 'queued_at': self.clock()}
+        self.jobs[job['id']] = job
+        return job
+
+    def save(self, jobs: list):
+        if not self.results_path:
+            return
+        with open(self.results_path, 'a', encoding='utf-8') as f:
+            for job in jobs:
+                f.write(json.dumps(job, ensure_ascii=False) + '\n')
+
+    def status(self) -> dict:
+        with self._changed:
+            return {
+                'agents': {name: {**agent, 'running': sorted(agent['running']), 'alive': self.__alive(agent)}
+                           for name, agent in self.agents.items()},
+                'jobs': list(self.jobs.values())
+            }
+
+    def serve(self, host: str = '0.0.0.0', port: int = 8470, token: str | None = None) -> ThreadingHTTPServer:
+        """Start the HTTP server in a background thread, server.server_address gives the bound port"""
+
+        server = ThreadingHTTPServer((host, port), handler_class(self, token))
+        Thread(target=server.serve_forever, name='fleet-coordinator', daemon=True).start()
+        log.info(f'Fleet coordinator is listening on {server.server_address[0]}:{server.server_address[1]}')
+        return server
+
+
+def handler_class(coordinator: Coordinator, token: str | None):
+
+    class FleetHandler(BaseHTTPRequestHandler):
+
+        routes = {
+            '/register': lambda body: coordinator.register(body['agent'], body['plant'], body['programs'],
+                                                           body.get('capacity', 1)),
+            '/lease': lambda body: coordinator.lease(body['agent'], body.get('free', 1)),
+            '/result': lambda body: coordinator.result(body['agent'], body['job'], body['result'],
+                                                       body.get('duration', 0.0), body.get('error'),
+                                                       body.get('spans'))
+        }
+
+        def reply(self, status: int, data: dict):
+            content = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def authorized(self) -> bool:
+            if token and self.headers.get(TOKEN_HEADER) != token:
+                self.reply(403, {'error': 'forbidden'})
+                return False
+            return True
+
+        def do_GET(self):
+            if not self.authorized():
+                return
+            if self.path == '/status':
+                return self.reply(200, coordinator.status())
+            self.reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if not self.authorized():
+                return
+            if self.path not in self.routes:
+                return self.reply(404, {'error': 'not found'})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                self.reply(200, self.routes[self.path](body))
+            except FleetError as e:
+                self.reply(409, {'error': str(e)})
+            except (KeyError, ValueError) as e:
+                self.reply(400, {'error': repr(e)})
+
+        def log_message(self, format, *args):
+            log.debug(f'Fleet request {self.address_string()}: {format % args}')
+
+    return FleetHandler
+
+
+class Agent:
+    """
+    Runs the jobs of the coordinator by the runner, executor.run_program by default.
+    As in ProgramExecutor, only the 'parallel' programs run at the same time, up to 'capacity' of them,
+    the rest run alone. The agent registers again if the coordinator was restarted
+    """
+
+    def __init__(self, url: str, name: str, plant: str, programs: list, capacity: int = 1,
+                 poll_interval: float = 5.0, token: str | None = None, runner=None, timeout: float = 10.0,
+                 parallel=(), run_log: str | None = None):
+        import requests
+
+        self.url = url.rstrip('/')
+        self.name = name
+        self.plant = plant
+        self.programs = list(programs)
+        self.capacity = max(1, capacity)
+        self.poll_interval = poll_interval
+        self.runner = runner
+        self.timeout = timeout
+        self.session = requests.Session()
+        if token:
+            self.session.headers[TOKEN_HEADER] = token
+        self.parallel = set(parallel)
+        self.run_log = run_log
+        self.running = set()
+        self.completed = 0
+        self._stop = Event()
+        # jobs being run and the leased jobs that run alone
+        self._slots = Condition()
+        self._active = 0
+        self._alone = 0
+
+    @classmethod
+    def from_config(cls, configuration, programs: list, runner=None):
+        conf = configuration['FLEET']
+        return cls(conf['url'], conf['name'], conf['plant'], programs,
+                   capacity=conf.getint('capacity', fallback=1),
+                   poll_interval=conf.getfloat('poll_interval', fallback=5.0),
+                   token=conf.get('token'), runner=runner,
+                   parallel=configuration.json_list('EXECUTION', 'parallel'),
+                   run_log=configuration.get('TRACING', 'run_log', fallback='run_log.jsonl'))
+
+    def post(self, path: str, data: dict) -> dict:
+        response = self.session.post(f'{self.url}{path}', json=data, timeout=self.timeout)
+        if response.status_code == 409:
+            raise FleetError(response.json().get('error'))
+        response.raise_for_status()
+        return response.json()
+
+    def register(self):
+        self.post('/register', {'agent': self.name, 'plant': self.plant, 'programs': self.programs,
+                                'capacity': self.capacity})
+
+    def run_job(self, job: dict) -> dict:
+        if self.runner is None:
+            from executor import run_program
+            self.runner = run_program
+        spans = []
+        with tracer.run('fleet.job', self.run_log, spans):
+            tracer.annotate(job=job['id'], program=job['program'], plant=self.plant, agent=self.name)
+            try:
+                outcome = self.runner(job['program'])
+            except Exception as e:
+                log.exception(f"Fleet job {job['program']} exception: {e}")
+                outcome = {'result': False, 'duration': 0.0, 'error': repr(e)}
+            if not outcome['result']:
+                tracer.fail(outcome.get('error') or 'automation failed')
+        return {'agent': self.name, 'job': job['id'], 'result': bool(outcome['result']),
+                'duration': outcome.get('duration', 0.0), 'error': outcome.get('error'), 'spans': spans}
+
+    def run(self):
+        """Take and run the jobs until stop()"""
+
+        from concurrent.futures import ThreadPoolExecutor
+        from contextvars import copy_context
+        import requests
+
+        registered = False
+        with ThreadPoolExecutor(self.capacity) as pool:
+            while not self._stop.is_set():
+                try:
+                    if not registered:
+                        self.register()
+                        registered = True
+                    jobs = self.post('/lease', {'agent': self.name, 'free': self.free()})['jobs']
+                except FleetError:
+                    registered = False
+                    continue
+                except requests.RequestException as e:
+                    log.warning(f'Fleet coordinator {self.url} is unavailable: {e}')
+                    registered = False
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                for job in jobs:
+                    log.info(f"Fleet job {job['id']}: {job['program']} is started")
+                    self.running.add(job['id'])
+                    if job['program'] not in self.parallel:
+                        with self._slots:
+                            self._alone += 1
+                    pool.submit(copy_context().run, self.__run_and_report, job)
+                self._stop.wait(self.poll_interval)
+
+    def free(self) -> int:
+        """Jobs to lease: none while a job that runs alone is leased"""
+
+        with self._slots:
+            return 0 if self._alone else self.capacity - len(self.running)
+
+    def __run_and_report(self, job: dict):
+        alone = job['program'] not in self.parallel
+        with self._slots:
+            # a job that runs alone waits for the running jobs, the parallel jobs wait for the leased alone jobs
+            self._slots.wait_for(lambda: not self._active if alone else not self._alone)
+            self._active += 1
+        try:
+            report = self.run_job(job)
+        finally:
+            with self._slots:
+                self._active -= 1
+                self._alone -= alone
+                self._slots.notify_all()
+        self.completed += 1
+        for attempt in range(3):
+            try:
+                self.post('/result', report)
+                break
+            except Exception as e:
+                log.warning(f"Fleet result of the job {job['id']} is not sent, attempt {attempt + 1}: {e}")
+                self._stop.wait(self.poll_interval)
+        self.running.discard(job['id'])
+
+    def stop(self):
+        self._stop.set()
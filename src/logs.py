@@ -0,0 +1,138 @@
+"""
+Logging of the program: the records are put to a queue by the calling thread and written to the console
+and the rotating log file by a background listener, so the polling loops don't wait for the disk.
+LOGGING section of config.ini:
+    level = INFO
+    levels = {"mercury_worker": "DEBUG", "waiter": "WARNING"}  - levels of the modules (file names)
+    file = app.log                                              - empty: console only
+    rotate = size | time
+    max_bytes = 10485760, backup_count = 7                     - size rotation / kept files
+    when = midnight, interval = 1                               - time rotation
+    format = text | json
+"""
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from datetime import datetime
+from copy import copy
+from queue import SimpleQueue
+import atexit
+import json
+import logging
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+_state = {'listener': None, 'handler': None, 'configured': False}
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'module': record.module,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RecordQueueHandler(QueueHandler):
+    """Puts the record with the rendered message and traceback, they are formatted by the listener"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class ModuleLevels(logging.Filter):
+    """Minimal level of the records of every module, other modules use the default level"""
+
+    def __init__(self, default: int, levels: dict):
+        super().__init__()
+        self.default = default
+        self.levels = levels
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self.levels.get(record.module, self.default)
+
+
+def level_number(level) -> int:
+    number = logging.getLevelName(str(level).upper())
+    if not isinstance(number, int):
+        raise ValueError(f'Unknown logging level {level}')
+    return number
+
+
+def file_handler(conf) -> logging.Handler:
+    from multiprocessing import parent_process
+
+    path = conf.get('file')
+    if parent_process() is not None:
+        # the pool processes append to the file of the main process, only the main process rotates it
+        return logging.FileHandler(path, encoding='utf-8')
+    if conf.get('rotate', 'size') == 'time':
+        return TimedRotatingFileHandler(path, when=conf.get('when', 'midnight'),
+                                        interval=conf.getint('interval', fallback=1),
+                                        backupCount=conf.getint('backup_count', fallback=7), encoding='utf-8')
+    return RotatingFileHandler(path, maxBytes=conf.getint('max_bytes', fallback=10 * 2 ** 20),
+                               backupCount=conf.getint('backup_count', fallback=7), encoding='utf-8')
+
+
+def setup_logging(configuration=None):
+    """
+    Set up the logging once: console only without the configuration, by its LOGGING section with it.
+    The call with the configuration replaces the console only set up
+    """
+
+    if _state['configured'] or (configuration is None and _state['listener']):
+        return
+    conf = configuration['LOGGING'] if configuration is not None and configuration.has_section('LOGGING') else {}
+    levels = {}
+    if conf:
+        levels = {module: level_number(level) for module, level in configuration.json_dict('LOGGING', 'levels').items()}
+    level = level_number(conf.get('level', 'INFO'))
+
+    if conf.get('format', 'text') == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if conf.get('file'):
+        handlers.append(file_handler(conf))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    stop_logging()
+    queue = SimpleQueue()
+    handler = RecordQueueHandler(queue)
+    handler.addFilter(ModuleLevels(level, levels))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(min([level, *levels.values()]))
+
+    listener = QueueListener(queue, *handlers)
+    listener.start()
+    _state.update(listener=listener, handler=handler, configured=configuration is not None)
+
+
+def stop_logging():
+    """Write the queued records and stop the listener"""
+
+    if _state['listener']:
+        _state['listener'].stop()
+        for handler in _state['listener'].handlers:
+            handler.close()
+        logging.getLogger().removeHandler(_state['handler'])
+        _state.update(listener=None, handler=None)
+
+
+atexit.register(stop_logging)
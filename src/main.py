@@ -1,6 +1,6 @@
-from service import Scheduler, config, log
-from app_context import WithAppRunner
-from notifications import TgSender
+from service import Scheduler, config, log, load_config, get_logger
+from executor import ProgramExecutor, session_pool, close_session_pool
+from tracing import tracer
 from os import getenv
 
 
@@ -16,6 +16,12 @@ class Launcher:
             '3': cls.debug_launch,
         }
 
+        if cls.fleet_role() == 'agent':
+            return cls.agent_launch()
+        if cls.fleet_role() == 'coordinator':
+            # the agents register before the first run
+            cls.fleet_coordinator()
+
         if config['SCHEDULE']['auto_launch'] == '1':
             return __ROUTE['1']()
 
@@ -26,33 +32,125 @@ class Launcher:
 
         return __ROUTE[mod]()
 
+    coordinator = None
+
+    @staticmethod
+    def fleet_role() -> str | None:
+        return config['FLEET'].get('role') if config.has_section('FLEET') else None
+
+    @classmethod
+    def fleet_coordinator(cls):
+        """Coordinator of the fleet, its server is started on the first use"""
+
+        if cls.coordinator is None:
+            from fleet import Coordinator
+
+            conf = config['FLEET']
+            cls.coordinator = Coordinator.from_config(config)
+            cls.coordinator.serve(conf.get('host', '0.0.0.0'), conf.getint('port', fallback=8470), conf.get('token'))
+        return cls.coordinator
+
+    @staticmethod
+    def enabled_programs() -> list:
+        return [i for i in config['AUTOMATIONS'] if config['AUTOMATIONS'][i] == "1"]
+
     @classmethod
-    def execute_programs(cls):
-        """Function to call the alternate execution of automation programs"""
+    def program_schedules(cls) -> dict:
+        """
+        Schedules of the enabled programs: ["cron expression" or "HH:MM", ...] in the SCHEDULES config section,
+        the programs without their own schedules run every day at start_time
+        """
+
+        return {program: config.json_list('SCHEDULES', program) or [config['SCHEDULE']['start_time']]
+                for program in cls.enabled_programs()}
+
+    @classmethod
+    def reload_config(cls) -> dict | None:
+        """Apply the configuration file changed while the scheduler is running, :return: new program schedules"""
+
+        if config.reload_if_changed():
+            return cls.program_schedules()
+        return None
+
+    @classmethod
+    def scheduler_tick(cls) -> dict | None:
+        """
+        Called by the scheduler before every check of the due schedules:
+        the Excel rows pending while the workbook was locked are merged as soon as it is free,
+        then the changed configuration is applied
+        :return: new program schedules
+        """
+
+        if 'mercury' in cls.enabled_programs():
+            from workers.mercury_worker import ExcelWriter
+
+            try:
+                ExcelWriter().flush_pending(config['Mercury']['data_path'])
+            except Exception as e:
+                log.exception(f'Pending Excel data is not written: {e}')
+        return cls.reload_config()
+
+    @classmethod
+    def execute_programs(cls, programs: list | None = None):
+        """
+        Function to call the alternate execution of automation programs
+        :param programs: programs to run, default - all enabled programs
+        """
 
         log.info(f'Start automation')
 
-        programs = [i for i in config['AUTOMATIONS'] if config['AUTOMATIONS'][i] == "1"]
-        err_list = []
+        with tracer.run('automation', config.get('TRACING', 'run_log', fallback='run_log.jsonl')):
+            programs = programs or cls.enabled_programs()
+            if cls.fleet_role() == 'coordinator':
+                # one notification of all plants, the failed jobs are named as plant/program
+                report = cls.fleet_coordinator().execute(programs)
+            else:
+                report = ProgramExecutor.from_config(config).execute(programs)
+            err_list = report.failed
+            if sessions := session_pool():
+                log.info(f'Application start latency: {sessions.summary()}')
 
-        for p in programs:
-            correct_result = False
-            with WithAppRunner(p) as application:
-                if application:
-                    correct_result = application.work()
-                if not correct_result:
-                    err_list.append(p)
+            cls.notify(err_list)
 
-        if err_list:
-            tg = TgSender(getenv('TG_API'))
-            tg.send_out_notifications(config['NOTIFICATIONS']['tg_recipients'], programs)
+    @staticmethod
+    def notify(err_list: list):
+        """
+        Send the failure notification. The messages queued by the previous runs are sent on every run,
+        so they don't wait for the next failure
+        """
+
+        from notifications import TgSender, NotificationQueue
+
+        queue_path = config.get('NOTIFICATIONS', 'queue_path', fallback='tg_queue.jsonl')
+        if not err_list and not (getenv('TG_API') and NotificationQueue(queue_path).load()):
+            return
+        tg = TgSender(getenv('TG_API'))
+        try:
+            if err_list:
+                tg.send_out_notifications(config.recipients, err_list)
+            else:
+                tg.flush()
+        finally:
+            tg.close()
 
     @classmethod
     def schedule_launch(cls):
         """Calling the schedule program automation function"""
 
-        sc = Scheduler(config['SCHEDULE']['start_time'], int(config['SCHEDULE']['sleep_time']))
-        sc.schedule_work(cls.execute_programs)
+        conf = config['SCHEDULE']
+        sc = Scheduler(conf['start_time'], int(conf['sleep_time']),
+                       state_path=conf.get('state_path', 'schedule_state.json'),
+                       catch_up=conf.getboolean('catch_up', fallback=True))
+        sc.schedule_work(cls.execute_programs, cls.program_schedules(), cls.scheduler_tick)
+
+    @classmethod
+    def agent_launch(cls):
+        """Run the jobs of the fleet coordinator with the programs enabled in this configuration"""
+
+        from fleet import Agent
+
+        log.info('Start fleet agent')
+        Agent.from_config(config, cls.enabled_programs()).run()
 
     @classmethod
     def test_launch(cls):
@@ -70,10 +168,16 @@ class Launcher:
 
 
 def main():
+    get_logger()
     try:
+        load_config()
+        get_logger(config)
         Launcher.route()
     except Exception as e:
         log.exception(repr(e))
+    finally:
+        # the applications kept alive between the runs are closed with the program
+        close_session_pool()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,16 @@
-import telebot
 from service import config, log, Helper, ERRORS
+from tracing import tracer, traced
+from threading import Lock
+from time import monotonic, sleep
+import json
+import os
 
 
 class Sender:
 
     def __init__(self, token: str):
         self.token = self.invalidate_token(token)
-        self.recipients = Helper.convert_str_to_list(config['NOTIFICATIONS']['tg_recipients'])
+        self.recipients = config.recipients
 
     @staticmethod
     def invalidate_token(token):
@@ -22,31 +26,191 @@ class Sender:
         return ERRORS.get('automation_failed').format(programs=', '.join(programs))
 
 
+class DeliveryError(Exception):
+
+    def __init__(self, message: str, retry: bool = True, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+class TelegramApi:
+    """Telegram Bot API client over one reused HTTP session"""
+
+    def __init__(self, token: str, api_url: str = 'https://api.telegram.org', timeout: float = 10.0):
+        import requests
+
+        self.url = f"{api_url.rstrip('/')}/bot{token}"
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send_message(self, chat_id: str, text: str):
+        import requests
+
+        try:
+            response = self.session.post(f'{self.url}/sendMessage', json={'chat_id': chat_id, 'text': text},
+                                         timeout=self.timeout)
+        except requests.RequestException as e:
+            raise DeliveryError(f'Telegram connection error: {e}')
+
+        if response.status_code == 200:
+            return
+        try:
+            description = response.json()
+        except ValueError:
+            description = {}
+        if response.status_code == 429:
+            raise DeliveryError('Telegram rate limit', retry_after=description.get('parameters', {}).get('retry_after'))
+        raise DeliveryError(f"Telegram error {response.status_code}: {description.get('description')}",
+                            retry=response.status_code >= 500)
+
+    def close(self):
+        self.session.close()
+
+
+class RateLimiter:
+    """Token bucket: no more than 'rate' calls per second over all threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_time = monotonic()
+        self._lock = Lock()
+
+    def wait(self):
+        with self._lock:
+            now = monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            sleep(delay)
+
+
+class NotificationQueue:
+    """Undelivered messages saved on disk as json lines until the next run"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> list:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def save(self, messages: list):
+        if not messages:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(m, ensure_ascii=False) + '\n' for m in messages)
+
+
+class NotificationDispatcher:
+    """
+    Sends messages to all recipients concurrently within the Telegram rate limit.
+    Failed deliveries are retried with backoff, undelivered messages are queued on disk
+    and sent first by the next dispatch
+    """
+
+    def __init__(self, api: TelegramApi, queue: NotificationQueue, rate: float = 25.0, workers: int = 4,
+                 attempts: int = 3, backoff: float = 1.0):
+        self.api = api
+        self.queue = queue
+        self.limiter = RateLimiter(rate)
+        self.workers = workers
+        self.attempts = attempts
+        self.backoff = backoff
+
+    def deliver(self, message: dict) -> str:
+        """
+        :param message: {'chat_id': ..., 'text': ...}
+        :return: 'sent', 'rejected' - Telegram refused the message, it isn't retried,
+                 'queued' - all attempts failed, the message is sent again by the next run
+        """
+
+        with tracer.span('telegram.deliver', chat_id=message['chat_id']):
+            status = self.__deliver(message)
+            tracer.annotate(status=status)
+            if status != 'sent':
+                tracer.fail(status)
+        return status
+
+    def __deliver(self, message: dict) -> str:
+        for attempt in range(1, self.attempts + 1):
+            self.limiter.wait()
+            try:
+                self.api.send_message(message['chat_id'], message['text'])
+                return 'sent'
+            except DeliveryError as e:
+                log.warning(f"Message to {message['chat_id']} failed, attempt {attempt}: {e}")
+                if not e.retry:
+                    return 'rejected'
+                if attempt < self.attempts:
+                    sleep(e.retry_after or self.backoff * 2 ** (attempt - 1))
+        return 'queued'
+
+    @traced('telegram.dispatch')
+    def dispatch(self, text: str | None, recipients: list) -> dict:
+        """Send the queued messages and the new one to all recipients, text None - only the queued messages"""
+
+        from concurrent.futures import ThreadPoolExecutor
+        from contextvars import copy_context
+
+        messages = self.queue.load()
+        if text is not None:
+            messages += [{'chat_id': r, 'text': text} for r in recipients]
+        if not messages:
+            return {}
+        with ThreadPoolExecutor(min(self.workers, len(messages)) or 1) as pool:
+            futures = [pool.submit(copy_context().run, self.deliver, message) for message in messages]
+            results = [future.result() for future in futures]
+
+        self.queue.save([m for m, result in zip(messages, results) if result == 'queued'])
+        report = {status: results.count(status) for status in ('sent', 'rejected', 'queued')}
+        tracer.annotate(**report)
+        return report
+
+
 class TgSender(Sender):
 
     def __init__(self, token: str):
         super().__init__(token)
-        self.bot = self.__validata_bot()
+        self.conf = config['NOTIFICATIONS']
+        self.api = TelegramApi(self.token,
+                               self.conf.get('api_url', 'https://api.telegram.org'),
+                               self.conf.getfloat('timeout', fallback=10.0))
+        self.dispatcher = NotificationDispatcher(self.api,
+                                                 NotificationQueue(self.conf.get('queue_path', 'tg_queue.jsonl')),
+                                                 rate=self.conf.getfloat('rate_limit', fallback=25.0),
+                                                 attempts=self.conf.getint('attempts', fallback=3))
 
-    def __validata_bot(self):
-        try:
-            return telebot.TeleBot(self.token)
-        except Exception as e:
-            log.exception(f"Telegram bot error: {e}")
+    def flush(self) -> dict:
+        """Send the messages left undelivered by the previous runs"""
+
+        report = self.dispatcher.dispatch(None, [])
+        if report:
+            log.info(f'Queued telegram messages were sent: {report}')
+        return report
+
+    def close(self):
+        self.api.close()
 
     def send_message_to_recipient(self, chat_id: str, message: str):
         """send message to one recipient"""
-        self.bot.send_message(chat_id=chat_id, text=message)
+        self.api.send_message(chat_id, message)
 
+    @traced('telegram.notify')
     def send_out_notifications(self, recipients, programs: list):
         """send message for all recipients"""
 
         msg = self.form_message(programs)
-        recipients = Helper.convert_str_to_list(recipients)
+        if isinstance(recipients, str):
+            recipients = Helper.convert_str_to_list(recipients)
 
         if recipients:
-            for recipient in recipients:
-                self.send_message_to_recipient(recipient, msg)
-            log.info("App error was sent to telegram recipients")
+            report = self.dispatcher.dispatch(msg, recipients)
+            log.info(f"App error was sent to telegram recipients: {report}")
         else:
             log.exception(f"{ERRORS.get('recipients_error')}")
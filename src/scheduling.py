@@ -0,0 +1,290 @@
+"""
+Schedule engine: sleeps until the next due time of the schedules instead of polling,
+catches up the runs missed while the program was stopped and never starts overlapping runs.
+Schedules are cron expressions 'minute hour day month weekday' or 'HH:MM' for a daily run
+"""
+from datetime import datetime, timedelta
+from time import sleep
+from service import log
+import json
+import os
+
+
+class CronSchedule:
+
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+    ALIASES = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *'}
+
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        cron = self.ALIASES.get(self.expression, self.expression)
+        if time := self.__daily_time(cron):
+            cron = f'{time[1]} {time[0]} * * *'
+
+        fields = cron.split()
+        if len(fields) != len(self.FIELDS):
+            raise ValueError(f'Incorrect schedule "{expression}", expected "minute hour day month weekday" or "HH:MM"')
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self.__parse_field(field, *spec) for field, spec in zip(fields, self.FIELDS))
+        # cron weekdays: 0 and 7 - Sunday, datetime.weekday(): 6 - Sunday
+        self.weekdays = {(d - 1) % 7 for d in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def __repr__(self):
+        return f'CronSchedule({self.expression!r})'
+
+    @staticmethod
+    def __daily_time(cron: str) -> tuple | None:
+        parts = cron.split(':')
+        if len(parts) == 2 and all(p.isdigit() for p in parts) and int(parts[0]) < 24 and int(parts[1]) < 60:
+            return int(parts[0]), int(parts[1])
+        return None
+
+    @staticmethod
+    def __parse_field(field: str, name: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = map(int, part.split('-'))
+            else:
+                start = end = int(part)
+                if step > 1:
+                    end = high
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f'Incorrect {name} "{field}" in the schedule, allowed {low}-{high}')
+            values.update(range(start, end + 1, step))
+        return values
+
+    def __day_matches(self, day: datetime) -> bool:
+        in_month = day.day in self.days
+        in_week = day.weekday() in self.weekdays
+        # as in cron: if both the day and the weekday are restricted, either of them matches
+        if not self.any_day and not self.any_weekday:
+            return in_month or in_week
+        return in_month and in_week
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First scheduled time strictly after the moment"""
+
+        t = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self.__day_matches(t):
+                t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in self.hours:
+                t = (t + timedelta(hours=1)).replace(minute=0)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f'Schedule "{self.expression}" never runs')
+
+
+def parse_schedules(schedules: dict) -> dict:
+    """:param schedules: {name: [cron expression or 'HH:MM']}"""
+    return {name: [CronSchedule(e) for e in expressions] for name, expressions in schedules.items()}
+
+
+class SystemClock:
+
+    @staticmethod
+    def now() -> datetime:
+        return datetime.now()
+
+    @staticmethod
+    def sleep(seconds: float):
+        sleep(seconds)
+
+
+class FakeClock:
+    """Clock for the schedule tests: sleep() moves the time forward at once"""
+
+    def __init__(self, start: datetime):
+        self.current = start
+        self.sleeps = []
+
+    def now(self) -> datetime:
+        return self.current
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.current += timedelta(seconds=seconds)
+
+    def advance(self, **delta):
+        self.current += timedelta(**delta)
+
+
+class ScheduleState:
+    """Start and finish time of the last run of every schedule, saved in a json file"""
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.runs = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.runs = json.load(f)
+            except ValueError as e:
+                log.warning(f'Schedule state {path} is broken and is ignored: {e}')
+
+    def finished(self, name: str) -> datetime | None:
+        run = self.runs.get(name, {})
+        return datetime.fromisoformat(run['finished']) if run.get('finished') else None
+
+    def interrupted(self, name: str) -> bool:
+        run = self.runs.get(name, {})
+        return bool(run.get('started')) and run.get('started', '') > run.get('finished', '')
+
+    def start(self, names: list, moment: datetime):
+        for name in names:
+            self.runs.setdefault(name, {})['started'] = moment.isoformat()
+        self.save()
+
+    def finish(self, names: list, moment: datetime):
+        for name in names:
+            self.runs.setdefault(name, {})['finished'] = moment.isoformat()
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.runs, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class RunLock:
+    """
+    Lock file held for the run time, so a second copy of the program doesn't start the same run.
+    A lock older than stale_after seconds is left by a crashed run and is taken over
+    """
+
+    def __init__(self, path: str | None, stale_after: float = 6 * 3600):
+        self.path = path
+        self.stale_after = stale_after
+
+    def acquire(self, now: datetime) -> bool:
+        if not self.path:
+            return True
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    locked_at = datetime.fromisoformat(f.read().strip())
+            except (OSError, ValueError):
+                locked_at = datetime.min
+            if (now - locked_at).total_seconds() < self.stale_after:
+                return False
+            log.warning(f'Stale schedule lock {self.path} from {locked_at} is taken over')
+            os.remove(self.path)
+            return self.acquire(now)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(now.isoformat())
+        return True
+
+    def release(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ScheduleEngine:
+    """
+    :param schedules: {name: [CronSchedule]}
+    :param state: last runs, a run missed while the program was stopped is caught up once at the start
+                  if catch_up is set, otherwise the schedule waits for its next time
+    :param max_sleep: longest single sleep, after it the due time is checked against the wall clock again,
+                      so the time the computer was asleep is taken into account
+    """
+
+    def __init__(self, schedules: dict, state: ScheduleState, clock=None, max_sleep: float = 3600,
+                 catch_up: bool = True, lock: RunLock | None = None):
+        self.schedules = schedules
+        self.state = state
+        self.clock = clock or SystemClock()
+        self.max_sleep = max_sleep
+        self.catch_up = catch_up
+        self.lock = lock or RunLock(None)
+        self.started = self.clock.now()
+
+    def next_due(self, name: str) -> datetime:
+        last = self.state.finished(name)
+        if last is None or not self.catch_up:
+            last = max(last or self.started, self.started)
+        return min(schedule.next_after(last) for schedule in self.schedules[name])
+
+    def due(self, now: datetime) -> list:
+        return [name for name in self.schedules if self.next_due(name) <= now]
+
+    def run_pending(self, function) -> list:
+        """
+        Call function(names) with all due schedules at once.
+        Scheduled times passed during the run are skipped, the runs never overlap
+        :return: names of the schedules that were run
+        """
+
+        now = self.clock.now()
+        if not (due := self.due(now)):
+            return []
+        for name in due:
+            if self.state.interrupted(name):
+                log.warning(f'The previous run of {name} was interrupted')
+            if (now - (missed := self.next_due(name))).total_seconds() > self.max_sleep:
+                log.info(f'{name}: catching up the run missed at {missed:%d.%m.%Y %H:%M}')
+
+        if not self.lock.acquire(now):
+            log.warning(f'Schedules {due} are already running by another process, the run is skipped')
+            self.state.finish(due, now)
+            return []
+        try:
+            self.state.start(due, now)
+            function(due)
+        except Exception as e:
+            log.exception(f'Scheduled run {due} exception: {e}')
+        finally:
+            self.state.finish(due, self.clock.now())
+            self.lock.release()
+        return due
+
+    def sleep_until_due(self):
+        now = self.clock.now()
+        next_time = min(self.next_due(name) for name in self.schedules)
+        self.clock.sleep(min(self.max_sleep, max(0.0, (next_time - now).total_seconds())))
+
+    def reload(self, reload):
+        """Apply the new schedules, the current ones stay if the new ones can't be read"""
+
+        current = self.schedules
+        try:
+            if not (schedules := reload()):
+                return
+            self.schedules = schedules
+            next_runs = {name: self.next_due(name) for name in schedules}
+        except Exception as e:
+            self.schedules = current
+            log.exception(f'New schedules are not applied, the current ones stay: {e}')
+            return
+        for name, next_run in next_runs.items():
+            log.info(f'{name}: next run at {next_run:%d.%m.%Y %H:%M}')
+
+    def run(self, function, until: datetime | None = None, reload=None):
+        """
+        Run the schedules forever or until the given time
+        :param reload: called before every check of the due schedules, returns new schedules or None
+        """
+
+        while until is None or self.clock.now() < until:
+            if reload:
+                self.reload(reload)
+            self.run_pending(function)
+            self.sleep_until_due()
@@ -1,10 +1,10 @@
 from datetime import datetime
-from time import sleep
 from configparser import ConfigParser
+import locale
 import logging
-import schedule
 import re
 import json
+import os
 
 ERRORS = {
     "config_not_found": "Can't find configuration file '{config}' in program directory",
@@ -15,31 +15,293 @@ ERRORS = {
     "date_format": "Unrecognized date format. The correct formats ",
     "automation_failed": "Failed to execute programs automatically: {programs}.\nPlease, run the programs manually.",
     "recipients_error": "Telegram recipients for bug report not found",
-    "token_error": "token to message sending not found"
+    "token_error": "token to message sending not found",
+    "wait_aborted": "{program}: waiting for the process was aborted ({reason})",
+    "meters_unpolled": "Mercury: no data of the meters {meters}, they will be polled again by the next run today",
+    "workbook_locked": "{file} is locked by another program, the data will be written as soon as it is free",
+    "config_section": "Section [{section}] is missing in the configuration file",
+    "config_option": "Parameter '{option}' is missing in the section [{section}]",
+    "config_value": "[{section}] {option} = {value}: {expected} expected",
+    "circuit_open": "{key}: {failures} failures in a row, the circuit breaker is open for {cooldown} s",
+    "circuit_skipped": "{key} is skipped, its circuit breaker is open"
 }
 
 
-def get_config(file_name: str) -> dict:
+class ConfigError(ValueError):
+    pass
+
+
+def _is_time(value: str) -> bool:
+    return re.match('^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', value) is not None
+
+
+def _is_list(value: str) -> bool:
     try:
-        configuration = ConfigParser()
-        configuration.read(file_name)
-        return configuration
-    except FileNotFoundError as ex:
-        print(ERRORS.get('config_not_found').format(config=file_name))
-        raise ex
+        return isinstance(json.loads(value), list)
+    except ValueError:
+        return False
+
+
+def _is_dict(value: str) -> bool:
+    try:
+        return isinstance(json.loads(value), dict)
+    except ValueError:
+        return False
+
+
+def _is_schedules(value: str) -> bool:
+    from scheduling import CronSchedule
+
+    try:
+        expressions = json.loads(value)
+        if not isinstance(expressions, list):
+            return False
+        for expression in expressions:
+            CronSchedule(str(expression)).next_after(datetime.now())
+    except ValueError:
+        return False
+    return True
+
+
+# value checks of the config schema: {type name: (check, description)}
+TYPES = {
+    'str': (bool, 'not empty value'),
+    'int': (lambda v: v.strip().lstrip('-').isdigit(), 'integer'),
+    'float': (lambda v: re.match(r'^\s*-?\d+(\.\d+)?\s*$', v) is not None, 'number'),
+    'flag': (lambda v: v in ('0', '1'), '0 or 1'),
+    'time': (_is_time, 'time HH:MM'),
+    'list': (_is_list, 'json list, e.g. [1, 2]'),
+    'dict': (_is_dict, 'json object, e.g. {"waiter": "DEBUG"}'),
+    'schedules': (_is_schedules, 'json list of cron expressions or HH:MM, e.g. ["0 9 * * 1-5"]')
+}
+
+# required parameters {section: {parameter: type}}, the program sections are required if the program is enabled
+SCHEMA = {
+    'SCHEDULE': {'start_time': 'time', 'sleep_time': 'int', 'auto_launch': 'flag'},
+    'AUTOMATIONS': {},
+    'NOTIFICATIONS': {'tg_recipients': 'list'}
+}
+# the fleet coordinator only hands out the programs, the agents run them by their own configuration
+FLEET_SCHEMA = {
+    'coordinator': {'FLEET': {'plants': 'list'}},
+    'agent': {'FLEET': {'url': 'str', 'name': 'str', 'plant': 'str'}}
+}
+
+# optional parameters, checked if they are set, every option of SCHEDULES is a list of schedules
+OPTIONAL_SCHEMA = {
+    'EXECUTION': {'parallel': 'list'},
+    'LOGGING': {'levels': 'dict'},
+    'FLEET': {'plants': 'list'}
+}
+
+PROGRAM_SCHEMA = {
+    'btctools': {'BtcTools': {'program_path': 'str', 'launch_type': 'str', 'data_folder': 'str'}},
+    'mercury': {'Mercury': {'program_path': 'str', 'launch_type': 'str', 'meter_indexes': 'list', 'data_path': 'str',
+                            'notepad_data_path': 'str'},
+                'Excel': {'meter_index_row': 'int', 'meter_index_col_first': 'int',
+                          'meter_index_col_last': 'int'}}
+}
+
+
+class LazyConfig(ConfigParser):
+    """
+    Configuration that is read by load_config() at the program start instead of the module import.
+    Modules used without the entry point (worker processes, benchmarks) read the file on the first access.
+    The parsed values of the json lists and the meter columns are cached until the value is changed,
+    reload_if_changed() rereads the file changed while the program is running
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.loaded = False
+        self.stamp = None
+        self._derived = {}
+        super().__init__()
+
+    def load(self, file_name: str | None = None):
+        self.file_name = file_name or self.file_name
+        self.loaded = True
+        self.stamp = self.file_stamp()
+        if self.stamp is None:
+            print(ERRORS.get('config_not_found').format(config=self.file_name))
+            raise FileNotFoundError(ERRORS.get('config_not_found').format(config=self.file_name))
+        self.read_string(self.read_text(), source=self.file_name)
+
+    def read_text(self) -> str:
+        """Text of the file: UTF-8 (with or without BOM), the configs saved in the locale encoding are still read"""
+
+        with open(self.file_name, 'rb') as f:
+            data = f.read()
+        try:
+            return data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return data.decode(locale.getpreferredencoding(False))
+
+    def file_stamp(self) -> tuple | None:
+        try:
+            stat = os.stat(self.file_name)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def validate(self):
+        """Check the sections and the parameters required by the enabled programs, ConfigError lists all problems"""
+
+        schema = dict(SCHEMA)
+        role = self['FLEET'].get('role') if self.has_section('FLEET') else None
+        schema.update(FLEET_SCHEMA.get(role, {}))
+        if self.has_section('AUTOMATIONS') and role != 'coordinator':
+            for program, value in self['AUTOMATIONS'].items():
+                if value == '1':
+                    schema.update(PROGRAM_SCHEMA.get(program, {}))
+
+        problems = []
+        for section, options in schema.items():
+            if not self.has_section(section):
+                problems.append(ERRORS.get('config_section').format(section=section))
+                continue
+            for option, value_type in options.items():
+                value = self[section].get(option)
+                check, expected = TYPES[value_type]
+                if value is None:
+                    problems.append(ERRORS.get('config_option').format(option=option, section=section))
+                elif not check(value):
+                    problems.append(ERRORS.get('config_value').format(section=section, option=option, value=value,
+                                                                      expected=expected))
+
+        optional = dict(OPTIONAL_SCHEMA)
+        if self.has_section('SCHEDULES'):
+            optional['SCHEDULES'] = {option: 'schedules' for option in self['SCHEDULES']}
+        for section, options in optional.items():
+            for option, value_type in options.items():
+                check, expected = TYPES[value_type]
+                if (value := self.get(section, option, fallback=None)) is not None and not check(value):
+                    problems.append(ERRORS.get('config_value').format(section=section, option=option, value=value,
+                                                                      expected=expected))
+        if problems:
+            raise ConfigError(f'{self.file_name}:\n' + '\n'.join(problems))
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reread the file if it was changed since the last reading.
+        The new file is applied only if it is valid, otherwise the current configuration stays
+        :return: True if the new configuration was applied
+        """
+
+        if not self.loaded or (stamp := self.file_stamp()) is None or stamp == self.stamp:
+            return False
+        self.stamp = stamp
+        new = LazyConfig(self.file_name)
+        try:
+            new.load()
+            new.validate()
+        except Exception as e:
+            log.error(f'Changed configuration is not applied: {e}')
+            return False
+
+        for section in self.sections():
+            self.remove_section(section)
+        self.read_dict(new)
+        log.info(f'Configuration {self.file_name} is reloaded')
+        return True
+
+    def derived(self, section: str, option: str, parse, fallback=None):
+        """Value parsed once and cached until the raw value is changed"""
+
+        raw = self[section].get(option) if self.has_section(section) else None
+        if raw is None:
+            return fallback
+        cached = self._derived.get((section, option))
+        if cached is None or cached[0] != raw:
+            cached = self._derived[(section, option)] = (raw, parse(raw))
+        return cached[1]
+
+    def json_list(self, section: str, option: str, fallback=None) -> list:
+        """Parsed json list of the parameter, e.g. meter_indexes = [1, 2]"""
+        return self.derived(section, option, Helper.convert_str_to_list, [] if fallback is None else fallback)
+
+    def json_dict(self, section: str, option: str) -> dict:
+        """Parsed json object of the parameter, e.g. levels = {"waiter": "DEBUG"}"""
+        return self.derived(section, option, json.loads, {})
+
+    @property
+    def meters(self) -> list:
+        return self.json_list('Mercury', 'meter_indexes')
+
+    @property
+    def recipients(self) -> list:
+        return self.json_list('NOTIFICATIONS', 'tg_recipients')
+
+    @property
+    def meter_columns(self) -> range:
+        """Excel columns of the meter numbers"""
+
+        first = self.derived('Excel', 'meter_index_col_first', int)
+        last = self.derived('Excel', 'meter_index_col_last', int)
+        return range(first, last)
+
+    def read_dict(self, *args, **kwargs):
+        self.loaded = True
+        return super().read_dict(*args, **kwargs)
+
+    def __ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def __getitem__(self, key):
+        self.__ensure_loaded()
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.__ensure_loaded()
+        return super().__contains__(key)
+
+    def has_section(self, section: str) -> bool:
+        self.__ensure_loaded()
+        return super().has_section(section)
+
+    def sections(self) -> list:
+        self.__ensure_loaded()
+        return super().sections()
+
+    def get(self, section: str, option: str, **kwargs):
+        self.__ensure_loaded()
+        return super().get(section, option, **kwargs)
+
+    def items(self, *args, **kwargs):
+        self.__ensure_loaded()
+        return super().items(*args, **kwargs)
+
+    def has_option(self, section: str, option: str) -> bool:
+        self.__ensure_loaded()
+        return super().has_option(section, option)
+
+
+def get_config(file_name: str) -> LazyConfig:
+    return LazyConfig(file_name)
 
 
 config = get_config('config.ini')
 
 
-def get_logger():
-    formatting = '%(asctime)s %(levelname)s %(message)s'
-    logging.basicConfig(level=logging.INFO, format=formatting, datefmt='%d/%m/%Y %H:%M:%S')
-    logger = logging.getLogger('app.log')
-    return logger
+def load_config(file_name: str | None = None) -> LazyConfig:
+    """Read and validate the configuration file, called once by the entry point"""
+
+    config.load(file_name)
+    config.validate()
+    return config
+
 
+def get_logger(configuration: LazyConfig | None = None):
+    """Set up the logging, see logs.py: console only or by the LOGGING section of the configuration"""
 
-log = get_logger()
+    from logs import setup_logging
+
+    setup_logging(configuration)
+    return logging.getLogger('app.log')
+
+
+log = logging.getLogger('app.log')
 
 
 class Helper:
@@ -95,9 +357,18 @@ class Helper:
 
 class Scheduler:
 
-    def __init__(self, work_time: str, sleep_time: int):
+    def __init__(self, work_time: str, sleep_time: int, state_path: str | None = 'schedule_state.json',
+                 catch_up: bool = True, clock=None):
+        """
+        :param work_time: daily start time, used if no other schedules are given
+        :param sleep_time: longest single sleep in seconds, the due time is checked again after it
+        :param state_path: file of the last runs to catch up the missed runs and the run lock
+        """
         self.work_time = self.invalidate_time(work_time)
         self.sleep_time = self.invalidate_time(sleep_time)
+        self.state_path = state_path
+        self.catch_up = catch_up
+        self.clock = clock
 
     def __new__(cls, *args, **kwargs):
         print(f'Program runs every day at {config["SCHEDULE"]["start_time"]}. '
@@ -112,8 +383,30 @@ class Scheduler:
             raise ValueError(ERRORS.get('sleep_time'))
         return time
 
-    def schedule_work(self, function):
-        schedule.every().day.at(self.work_time).do(function)
-        while True:
-            schedule.run_pending()
-            sleep(self.sleep_time)
+    def engine(self, schedules: dict | None = None):
+        """
+        :param schedules: {name: [cron expression or 'HH:MM']}, default - {'automation': [work_time]}
+        """
+
+        from scheduling import ScheduleEngine, ScheduleState, RunLock, parse_schedules
+
+        schedules = schedules or {'automation': [self.work_time]}
+        return ScheduleEngine(parse_schedules(schedules),
+                              ScheduleState(self.state_path),
+                              self.clock,
+                              max_sleep=max(1, self.sleep_time),
+                              catch_up=self.catch_up,
+                              lock=RunLock(f'{self.state_path}.lock' if self.state_path else None))
+
+    def schedule_work(self, function, schedules: dict | None = None, reload=None):
+        """
+        Call function(names) with the names of the due schedules, see engine()
+        :param reload: returns the new schedules if they were changed, otherwise None
+        """
+
+        from scheduling import parse_schedules
+
+        engine = self.engine(schedules)
+        for name in engine.schedules:
+            log.info(f'{name}: next run at {engine.next_due(name):%d.%m.%Y %H:%M}')
+        engine.run(function, reload=(lambda: (new := reload()) and parse_schedules(new)) if reload else None)
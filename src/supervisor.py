@@ -0,0 +1,217 @@
+"""
+Supervision of the automation programs by their run history, SUPERVISOR section of config.ini:
+the timeouts of the long waits are learned from the durations of the past successful waits,
+the apps and the meters that keep failing are skipped by circuit breakers until their cool-down ends.
+    enabled = 1
+    path = supervisor.json                  - the learned history, kept between the runs
+    min_samples = 5, history_size = 50      - durations needed to learn a timeout / kept durations of a step
+    timeout_factor = 3, min_timeout = 5     - learned timeout: p95 * factor, not less than min_timeout
+    max_timeout = 3600                      - timeout of the waits without a timeout and a history
+    failure_threshold = 3                   - failures in a row opening a breaker
+    cooldown = 600, max_cooldown = 86400    - seconds before the trial call, doubled by every repeated opening
+"""
+from threading import Lock
+from time import time
+from service import log, ERRORS
+from tracing import percentile
+import json
+import os
+
+_supervisor = None
+
+
+class CircuitBreaker:
+    """
+    closed - calls are allowed, open - calls are skipped until the cool-down ends,
+    half-open - the cool-down ended, one trial call closes the breaker or opens it again for a longer time.
+    The other calls are skipped while the trial runs, a trial without an outcome for a cool-down is given up
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 600.0, max_cooldown: float = 86400.0,
+                 failures: int = 0, opened_at: float | None = None, trips: int = 0):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = failures
+        self.opened_at = opened_at
+        self.trips = trips
+        # start of the trial call of the half-open breaker, not kept between the runs
+        self.trial_at = None
+
+    @property
+    def cooldown(self) -> float:
+        return min(self.max_cooldown, self.base_cooldown * 2 ** max(0, self.trips - 1))
+
+    def state(self, now: float) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if now - self.opened_at < self.cooldown else 'half-open'
+
+    def allow(self, now: float) -> bool:
+        state = self.state(now)
+        if state != 'half-open':
+            return state == 'closed'
+        if self.trial_at is not None and now - self.trial_at < self.cooldown:
+            return False
+        self.trial_at = now
+        return True
+
+    def success(self):
+        self.failures, self.opened_at, self.trips, self.trial_at = 0, None, 0, None
+
+    def failure(self, now: float) -> bool:
+        """:return: True if the breaker is opened by this failure"""
+
+        self.failures += 1
+        self.trial_at = None
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.trips += 1
+            self.opened_at = now
+            return True
+        return False
+
+    def as_dict(self) -> dict:
+        return {'failures': self.failures, 'opened_at': self.opened_at, 'trips': self.trips}
+
+
+class Supervisor:
+    """
+    Duration history of the steps and circuit breakers of the apps and meters by their keys,
+    e.g. 'BtcTools.process', 'app.mercury', 'meter.12345'. save() merges the keys changed by this process
+    into the file, so the pool processes don't overwrite each other's history
+    """
+
+    def __init__(self, path: str, min_samples: int = 5, history_size: int = 50, timeout_factor: float = 3.0,
+                 min_timeout: float = 5.0, max_timeout: float = 3600.0, failure_threshold: int = 3,
+                 cooldown: float = 600.0, max_cooldown: float = 86400.0, clock=time):
+        self.path = path
+        self.min_samples = min_samples
+        self.history_size = history_size
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.breaker_args = {'threshold': failure_threshold, 'cooldown': cooldown, 'max_cooldown': max_cooldown}
+        self.clock = clock
+        self._changed = {'durations': set(), 'breakers': set()}
+        self._lock = Lock()
+        self.durations, self.breakers = self.__read()
+
+    @classmethod
+    def from_config(cls, configuration):
+        if not configuration.has_section('SUPERVISOR'):
+            return cls('supervisor.json')
+        conf = configuration['SUPERVISOR']
+        if not conf.getboolean('enabled', fallback=True):
+            return None
+        return cls(conf.get('path', 'supervisor.json'),
+                   min_samples=conf.getint('min_samples', fallback=5),
+                   history_size=conf.getint('history_size', fallback=50),
+                   timeout_factor=conf.getfloat('timeout_factor', fallback=3.0),
+                   min_timeout=conf.getfloat('min_timeout', fallback=5.0),
+                   max_timeout=conf.getfloat('max_timeout', fallback=3600.0),
+                   failure_threshold=conf.getint('failure_threshold', fallback=3),
+                   cooldown=conf.getfloat('cooldown', fallback=600.0),
+                   max_cooldown=conf.getfloat('max_cooldown', fallback=86400.0))
+
+    def __read(self) -> tuple[dict, dict]:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}, {}
+        except (OSError, ValueError) as e:
+            log.warning(f'Supervisor history {self.path} is not read: {e}')
+            return {}, {}
+        breakers = {key: CircuitBreaker(**self.breaker_args, **state) for key, state in data.get('breakers', {}).items()}
+        return data.get('durations', {}), breakers
+
+    def save(self):
+        with self._lock:
+            if not any(self._changed.values()):
+                return
+            durations, breakers = self.__read()
+            for key in self._changed['durations']:
+                durations[key] = self.durations[key]
+            for key in self._changed['breakers']:
+                breakers[key] = self.breakers[key]
+            data = {'durations': durations, 'breakers': {key: b.as_dict() for key, b in breakers.items()}}
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+            self._changed = {'durations': set(), 'breakers': set()}
+
+    def record(self, key: str, seconds: float):
+        """Duration of the successful step"""
+
+        with self._lock:
+            history = self.durations.setdefault(key, [])
+            history.append(round(seconds, 3))
+            del history[:-self.history_size]
+            self._changed['durations'].add(key)
+
+    def p95(self, key: str) -> float | None:
+        history = self.durations.get(key, [])
+        if len(history) < self.min_samples:
+            return None
+        return percentile(sorted(history), 95)
+
+    def learned_timeout(self, *keys: str) -> float | None:
+        """Timeout by the history of the first key with enough durations"""
+
+        for key in keys:
+            if (p95 := self.p95(key)) is not None:
+                return min(self.max_timeout, max(self.min_timeout, p95 * self.timeout_factor))
+        return None
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(**self.breaker_args)
+        return self.breakers[key]
+
+    def allow(self, key: str) -> bool:
+        with self._lock:
+            return key not in self.breakers or self.breakers[key].allow(self.clock())
+
+    def success(self, key: str):
+        with self._lock:
+            if key in self.breakers and self.breakers[key].failures:
+                if self.breakers[key].opened_at is not None:
+                    log.info(f'{key}: recovered, the circuit breaker is closed')
+                self.breakers[key].success()
+                self._changed['breakers'].add(key)
+
+    def failure(self, key: str):
+        with self._lock:
+            breaker = self.breaker(key)
+            if breaker.failure(self.clock()):
+                log.warning(ERRORS.get('circuit_open').format(key=key, failures=breaker.failures,
+                                                              cooldown=round(breaker.cooldown)))
+            self._changed['breakers'].add(key)
+
+    def outcome(self, key: str, ok: bool):
+        if ok:
+            self.success(key)
+        else:
+            self.failure(key)
+
+    def open_breakers(self) -> list:
+        now = self.clock()
+        return [key for key, breaker in self.breakers.items() if breaker.state(now) == 'open']
+
+
+def get_supervisor() -> Supervisor | None:
+    """Supervisor of the current process, None if it is disabled in the config"""
+
+    global _supervisor
+    if _supervisor is None:
+        from service import config
+        _supervisor = Supervisor.from_config(config) or False
+    return _supervisor or None
+
+
+def set_supervisor(supervisor: Supervisor | None):
+    """Replace the supervisor, e.g. by one with a temporary history for the benchmarks"""
+
+    global _supervisor
+    _supervisor = supervisor if supervisor is not None else False
@@ -0,0 +1,207 @@
+"""
+Nested timing spans of the automation run.
+Every finished run is appended to the json-lines run log, one line per span,
+percentile stats across runs: python tracing.py [run log path]
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from uuid import uuid4
+import json
+import math
+import sys
+
+_current = ContextVar('span', default=None)
+# spans of the current run, the runs in different contexts collect their spans separately
+_run_spans = ContextVar('run_spans', default=None)
+
+
+class Span:
+
+    def __init__(self, name: str, run_id: str | None, parent: 'Span | None', attrs: dict):
+        self.id = uuid4().hex[:12]
+        self.name = name
+        self.run_id = run_id
+        self.parent_id = parent.id if parent else None
+        self.depth = parent.depth + 1 if parent else 0
+        self.attrs = attrs
+        self.start = datetime.now().isoformat(timespec='milliseconds')
+        self.duration = 0.0
+        self.outcome = 'ok'
+        self.error = None
+        self._started = perf_counter()
+
+    def finish(self, error: BaseException | None = None):
+        self.duration = perf_counter() - self._started
+        if error is not None:
+            self.outcome, self.error = 'error', repr(error)
+
+    def as_dict(self) -> dict:
+        return {
+            'run_id': self.run_id, 'id': self.id, 'parent': self.parent_id, 'depth': self.depth,
+            'name': self.name, 'start': self.start, 'duration': round(self.duration, 4),
+            'outcome': self.outcome, 'error': self.error, 'attrs': self.attrs
+        }
+
+
+class Tracer:
+
+    def __init__(self):
+        self.spans: list[dict] = []
+        self._lock = Lock()
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        parent = _current.get()
+        span = Span(name, parent.run_id if parent else None, parent, attrs)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(e)
+            raise
+        else:
+            span.finish()
+        finally:
+            _current.reset(token)
+            with self._lock:
+                self.__collector().append(span.as_dict())
+
+    def __collector(self) -> list:
+        spans = _run_spans.get()
+        return self.spans if spans is None else spans
+
+    @contextmanager
+    def run(self, name: str, run_log: str | None = None, spans: list | None = None):
+        """
+        Root span of the run, the spans of the run are written to the run log after it
+        :param spans: list collecting the spans of the run, e.g. to send them to the coordinator of the fleet
+        """
+
+        spans = [] if spans is None else spans
+        tokens = _current.set(None), _run_spans.set(spans)
+        try:
+            with self.span(name) as root:
+                root.run_id = root.start
+                yield root
+        finally:
+            _current.reset(tokens[0])
+            _run_spans.reset(tokens[1])
+            for span in spans:
+                span['run_id'] = root.run_id
+            with self._lock:
+                self.spans = spans
+            if run_log:
+                self.write(run_log, spans)
+            from service import log
+            log.info(f'Run timings:\n{summary_table(spans)}')
+
+    @staticmethod
+    def annotate(**attrs):
+        """Add attributes to the current span"""
+
+        if span := _current.get():
+            span.attrs.update(attrs)
+
+    @staticmethod
+    def fail(reason: str):
+        """Mark the current span as failed without an exception"""
+
+        if span := _current.get():
+            span.outcome, span.error = 'failed', reason
+
+    def adopt(self, spans: list):
+        """Add the spans recorded in another process under the current span"""
+
+        parent = _current.get()
+        with self._lock:
+            for span in spans:
+                if span['parent'] is None and parent:
+                    span['parent'], span['depth'] = parent.id, parent.depth + 1
+                elif parent:
+                    span['depth'] += parent.depth + 1
+                self.__collector().append(span)
+
+    def pop_spans(self) -> list:
+        with self._lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+    def write(self, run_log: str, spans: list | None = None):
+        with open(run_log, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(span, ensure_ascii=False, default=str) + '\n'
+                         for span in (self.spans if spans is None else spans))
+
+    def summary(self) -> str:
+        return summary_table(self.spans)
+
+
+def traced(name: str):
+    """Record the function call as a span, a False result marks the span as failed"""
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                result = function(*args, **kwargs)
+                if result is False:
+                    tracer.fail('returned False')
+                return result
+        return wrapper
+    return decorator
+
+
+def summary_table(spans: list) -> str:
+    stats = {}
+    for span in sorted(spans, key=lambda s: s['start']):
+        s = stats.setdefault(span['name'], {'count': 0, 'total': 0.0, 'max': 0.0, 'failed': 0,
+                                            'depth': span['depth']})
+        s['count'] += 1
+        s['total'] += span['duration']
+        s['max'] = max(s['max'], span['duration'])
+        s['failed'] += span['outcome'] != 'ok'
+
+    lines = [f"{'span':<40}{'count':>7}{'total, s':>10}{'avg, s':>9}{'max, s':>9}{'failed':>8}"]
+    for name, s in stats.items():
+        lines.append(f"{'  ' * s['depth'] + name:<40}{s['count']:>7}{s['total']:>10.2f}"
+                     f"{s['total'] / s['count']:>9.2f}{s['max']:>9.2f}{s['failed']:>8}")
+    return '\n'.join(lines)
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile of the sorted values"""
+    return values[max(0, min(len(values) - 1, math.ceil(p * len(values) / 100) - 1))]
+
+
+def run_stats(run_log: str) -> dict:
+    """Percentiles of the span durations across all runs of the run log"""
+
+    durations = {}
+    with open(run_log, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                durations.setdefault(span['name'], []).append(span['duration'])
+
+    stats = {}
+    for name, values in durations.items():
+        values.sort()
+        stats[name] = {'count': len(values), **{f'p{p}': percentile(values, p) for p in (50, 90, 95, 99)}}
+    return stats
+
+
+def stats_table(stats: dict) -> str:
+    lines = [f"{'span':<40}{'count':>7}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}"]
+    for name, s in sorted(stats.items()):
+        lines.append(f"{name:<40}{s['count']:>7}{s['p50']:>9.2f}{s['p90']:>9.2f}{s['p95']:>9.2f}{s['p99']:>9.2f}")
+    return '\n'.join(lines)
+
+
+tracer = Tracer()
+
+
+if __name__ == '__main__':
+    print(stats_table(run_stats(sys.argv[1] if len(sys.argv) > 1 else 'run_log.jsonl')))
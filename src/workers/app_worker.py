@@ -1,29 +1,94 @@
 from service import config, log, ERRORS, Helper
-from pywinauto.application import Application, AppStartError, ProcessNotFoundError
-from pywinauto.findbestmatch import MatchError
-from time import sleep
+from drivers import get_driver
+from .waiter import Waiter, WaitSteps, WaitTimeout, WaitCancelled
+from .locators import Locators, DirectReader, SnapshotReader
+from tracing import traced
+from supervisor import get_supervisor
+from threading import RLock
 import re
 
 
+class ReaderControl:
+    """Control read through the reader of the worker, e.g. by the wait conditions of waiter.py"""
+
+    def __init__(self, worker: 'AppWorker', name: str):
+        self.worker = worker
+        self.name = name
+
+    def window_text(self) -> str:
+        self.worker.refresh_reader()
+        return self.worker.reader.text(self.name)
+
+
 class AppWorker:
     """
     Class for the working with windows applications
     """
 
-    def __init__(self):
+    # clicks and typing need the foreground input focus, concurrently running workers take turns by this lock
+    focus_lock = RLock()
+
+    # controls of the main dialog {name: best-match key or child_window criteria}, see Locators
+    LOCATORS = {}
+
+    def __init__(self, program_obj=None):
+        """
+        :param program_obj: already running application instance, if None the program is launched
+        """
+
         self.program_name = self.__class__.__name__.replace('Worker', '')
         self.app_conf = config[self.program_name]
-        self.program_obj = self.launch(self.app_conf['program_path'], self.app_conf['launch_type'])
+        self.waiter = Waiter(interval=self.app_conf.getfloat('wait_interval', fallback=0.2),
+                             max_interval=self.app_conf.getfloat('wait_max_interval', fallback=5.0))
+        self.steps = WaitSteps(self.app_conf, self.waiter, get_supervisor(), self.program_name)
+        self.program_obj = program_obj or self.launch(self.app_conf['program_path'], self.app_conf['launch_type'])
 
-        if isinstance(self.program_obj, Application):
+        if self.program_obj is not None:
             self.main_dlg = self.program_obj['Dialog']
+            self.ui = Locators(self.main_dlg, self.LOCATORS)
+            self.reader = self.make_reader()
+
+    def make_reader(self) -> DirectReader:
+        """With 'snapshot' on, the wait loops read the dialog controls from one capture of the dialog per check"""
+
+        if self.app_conf.getboolean('snapshot', fallback=False):
+            return SnapshotReader(self.ui, get_driver())
+        return DirectReader(self.ui)
+
+    def refresh_reader(self):
+        try:
+            self.reader.refresh()
+        except Exception:
+            log.exception(f'{self.program_name}: the dialog capture failed, the controls are read directly')
+            self.reader = DirectReader(self.ui)
+
+    def read_control(self, name: str) -> ReaderControl:
+        return ReaderControl(self, name)
+
+    @classmethod
+    def find_running(cls):
+        """Connect to the program instance left running by the previous run"""
+
+        app_conf = config[cls.__name__.replace('Worker', '')]
+        program_path = app_conf['program_path']
+        if app_conf['launch_type'] == 'manual':
+            program_path = Helper.get_file_name(program_path)
+        return cls.try_connect(program_path)
+
+    def is_alive(self) -> bool:
+        """Health check before the reuse of the application instance"""
+
+        try:
+            return bool(self.program_obj.is_process_running() and self.main_dlg.exists(timeout=0))
+        except Exception:
+            return False
 
     @staticmethod
     def connect(program: str):
         """Method for connecting to an opened program"""
 
         try:
-            return Application(backend='uia').connect(path=program)
+            return get_driver().connect(program)
         except FileNotFoundError:
             log.exception(f'Fail connection to  {program}')
 
@@ -33,7 +98,7 @@ class AppWorker:
         :param program_path: the full program path
         :param launch_type: if value == 'normal' an application will be started by calling the executable file
                             if value == 'manual' an application will be started by double-click on program folder
-        :return: the instance of Application class type
+        :return: the application instance of the UI driver
         """
 
         launch_types = {
@@ -43,17 +108,17 @@ class AppWorker:
 
         try:
             return launch_types[launch_type](program_path)
-        except (AppStartError, ProcessNotFoundError, MatchError):
+        except get_driver().start_errors:
             log.exception(ERRORS.get('file_not_found').format(file=self.program_name))
 
     @staticmethod
-    def __normal_launch(program_path) -> Application:
+    def __normal_launch(program_path):
         """Description in launch() doc"""
 
-        app = Application(backend='uia').start(program_path)
+        app = get_driver().start(program_path)
         return app
 
-    def __manual_launch(self, program_path: str) -> Application:
+    def __manual_launch(self, program_path: str):
         """Description in launch() doc"""
 
         file_parse_dict = Helper.parse_file_path(program_path)
@@ -61,33 +126,62 @@ class AppWorker:
         explorer = self.connect('explorer.exe')
         dlg = explorer[file_parse_dict.get('folder_name')]
         dlg[file_parse_dict['file_name']].click_input(double=True)
-        sleep(5)
+        program = self.steps.until('manual_launch', lambda: self.try_connect(file_parse_dict['file_name']), 30)
         explorer.kill()
-        return self.connect(file_parse_dict['file_name'])
+        return program
 
+    @staticmethod
+    def try_connect(program: str):
+        """Connect to the program if its process is already started"""
+
+        return get_driver().try_connect(program)
+
+    @traced('wait_process')
     def _wait_process(self,
                       finish_comp: str = None,
                       error_comp: str = None,
-                      progress_field: str = None) -> bool:
+                      progress_field: str = None,
+                      timeout: float | None = None,
+                      key: str | None = None) -> bool:
         """
-        param progress_field:
-        :return: True - if finished after the progress bar is full,
-                 False - if finished after closing the pop-up window completion
+        Wait for the end of the application process
+        :param finish_comp: pop-up window shown on completion
+        :param error_comp: pop-up window shown on error
+        :param progress_field: field with the percentage of the progress
+        :param timeout: seconds before the wait is aborted,
+                        default - 'process_timeout' or 'wait_timeout' from the app config,
+                        shortened to the timeout learned by the supervisor
+        :param key: history key of the wait, e.g. the process of one meter, default - 'process'
+        :return: True - if finished after the progress bar is full or after closing the pop-up window completion,
+                 False - if finished after closing the pop-up window error or the wait was aborted
         """
 
-        while True:
-            progress_str = re.sub("[^0-9]", "", self.main_dlg[progress_field].window_text())
-            progress = int(progress_str) if len(progress_str) > 0 else 0
-            if progress >= 100:
-                break
-            if finish_comp and self.main_dlg[finish_comp].exists():
-                self.main_dlg.OKButton.click_input()
-                break
-            if error_comp and self.main_dlg[error_comp].exists():
+        def progress_state():
+            self.refresh_reader()
+            if progress_field:
+                progress_str = re.sub("[^0-9]", "", self.reader.text(progress_field))
+                if progress_str and int(progress_str) >= 100:
+                    return 'done'
+            if finish_comp and self.reader.exists(finish_comp):
+                return 'finished'
+            if error_comp and self.reader.exists(error_comp):
+                return 'error'
+            return None
+
+        if timeout is None:
+            timeout = self.app_conf.getfloat('wait_timeout', fallback=None)
+
+        try:
+            state = self.steps.until('process', progress_state, timeout, key=key, failures=('error',))
+        except (WaitTimeout, WaitCancelled) as e:
+            log.exception(ERRORS.get('wait_aborted').format(program=self.program_name, reason=e))
+            return False
+
+        log.info(f'{self.program_name} process wait stats: {self.waiter.history[-1]}')
+        if state in ('finished', 'error'):
+            with self.focus_lock:
                 self.main_dlg.OKButton.click_input()
-                return False
-            sleep(5)
-        return True
+        return state != 'error'
 
     def work(self):
         pass
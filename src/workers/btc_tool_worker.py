@@ -1,42 +1,80 @@
-from service import config, Helper, log
-from time import sleep
+from service import config, Helper, log, ERRORS
 from .app_worker import AppWorker
+from .waiter import exists, enabled, any_of
+from .scan_store import ScanStore
+from tracing import traced
 
 
 class BtcToolsWorker(AppWorker):
 
+    LOCATORS = {
+        'no_button': 'NoButton',
+        'scan_button': 'ScanButton',
+        'export_button': 'ExportButton',
+        'header': 'Header5',
+        'progress': 'Progress'
+    }
+
     def work(self) -> bool:
         """Retrieve data on all devices in the network and save it in Excel format"""
         try:
             self.__scan_net()
             self.__export_scan()
             self.__save_scan()
+            self.ingest_scans()
             return True
         except Exception as e:
             log.exception(e)
             return False
 
+    @traced('btctools.ingest')
+    def ingest_scans(self):
+        """Ingest the new exports of 'export_path' into the scan store, if 'store_path' is set in config"""
+
+        if not (self.app_conf.get('store_path') and self.app_conf.get('export_path')):
+            return
+        try:
+            store = ScanStore(self.app_conf['store_path'])
+            ingested = store.ingest_folder(self.app_conf['export_path'])
+            log.info(f'Scan exports ingested: {ingested}')
+            if ingested and (offline := store.gone_offline()):
+                log.warning(f"Devices gone offline since the previous scan: {[d['ip'] for d in offline]}")
+            store.close()
+        except Exception as e:
+            log.exception(f'Scan ingestion exception: {e}')
+
+    @traced('btctools.scan')
     def __scan_net(self):
-        sleep(5)
-        if self.main_dlg.NoButton:
-            self.main_dlg.NoButton.click_input()
-        self.main_dlg.ScanButton.click_input()
-        self._wait_process(finish_comp='Dialog', progress_field='Progress')
-        sleep(1)
+        self.ui.validate()
+        self.steps.until('scan_ready', any_of(exists(self.ui.spec('no_button')), enabled(self.ui.spec('scan_button'))), 5)
+        with self.focus_lock:
+            if self.ui.spec('no_button').exists(timeout=0):
+                self.ui.spec('no_button').click_input()
+            self.ui['scan_button'].click_input()
+        if not self._wait_process(finish_comp='Dialog', progress_field='progress'):
+            # a partial scan must not be exported as the result of the run
+            raise RuntimeError(ERRORS.get('wait_aborted').format(program=self.program_name,
+                                                                  reason='the scan is not completed'))
+        self.steps.until('scan_finish', enabled(self.ui.spec('export_button')), 5)
 
+    @traced('btctools.export')
     def __export_scan(self):
-        self.main_dlg.Header5.click_input()
-        self.main_dlg.ExportButton.click_input()
-        modal = self.program_obj['Dialog']
-        sleep(1)
-        today = Helper.get_cur_date('_dd_mm')
-        modal[str(config['BtcTools']['data_folder'])].click_input(button='left', double=True)
-        modal.ComboBox0.type_keys(f'scan{today}')
-        modal.SaveButton.click_input()
+        with self.focus_lock:
+            self.ui['header'].click_input()
+            self.ui['export_button'].click_input()
+            modal = self.program_obj['Dialog']
+            folder = modal[str(config['BtcTools']['data_folder'])]
+            self.steps.until('export_dialog', exists(folder), 5)
+            today = Helper.get_cur_date('_dd_mm')
+            folder.click_input(button='left', double=True)
+            modal.ComboBox0.type_keys(f'scan{today}')
+            modal.SaveButton.click_input()
 
+    @traced('btctools.save')
     def __save_scan(self,):
         save_window = self.program_obj['Dialog']
-        if save_window.YesButton:
-            save_window.YesButton.click_input()
-        elif save_window.OkButton:
-            save_window.OkButton.click_input()
+        with self.focus_lock:
+            if save_window.YesButton:
+                save_window.YesButton.click_input()
+            elif save_window.OkButton:
+                save_window.OkButton.click_input()
@@ -0,0 +1,235 @@
+"""
+Consumption analytics over the meter readings written by ExcelWriter: every sheet is a matrix of dates x meters.
+The sheets are read once into NumPy arrays and cached in '<workbook>.analytics.npz',
+the cache is valid while the workbook has the same modification time and size.
+reset_energy holds the cumulative energy, its daily consumption is the difference of the readings,
+previous_day holds the consumption of the day before the row date
+"""
+from collections import namedtuple
+from datetime import date, datetime
+from service import log
+from .excel_append import WorkbookIndex
+import numpy as np
+import os
+import warnings
+
+SHEETS = ('reset_energy', 'previous_day')
+CUMULATIVE = ('reset_energy',)
+PERIODS = {'day': 'D', 'week': 'W', 'month': 'M', 'year': 'Y'}
+
+# dates x meters matrix, dates - datetime64[D], meters - meter numbers
+Series = namedtuple('Series', 'dates meters values')
+
+
+def parse_date(value) -> np.datetime64 | None:
+    """Row date of the sheet: 'dd.mm.yyyy' or a date cell"""
+
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return np.datetime64(value, 'D')
+    if isinstance(value, str):
+        try:
+            return np.datetime64(datetime.strptime(value.strip(), '%d.%m.%Y').date(), 'D')
+        except ValueError:
+            return None
+    return None
+
+
+def to_number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def read_sheet(sheet, meters_row: int, meters_columns: range) -> Series:
+    """Dates and readings of the sheet sorted by date, the last row of a repeated date is kept"""
+
+    first, last = meters_columns.start, meters_columns.stop - 1
+    header = next(sheet.iter_rows(min_row=meters_row, max_row=meters_row, min_col=first, max_col=last,
+                                  values_only=True), ())
+    columns = [i for i, meter in enumerate(header) if meter is not None]
+    meters = np.array([str(header[i]) for i in columns])
+
+    dates, rows = [], []
+    for row in sheet.iter_rows(min_row=meters_row + 1, max_col=last, values_only=True):
+        if not row or (day := parse_date(row[0])) is None:
+            continue
+        values = row[first - 1:]
+        dates.append(day)
+        rows.append([to_number(values[i]) if i < len(values) else np.nan for i in columns])
+
+    dates = np.array(dates, dtype='datetime64[D]')
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns))
+    # stable sort, then the last of the equal dates
+    order = np.argsort(dates, kind='stable')
+    dates, values = dates[order], values[order]
+    keep = np.append(dates[1:] != dates[:-1], True) if len(dates) else np.array([], dtype=bool)
+    return Series(dates[keep], meters, values[keep])
+
+
+class ConsumptionHistory:
+    """Readings of the sheets and the vectorized reports over them"""
+
+    def __init__(self, sheets: dict[str, Series]):
+        self.sheets = sheets
+
+    @staticmethod
+    def cache_path(data_path: str) -> str:
+        return f'{data_path}.analytics.npz'
+
+    @classmethod
+    def load(cls, data_path: str, meters_row: int, meters_columns: range, sheets=SHEETS) -> 'ConsumptionHistory':
+        """The history from the cache if it is valid, otherwise from the workbook, then the cache is rewritten"""
+
+        stamp = WorkbookIndex.file_stamp(data_path)
+        if (history := cls.load_cache(cls.cache_path(data_path), stamp, sheets)) is not None:
+            return history
+        history = cls.read_workbook(data_path, meters_row, meters_columns, sheets)
+        try:
+            history.save_cache(cls.cache_path(data_path), stamp)
+        except OSError as e:
+            log.warning(f'Consumption cache is not saved: {e}')
+        return history
+
+    @classmethod
+    def from_config(cls, configuration, data_path: str | None = None) -> 'ConsumptionHistory':
+        return cls.load(data_path or configuration['Mercury']['data_path'],
+                        int(configuration['Excel']['meter_index_row']), configuration.meter_columns)
+
+    @classmethod
+    def read_workbook(cls, data_path: str, meters_row: int, meters_columns: range, sheets=SHEETS):
+        import openpyxl
+
+        wb = openpyxl.load_workbook(data_path, read_only=True, data_only=True)
+        try:
+            return cls({name: read_sheet(wb[name], meters_row, meters_columns)
+                        for name in sheets if name in wb.sheetnames})
+        finally:
+            wb.close()
+
+    @classmethod
+    def load_cache(cls, path: str, stamp: list, sheets=SHEETS) -> 'ConsumptionHistory | None':
+        try:
+            with np.load(path) as cache:
+                if cache['stamp'].tolist() != stamp or not set(sheets) <= set(cache['sheets'].tolist()):
+                    return None
+                return cls({name: Series(cache[f'{name}.dates'], cache[f'{name}.meters'], cache[f'{name}.values'])
+                            for name in cache['sheets'].tolist() if name in sheets})
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save_cache(self, path: str, stamp: list):
+        arrays = {'stamp': np.array(stamp, dtype=np.int64), 'sheets': np.array(list(self.sheets))}
+        for name, series in self.sheets.items():
+            arrays.update({f'{name}.dates': series.dates, f'{name}.meters': series.meters,
+                           f'{name}.values': series.values})
+        temp_path = f'{path}.tmp.npz'
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, path)
+
+    def daily(self, sheet: str = 'reset_energy') -> Series:
+        """
+        Consumption of every meter by the calendar days from the first to the last date of the sheet.
+        A cumulative reading is compared with the last known reading of the same meter and the difference
+        is spread evenly over the days between them, so the missed readings of a meter (empty cells)
+        and the missed rows don't change the totals
+        """
+
+        series = self.sheets[sheet]
+        dates, values = series.dates, series.values
+        if sheet not in CUMULATIVE:
+            # the row holds the consumption of the day before its date
+            if not len(dates):
+                return series
+            calendar = np.arange(dates[0] - 1, dates[-1])
+            daily = np.full((len(calendar), values.shape[1]), np.nan)
+            daily[(dates - dates[0]).astype(np.int64)] = values
+            return Series(calendar, series.meters, daily)
+
+        rows, meters = values.shape
+        if rows < 2:
+            return Series(dates[:0], series.meters, values[:0])
+        known = ~np.isnan(values)
+        positions = np.arange(rows)[:, None]
+        # the last known reading at or before every row and the first known one at or after it, per meter
+        previous = np.maximum.accumulate(np.where(known, positions, -1), axis=0)
+        following = np.minimum.accumulate(np.where(known, positions, rows)[::-1], axis=0)[::-1]
+
+        calendar = np.arange(dates[0] + 1, dates[-1] + 1)
+        row = np.searchsorted(dates, calendar)
+        before, after = previous[row - 1], following[row]
+        found = (before >= 0) & (after < rows)
+        before, after = np.where(found, before, 0), np.where(found, after, 0)
+        columns = np.arange(meters)
+        days = (dates[after] - dates[before]).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            daily = (values[after, columns] - values[before, columns]) / days
+        return Series(calendar, series.meters, np.where(found, daily, np.nan))
+
+    @staticmethod
+    def rolling_mean(series: Series, window: int = 7, min_count: int = 1) -> Series:
+        """Mean of the last 'window' days of every meter, the missing values are skipped"""
+
+        known = ~np.isnan(series.values)
+        sums = np.cumsum(np.where(known, series.values, 0.0), axis=0)
+        counts = np.cumsum(known, axis=0)
+        sums[window:] = sums[window:] - sums[:-window]
+        counts[window:] = counts[window:] - counts[:-window]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts >= min_count, sums / counts, np.nan)
+        return Series(series.dates, series.meters, means)
+
+    @staticmethod
+    def outliers(series: Series, threshold: float = 3.5) -> np.ndarray:
+        """
+        Outlier flags of the matrix: the robust z-score of the value among the values of its meter
+        is over the threshold, or the consumption is negative (the meter was reset or replaced)
+        """
+
+        values = series.values
+        if not values.size:
+            return np.zeros(values.shape, dtype=bool)
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            # the columns of the meters without readings are all NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            # the nan-aware functions are several times slower, they are used only for the gaps
+            gaps = np.isnan(values).any()
+            median, mean = (np.nanmedian, np.nanmean) if gaps else (np.median, np.mean)
+            center = median(values, axis=0)
+            deviations = np.abs(values - center)
+            scale = median(deviations, axis=0) * 1.4826
+            # more than half of the values are equal: the mean absolute deviation is the scale
+            scale = np.where(scale > 0, scale, mean(deviations, axis=0) * 1.2533)
+            scores = deviations / np.where(scale > 0, scale, np.inf)
+            return (scores > threshold) | (values < 0)
+
+    @staticmethod
+    def totals(series: Series, period: str = 'month') -> Series:
+        """Sum of every meter by the periods: day, week (from Monday), month or year, dates are the period starts"""
+
+        if not len(series.dates):
+            return series
+        if period == 'week':
+            # numpy weeks start on Thursday, the day of the epoch
+            keys = (series.dates + 3).astype('datetime64[W]').astype('datetime64[D]') - 3
+        else:
+            keys = series.dates.astype(f'datetime64[{PERIODS[period]}]').astype('datetime64[D]')
+        starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+        sums = np.add.reduceat(np.nan_to_num(series.values), starts, axis=0)
+        return Series(keys[starts], series.meters, sums)
+
+    def report(self, period: str = 'month', window: int = 7, threshold: float = 3.5) -> dict:
+        """Consumption summary of the reset_energy history"""
+
+        daily = self.daily('reset_energy')
+        flags = self.outliers(daily, threshold)
+        return {
+            'daily': daily,
+            'rolling': self.rolling_mean(daily, window),
+            'outliers': [(str(daily.dates[d]), str(daily.meters[m]), float(daily.values[d, m]))
+                         for d, m in zip(*np.nonzero(flags))],
+            'totals': self.totals(daily, period)
+        }
+
@@ -0,0 +1,313 @@
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+import zipfile
+import hashlib
+import json
+import os
+import re
+
+NS = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+}
+
+# the end of the sheet data: the closing tag or the empty element written by Excel
+SHEET_DATA = re.compile(rb'</sheetData>|<sheetData\s*/>')
+SHEET_DATA_TAIL = 32
+DIMENSION = re.compile(rb'<dimension ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"\s*/>')
+
+
+class HeaderIndex:
+    """Meter number -> column map of a sheet, read once from the meter number row"""
+
+    def __init__(self, columns: dict | None = None, empty: list | None = None):
+        self.columns = columns or {}
+        self.empty = empty or []
+
+    @classmethod
+    def read(cls, sheet, row: int, columns: range):
+        index = cls()
+        for cells in sheet.iter_rows(min_row=row, max_row=row, min_col=columns.start, max_col=columns.stop - 1):
+            for column, cell in enumerate(cells, columns.start):
+                if not cell.value:
+                    index.empty.append(column)
+                elif cell.value not in index.columns:
+                    index.columns[cell.value] = column
+        return index
+
+    def column(self, meter_number) -> int | None:
+        return self.columns.get(meter_number)
+
+    def missing(self, meters) -> list:
+        """Meters without a column"""
+        return [m for m in meters if m not in self.columns]
+
+    def unpolled(self, meters) -> list:
+        """Columns of the meters without data"""
+        return [m for m in self.columns if m not in meters]
+
+    def as_dict(self) -> dict:
+        return {'meters': [[meter, column] for meter, column in self.columns.items()], 'empty': self.empty}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls({meter: column for meter, column in data.get('meters', [])}, data.get('empty', []))
+
+
+class WorkbookIndex:
+    """
+    Sidecar index of the workbook '<workbook>.index.json' with the last row, the last date
+    and the meter columns of every sheet.
+    The index is valid for the workbook file with the same modification time and size,
+    or with the same content hash if the file was only touched or copied
+    """
+
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+        self.path = f'{data_path}.index.json'
+        self.sheets = {}
+        self.headers: dict[str, HeaderIndex] = {}
+        self.loaded = self.__load()
+
+    @staticmethod
+    def file_stamp(data_path: str) -> list:
+        stat = os.stat(data_path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    @staticmethod
+    def file_hash(data_path: str) -> str:
+        digest = hashlib.sha1()
+        with open(data_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def __load(self) -> bool:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if index.get('stamp') != self.file_stamp(self.data_path) and \
+                index.get('hash') != self.file_hash(self.data_path):
+            return False
+        self.sheets = index.get('sheets', {})
+        self.headers = {name: HeaderIndex.from_dict(h) for name, h in index.get('headers', {}).items()}
+        return True
+
+    def rebuild(self, sheet_names, meters_row: int, meters_columns: range):
+        """Read the last rows and the meter columns of the sheets in the streaming mode"""
+
+        import openpyxl
+
+        wb = openpyxl.load_workbook(self.data_path, read_only=True)
+        try:
+            for name in sheet_names:
+                if name not in wb.sheetnames:
+                    continue
+                # the new rows go after the last row with any value, as sheet.max_row of the rewrite,
+                # the last date is the last value of the date column
+                rows, last_date = 0, None
+                for rows, row in enumerate(wb[name].iter_rows(min_col=1, max_col=1), 1):
+                    if row and row[0].value is not None:
+                        last_date = row[0].value
+                self.sheets[name] = {'last_row': max(rows, wb[name].max_row or 0), 'last_date': last_date}
+                self.headers[name] = HeaderIndex.read(wb[name], meters_row, meters_columns)
+        finally:
+            wb.close()
+        self.loaded = True
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'stamp': self.file_stamp(self.data_path),
+                'hash': self.file_hash(self.data_path),
+                'sheets': self.sheets,
+                'headers': {name: h.as_dict() for name, h in self.headers.items()}
+            }, f, default=str)
+
+
+class XlsxAppender:
+    """
+    Append rows to the sheets of an existing xlsx file without loading the workbook.
+    The sheet xml is copied as a stream with the new rows inserted at the end of its data,
+    the other parts of the file are copied as is
+    """
+
+    CHUNK = 1 << 20
+
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+
+    def sheet_parts(self, zin: zipfile.ZipFile) -> dict:
+        """Sheet name -> path of the sheet xml in the archive"""
+
+        workbook = ElementTree.fromstring(zin.read('xl/workbook.xml'))
+        rels = ElementTree.fromstring(zin.read('xl/_rels/workbook.xml.rels'))
+        targets = {rel.get('Id'): rel.get('Target') for rel in rels.findall('rel:Relationship', NS)}
+        parts = {}
+        for sheet in workbook.find('main:sheets', NS):
+            target = targets[sheet.get(f"{{{NS['r']}}}id")]
+            parts[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+        return parts
+
+    @staticmethod
+    def row_xml(row: int, values: dict) -> bytes:
+        """
+        :param row: row number
+        :param values: {column number: value}, str values are written as inline strings
+        """
+
+        from openpyxl.utils import get_column_letter
+
+        cells = []
+        for column in sorted(values):
+            value = values[column]
+            if value is None:
+                continue
+            ref = f'{get_column_letter(column)}{row}'
+            if isinstance(value, str):
+                cells.append(f'<c r="{ref}" t="inlineStr"><is><t>{escape(value)}</t></is></c>')
+            else:
+                cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+        return f'<row r="{row}">{"".join(cells)}</row>'.encode()
+
+    def append(self, rows: dict):
+        """
+        :param rows: {sheet name: [(row number, {column number: value}), ...]}
+        """
+
+        tmp_path = f'{self.data_path}.tmp'
+        try:
+            with zipfile.ZipFile(self.data_path) as zin, \
+                    zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zout:
+                parts = self.sheet_parts(zin)
+                changes = {parts[name]: sheet_rows for name, sheet_rows in rows.items() if sheet_rows}
+                for item in zin.infolist():
+                    if item.filename in changes:
+                        self.__copy_sheet(zin, zout, item, changes[item.filename])
+                    else:
+                        zout.writestr(item, zin.read(item.filename), compress_type=item.compress_type)
+            os.replace(tmp_path, self.data_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def __copy_sheet(self, zin, zout, item, rows: list):
+        from openpyxl.utils import get_column_letter
+
+        rows_xml = b''.join(self.row_xml(row, values) for row, values in rows)
+        last_row = max(row for row, _ in rows)
+        last_column = get_column_letter(max(max(values) for _, values in rows))
+        info = zipfile.ZipInfo(item.filename, item.date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+
+        with zin.open(item) as src, zout.open(info, 'w', force_zip64=True) as dst:
+            buf, head, inserted = b'', True, False
+            for chunk in iter(lambda: src.read(self.CHUNK), b''):
+                buf += chunk
+                if head:
+                    # the dimension precedes the sheet data, the head is read whole to update it
+                    if b'<sheetData' not in buf:
+                        continue
+                    buf = DIMENSION.sub(lambda m: self.__dimension(m, last_row, last_column), buf, count=1)
+                    head = False
+                if not inserted:
+                    if not (match := SHEET_DATA.search(buf)):
+                        # the end tag may be split between the chunks
+                        dst.write(buf[:-SHEET_DATA_TAIL])
+                        buf = buf[-SHEET_DATA_TAIL:]
+                        continue
+                    if match.group() == b'</sheetData>':
+                        buf = buf[:match.start()] + rows_xml + buf[match.start():]
+                    else:
+                        buf = buf[:match.start()] + b'<sheetData>' + rows_xml + b'</sheetData>' + buf[match.end():]
+                    inserted = True
+                dst.write(buf)
+                buf = b''
+            dst.write(buf)
+
+        if not inserted:
+            raise ValueError(f'Sheet data not found in {item.filename}')
+
+    @staticmethod
+    def __dimension(match, last_row: int, last_column: str) -> bytes:
+        first_col, first_row, end_col, end_row = match.groups()
+        end_col = end_col or first_col
+        end_row = int(end_row or first_row)
+        if (len(last_column), last_column.encode()) > (len(end_col), end_col):
+            end_col = last_column.encode()
+        return b'<dimension ref="%s%s:%s%d"/>' % (first_col, first_row, end_col, max(end_row, last_row))
+
+
+def write_streaming(data_path: str, sheets: dict):
+    """
+    Create a workbook in the openpyxl write-only mode, rows are written without keeping them in memory
+    :param sheets: {sheet name: iterable of rows}
+    """
+
+    import openpyxl
+
+    wb = openpyxl.Workbook(write_only=True)
+    for name, rows in sheets.items():
+        sheet = wb.create_sheet(name)
+        for row in rows:
+            sheet.append(row)
+    wb.save(data_path)
+
+
+def is_locked(path: str) -> bool:
+    """The file is opened for writing by another program, e.g. the workbook is open in Excel on Windows"""
+
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except PermissionError:
+        return True
+    except FileNotFoundError:
+        return False
+    os.close(fd)
+    return False
+
+
+def save_atomic(wb, data_path: str):
+    """Save the workbook to a temporary file and replace the workbook by it"""
+
+    tmp_path = f'{data_path}.tmp'
+    try:
+        wb.save(tmp_path)
+        os.replace(tmp_path, data_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class PendingRows:
+    """
+    Data of the days that weren't written because the workbook was locked, kept in '<workbook>.pending.json'
+    and merged into the workbook by the next write
+    """
+
+    def __init__(self, data_path: str):
+        self.path = f'{data_path}.pending.json'
+
+    def load(self) -> dict:
+        """:return: {date: {meter: readings}} in the order of the days"""
+
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                days = json.load(f)
+        except FileNotFoundError:
+            return {}
+        # meters are kept as [meter, readings] pairs, so their numbers aren't turned into strings
+        return {day: {meter: values for meter, values in data} for day, data in days}
+
+    def save(self, days: dict):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([[day, list(data.items())] for day, data in days.items()], f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
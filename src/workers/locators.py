@@ -0,0 +1,151 @@
+from time import perf_counter
+
+
+class Locators:
+    """
+    Named controls of a dialog, resolved by the best-match search once and cached.
+    Workers declare their controls up front as {name: best-match key or child_window criteria},
+    an undeclared name is used as the best-match key itself.
+    The cache is dropped when the dialog window is recreated (its handle changes), see validate().
+    Every tree search is passed to the hooks as hook(name, seconds)
+    """
+
+    def __init__(self, dialog, declared: dict | None = None, hooks=None):
+        self.dialog = dialog
+        self.declared = declared or {}
+        self.hooks = list(hooks or [])
+        self.lookups = {}
+        self._specs = {}
+        self._wrappers = {}
+        self._handle = None
+
+    def spec(self, name: str):
+        """Window specification of the control, it doesn't search the tree until it is used"""
+
+        if name not in self._specs:
+            locator = self.declared.get(name, name)
+            if isinstance(locator, dict):
+                self._specs[name] = self.dialog.child_window(**locator)
+            else:
+                self._specs[name] = self.dialog[locator]
+        return self._specs[name]
+
+    def __getitem__(self, name: str):
+        """Wrapper of the control, the tree is searched on the first access only"""
+
+        if name not in self._wrappers:
+            spec = self.spec(name)
+            started = perf_counter()
+            self._wrappers[name] = spec.wrapper_object() if hasattr(spec, 'wrapper_object') else spec
+            self.record(name, perf_counter() - started)
+        return self._wrappers[name]
+
+    def record(self, name: str, seconds: float):
+        stats = self.lookups.setdefault(name, {'count': 0, 'total': 0.0})
+        stats['count'] += 1
+        stats['total'] += seconds
+        for hook in self.hooks:
+            hook(name, seconds)
+
+    def resolve_all(self):
+        """Resolve all declared controls, e.g. right after the dialog is opened"""
+
+        for name in self.declared:
+            self[name]
+
+    def invalidate(self, name: str | None = None):
+        if name is None:
+            self._wrappers.clear()
+        else:
+            self._wrappers.pop(name, None)
+
+    def validate(self) -> bool:
+        """
+        Drop the cached wrappers if the dialog window was recreated
+        :return: True if the cache is still valid
+        """
+
+        started = perf_counter()
+        try:
+            handle = self.dialog.wrapper_object().handle if hasattr(self.dialog, 'wrapper_object') else id(self.dialog)
+        except Exception:
+            handle = None
+        self.record('<dialog>', perf_counter() - started)
+
+        valid = handle is not None and handle == self._handle
+        if not valid:
+            self.invalidate()
+        self._handle = handle
+        return valid
+
+    def profile(self) -> dict:
+        return {name: {'count': s['count'], 'total': round(s['total'], 3)} for name, s in self.lookups.items()}
+
+
+class DirectReader:
+    """Reads every control by its own call to the application"""
+
+    def __init__(self, locators: Locators):
+        self.ui = locators
+
+    def refresh(self):
+        pass
+
+    def text(self, name: str) -> str:
+        try:
+            return self.ui[name].window_text()
+        except Exception:
+            # the cached wrapper is stale when the window was recreated, search it once again
+            self.ui.invalidate(name)
+            return self.ui[name].window_text()
+
+    def exists(self, name: str) -> bool:
+        return bool(self.ui.spec(name).exists(timeout=0))
+
+
+class SnapshotReader(DirectReader):
+    """
+    Reads the controls from the snapshot of the dialog taken by one driver call per refresh().
+    A control is found in the snapshot by the key of its cached wrapper. The existence of a control is checked
+    by the application, a found control is then trusted until the set of controls changes between the snapshots.
+    A missing one is checked again every time: a pop-up can be a top-level window outside of the dialog subtree,
+    its appearance doesn't change the snapshot
+    """
+
+    def __init__(self, locators: Locators, driver):
+        super().__init__(locators)
+        self.driver = driver
+        self.snapshot = None
+        self.diff = None
+        self.captures = 0
+        self._keys = {}
+        self._exists = {}
+
+    def refresh(self):
+        snapshot = self.driver.capture(self.ui.dialog)
+        self.diff = snapshot.diff(self.snapshot)
+        if self.diff.structural:
+            self._exists.clear()
+        self.snapshot = snapshot
+        self.captures += 1
+
+    def key(self, name: str):
+        if name not in self._keys:
+            self._keys[name] = self.driver.element_key(self.ui[name])
+        return self._keys[name]
+
+    def text(self, name: str) -> str:
+        if self.snapshot is None:
+            self.refresh()
+        state = self.snapshot.get(self.key(name))
+        if state is None:
+            # the control isn't in the snapshot, the window may be recreated
+            self._keys.pop(name, None)
+            return super().text(name)
+        return state.text
+
+    def exists(self, name: str) -> bool:
+        if self._exists.get(name):
+            return True
+        self._exists[name] = super().exists(name)
+        return self._exists[name]
@@ -1,7 +1,12 @@
 from .app_worker import AppWorker
+from .waiter import Waiter, WaitSteps, enabled, text_changed
+from .meter_polling import MeterPoller, MeterTransport, GuiMeterTransport
+from .excel_append import WorkbookIndex, HeaderIndex, XlsxAppender, PendingRows, is_locked, save_atomic
+from .meter_store import MeterStore
+from .poll_journal import PollJournal
 from service import ERRORS, log, Helper, config
-from time import sleep
-import openpyxl
+from tracing import tracer, traced
+from datetime import date
 
 
 class MercuryWorker(AppWorker):
@@ -17,6 +22,16 @@ class MercuryWorker(AppWorker):
             }
         }
 
+    LOCATORS = {
+        'connection_link': 'Параметры связиHyperlink',
+        'meter_edit': 'СчетчикEdit',
+        'access_edit': 'Уровень доступаEdit',
+        'connect_button': '\xa0Соединить\xa0',
+        'progress': 'Static3',
+        'data_link': 'Hyperlink9',
+        'read_button': 'Button1'
+    }
+
     def work(self) -> bool:
         """full process of Mercury.exe work"""
 
@@ -26,24 +41,73 @@ class MercuryWorker(AppWorker):
             log.exception(ERRORS.get('mercury_data_incorrect'))
             return False
 
+        if self.store_data(self.journal.unstored()):
+            self.journal.mark_stored(values_dict)
+
         try:
             ew = ExcelWriter()
-            ew.write_workbook_data(values_dict, self.app_conf['data_path'])
+            ew.write_workbook_data(values_dict, self.app_conf['data_path'], self.journal.resumed)
         except Exception as ex:
             log.exception(f'Excel write exception: {ex}')
+            tracer.annotate(excel_error=repr(ex))
             np = NotepadWriter()
             np.write_data(values_dict, self.app_conf['notepad_data_path'])
         finally:
+            # the journal is kept while a meter failed or the readings aren't in the meter store
+            if not self.journal.failed and not self.journal.unstored():
+                self.journal.complete()
+            return True
+
+    @traced('mercury.store')
+    def store_data(self, values_dict: dict) -> bool:
+        """
+        Append the readings to the local meter store if 'store_path' is set in config
+        :return: False if the store failed, the readings stay unstored in the journal for the next run
+        """
+
+        if not (store_path := self.app_conf.get('store_path')):
+            return True
+        try:
+            store = MeterStore(store_path)
+            store.append(date.today(), values_dict)
+            store.close()
             return True
+        except Exception as ex:
+            log.exception(f'Meter store exception: {ex}')
+            return False
 
+    @traced('mercury.poll')
     def get_data(self) -> dict:
-        """function to get the values of all electricity meters"""
+        """
+        function to get the values of all electricity meters.
+        The readings are checkpointed in the poll journal, a run of the same day polls only the meters
+        that the previous run didn't poll or failed
+        :return: readings of the polled meters, the unavailable meters are missing
+        """
+
+        meters_list = config.meters
+        self.journal = PollJournal(self.app_conf.get('journal_path', 'mercury_journal.jsonl'))
+        pending = self.journal.pending(meters_list)
+        if self.journal.resumed:
+            log.info(f'Poll is resumed: {len(self.journal.readings)} meters are taken from the journal, '
+                     f'{len(pending)} meters are polled')
+        tracer.annotate(meters=len(meters_list), pending=len(pending))
+
+        for meter, values in self.poller().poll(pending):
+            self.journal.record(meter, values)
+
+        if failed := [m for m in meters_list if m in self.journal.failed]:
+            log.warning(ERRORS.get('meters_unpolled').format(meters=failed))
+        return {m: self.journal.readings[m] for m in meters_list if m in self.journal.readings}
 
-        meters_values = {}
-        meters_list = Helper.convert_str_to_list(self.app_conf['meter_indexes'])
-        for meter in meters_list:
-            meters_values[meter] = self.get_meter_data(meter)
-        return meters_values
+    def poller(self, transport: MeterTransport | None = None) -> MeterPoller:
+        """Meter polling pipeline through the application window or the given transport"""
+
+        return MeterPoller(transport or GuiMeterTransport(self),
+                           self.ENERGY_METERS.keys(),
+                           attempts=self.app_conf.getint('poll_attempts', fallback=3),
+                           backoff=self.app_conf.getfloat('poll_backoff', fallback=2.0),
+                           supervisor=self.steps.supervisor)
 
     def get_meter_data(self, meter_id: int) -> dict | None:
         """
@@ -52,34 +116,40 @@ class MercuryWorker(AppWorker):
         :return: Meter value
         """
 
-        values = {}
+        return self.poller().poll_meter(meter_id)
 
-        if not self.connect_to_meter(meter_id):
-            for key in self.ENERGY_METERS.keys():
-                values[key] = 0.0
- 
-        else:
-            for value_type, value_data in self.ENERGY_METERS.items():
-                self.main_dlg[value_data.get('button')].click_input()
-                self.main_dlg.Button1.click_input()
-                sleep(3)
-                value = self.main_dlg[value_data.get('field')].window_text()
-                try:
-                    values[value_type] = float(value)
-                except (ValueError, TypeError) as e:
-                    log.exception(f"Can't get {value_type} from meter index: {value}. Exception: {e}")
-
-        return values
+    @traced('mercury.read_value')
+    def read_value(self, value_type: str) -> float:
+        """read one value of the connected meter"""
+
+        value_data = self.ENERGY_METERS[value_type]
+        field = self.read_control(value_data.get('field'))
+        with self.focus_lock:
+            self.ui[value_data.get('button')].click_input()
+            new_value = text_changed(field)
+            self.ui['read_button'].click_input()
+        # the same value as the previous meter gives no text change, so the timeout isn't an error
+        self.steps.until('meter_value', new_value, 3, required=False)
+        value = self.reader.text(field.name)
+        try:
+            return float(value)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Can't get {value_type} from meter index: {value}") from e
 
+    @traced('mercury.connect')
     def connect_to_meter(self, meter_id):
-        self.main_dlg['Параметры связиHyperlink'].click_input()
-        sleep(1)
-        self.main_dlg['СчетчикEdit'].set_text(u'')
-        self.main_dlg['СчетчикEdit'].type_keys(f'{meter_id}')
-        self.main_dlg['Уровень доступаEdit'].set_text(u'111111')
-        self.main_dlg['\xa0Соединить\xa0'].click_input()
-        if self._wait_process(error_comp='Ошибка!', progress_field='Static3'):
-            self.main_dlg.Hyperlink9.click_input()
+        tracer.annotate(meter=meter_id)
+        self.ui.validate()
+        with self.focus_lock:
+            self.ui['connection_link'].click_input()
+            self.steps.until('connection_form', enabled(self.ui.spec('meter_edit')), 1)
+            self.ui['meter_edit'].set_text(u'')
+            self.ui['meter_edit'].type_keys(f'{meter_id}')
+            self.ui['access_edit'].set_text(u'111111')
+            self.ui['connect_button'].click_input()
+        if self._wait_process(error_comp='Ошибка!', progress_field='progress', key=f'connect.{meter_id}'):
+            with self.focus_lock:
+                self.ui['data_link'].click_input()
             return True
         return False
 
@@ -87,90 +157,201 @@ class MercuryWorker(AppWorker):
 class ExcelWriter:
 
     ENERGY_METERS = ['previous_day', 'reset_energy']
+    UNLOCK_TIMEOUT = 60
 
     def __init__(self):
         self.app_conf = config['Excel']
         self.meters_row = int(self.app_conf['meter_index_row'])
-        self.meters_columns = range(int(self.app_conf['meter_index_col_first']),
-                                    int(self.app_conf['meter_index_col_last']))
+        self.meters_columns = config.meter_columns
+        # the lock is checked with a growing interval, Excel may keep the file open for a while
+        self.steps = WaitSteps(self.app_conf, Waiter(interval=0.5, max_interval=10.0, backoff=2.0))
 
     @classmethod
-    def check_last_date(cls, wb: openpyxl.load_workbook, sheet: str) -> bool:
+    def check_last_date(cls, wb: 'openpyxl.Workbook', sheet: str, day: str | None = None) -> bool:
         sheet = wb[sheet]
         last_row = sheet.max_row
         last_date = sheet.cell(row=last_row, column=1).value
-        if last_date == Helper.get_cur_date('dd.mm.yyyy'):
+        if last_date == (day or Helper.get_cur_date('dd.mm.yyyy')):
+            return False
+        return True
+
+    @traced('excel.write')
+    def write_workbook_data(self, data: dict, data_path: str, resumed: bool = False):
+        """
+        Recording dict data to Excel row by keys.
+        The workbook is replaced by a fully written temporary file. If it stays locked (open in Excel)
+        for 'workbook_unlocked_timeout' seconds, the data is kept in the pending rows, they are merged
+        by flush_pending() as soon as the workbook is free or by the next run
+        :param resumed: the data of a resumed poll, the missing values of today's row are added
+        """
+
+        pending = PendingRows(data_path)
+        days = pending.load()
+        today = Helper.get_cur_date('dd.mm.yyyy')
+        days[today] = {**days.get(today, {}), **data}
+        if len(days) > 1:
+            log.info(f'Pending Excel data of {list(days)[:-1]} is merged into the workbook')
+
+        if not self.steps.until('workbook_unlocked', lambda: not is_locked(data_path), self.UNLOCK_TIMEOUT,
+                              required=False):
+            pending.save(days)
+            log.warning(ERRORS.get('workbook_locked').format(file=data_path))
+            return
+        self.write_days(days, data_path, pending, resumed)
+
+    @traced('excel.flush')
+    def flush_pending(self, data_path: str) -> bool:
+        """
+        Merge the pending rows into the workbook if it isn't locked now, called between the scheduled runs
+        :return: True if the pending rows were written
+        """
+
+        pending = PendingRows(data_path)
+        if not (days := pending.load()) or is_locked(data_path):
             return False
+        log.info(f'Pending Excel data of {list(days)} is merged into the unlocked workbook')
+        return self.write_days(days, data_path, pending)
+
+    def write_days(self, days: dict, data_path: str, pending: PendingRows, resumed: bool = False) -> bool:
+        """
+        :param days: {date: {meter: readings}}, a row is written for every date
+        :return: False if the workbook is locked, the days are kept in the pending rows
+        """
+
+        index = self.workbook_index(data_path)
+        self.report_headers(index, days[list(days)[-1]])
+        try:
+            if not self.append_workbook_data(days, data_path, index, resumed):
+                import openpyxl
+
+                wb = openpyxl.load_workbook(data_path)
+                for day, day_data in days.items():
+                    for meter_type in self.ENERGY_METERS:
+                        self.write_sheet_data(wb, day_data, meter_type, index, day)
+                self.save_data(wb, data_path)
+                index.save()
+        except PermissionError:
+            pending.save(days)
+            log.warning(ERRORS.get('workbook_locked').format(file=data_path))
+            return False
+        pending.clear()
+        log.info(f'Excel wait profile: {self.steps.profile()}')
         return True
 
-    def write_workbook_data(self, data: dict, data_path: str):
-        """Recording dict data to Excel row by keys"""
+    @traced('excel.index')
+    def workbook_index(self, data_path: str) -> WorkbookIndex:
+        """Last rows and meter columns of the sheets, read from the workbook only if it was changed"""
+
+        index = WorkbookIndex(data_path)
+        if not index.loaded:
+            index.rebuild(self.ENERGY_METERS, self.meters_row, self.meters_columns)
+        return index
+
+    @staticmethod
+    def report_headers(index: WorkbookIndex, data: dict):
+        for meter_type, headers in index.headers.items():
+            if headers.empty:
+                log.warning(f"{meter_type}: incorrect meter number in excel file columns {headers.empty}")
+            if missing := headers.missing(data):
+                log.warning(f"{meter_type}: meters {missing} have no column in excel file")
+            if unpolled := headers.unpolled(data):
+                log.warning(f"{meter_type}: data of the meters {unpolled} doesn't exists")
+
+    @traced('excel.append')
+    def append_workbook_data(self, days: dict, data_path: str, index: WorkbookIndex, resumed: bool = False) -> bool:
+        """
+        Append the new rows without loading and saving the whole workbook ('write_mode = append' in config).
+        The last rows and the meter columns are taken from the sidecar index
+        :param days: {date: {meter: readings}}, a row is appended for every date
+        :param resumed: the data completes the row written today by an interrupted poll
+        :return: False if the append mode is off or failed, then the workbook should be rewritten
+        """
+
+        if self.app_conf.get('write_mode', 'append') != 'append':
+            return False
+
+        try:
+            rows, last_dates = {}, {}
+            for meter_type in self.ENERGY_METERS:
+                if not (sheet := index.sheets.get(meter_type)):
+                    log.info(f"Sheet {meter_type} doesn't exists")
+                    continue
+                row, last_date = sheet['last_row'], sheet['last_date']
+                for day, data in days.items():
+                    if day == last_date:
+                        log.info(f"{meter_type} data on the {day} exists")
+                        if resumed:
+                            # the row of the interrupted run is completed by the rewrite
+                            return False
+                        continue
+                    row, last_date = row + 1, day
+                    values = {1: day}
+                    headers = index.headers[meter_type]
+                    for meter_number, meter_data in data.items():
+                        if meter_data and (column := headers.column(meter_number)) is not None:
+                            values[column] = meter_data.get(meter_type)
+                    rows.setdefault(meter_type, []).append((row, values))
+                    last_dates[meter_type] = day
 
-        self.close_workbook(config['Excel']['program_path'], config['Mercury']['data_path'])
-        wb = openpyxl.load_workbook(data_path)
-        for meter_type in self.ENERGY_METERS:
-            self.write_sheet_data(wb, data, meter_type)
-        self.save_data(wb, data_path)
+            if rows:
+                XlsxAppender(data_path).append(rows)
+                for meter_type, sheet_rows in rows.items():
+                    index.sheets[meter_type] = {'last_row': sheet_rows[-1][0], 'last_date': last_dates[meter_type]}
+                index.save()
+            return True
+        except PermissionError:
+            raise
+        except Exception as e:
+            log.warning(f"Excel append exception: {e}. The workbook will be rewritten")
+            return False
 
-    def write_sheet_data(self, wb: openpyxl.load_workbook, data: dict, meter_type):
-        current_date = Helper.get_cur_date('dd.mm.yyyy')
+    def write_sheet_data(self, wb: 'openpyxl.Workbook', data: dict, meter_type, index: WorkbookIndex,
+                         day: str | None = None):
+        current_date = day or Helper.get_cur_date('dd.mm.yyyy')
 
         if meter_type not in wb.sheetnames:
             log.info(f"Sheet {meter_type} doesn't exists")
             return
         sheet = wb[meter_type]
         last_row = sheet.max_row
-        if not self.check_last_date(wb, meter_type):
-            log.info(f"{meter_type} data on the {current_date} exists")
-            return
-        date_cell = sheet.cell(row=last_row + 1, column=1)
-        date_cell.value = current_date
+        headers = index.headers.get(meter_type) or HeaderIndex.read(sheet, self.meters_row, self.meters_columns)
+        if self.check_last_date(wb, meter_type, current_date):
+            date_cell = sheet.cell(row=last_row + 1, column=1)
+            date_cell.value = current_date
+        else:
+            # the row of a resumed poll: only the meters missing in it are written
+            log.info(f"{meter_type} data on the {current_date} exists, the missing values are added")
+            last_row -= 1
+            data = {meter_number: meter_data for meter_number, meter_data in data.items()
+                    if (column := headers.column(meter_number)) is not None
+                    and sheet.cell(row=last_row + 1, column=column).value is None}
 
-        for column in self.meters_columns:
-            self.write_cell_data(data, sheet, meter_type, column, last_row)
+        for meter_number, meter_data in data.items():
+            self.write_cell_data(meter_data, sheet, meter_type, headers.column(meter_number), last_row)
+        index.sheets[meter_type] = {'last_row': last_row + 1, 'last_date': current_date}
 
-    def write_cell_data(self, data, sheet, meter_type, column, row):
-        meter_number = sheet.cell(row=self.meters_row, column=column).value
-        if not meter_number:
-            log.warning(f"Incorrect meter number in excel file")
-            return
-        if not (meter_data := data.get(meter_number)):
-            log.warning(f"Data of the meter {meter_number} doesn't exists")
+    @staticmethod
+    def write_cell_data(meter_data, sheet, meter_type, column, row):
+        if not meter_data or column is None:
             return
         current_cell = sheet.cell(row=row + 1, column=column)
         current_cell.value = meter_data.get(meter_type)
 
     @staticmethod
+    @traced('excel.save')
     def save_data(app, data_path: str):
-        try:
-            app.save(data_path)
-        except PermissionError:
-            current_date = Helper.get_cur_date('_dd_mm')
-            app.save(data_path.replace('.xlsx', f'{current_date}.xlsx'))
-
-    @staticmethod
-    def close_workbook(program_path: str, data_path: str):
-        try:
-            excel = AppWorker.connect(program_path)
-            data_file = Helper.get_file_name(data_path)
-            if not excel[data_file].exists(timeout=5):
-                return
-            wb = excel[data_file]
-            wb['CloseButton'].click()
-            if wb['SaveButton'].exists():
-                wb['SaveButton'].click()
-            sleep(3)
-        except Exception as e:
-            log.warning(f"Workbook closing exception: {e}")
+        """Atomic save, PermissionError if the workbook is locked"""
+        save_atomic(app, data_path)
 
 
 class NotepadWriter:
 
     @classmethod
+    @traced('notepad.write')
     def write_data(cls, data: dict, data_path: str):
         """Recording dict data to Notepad row by keys"""
         
         val_str = '|'.join(str(d.values()).rjust(15) for d in data.values())
         full_str = Helper.get_cur_date('dd.mm.yyyy') + ' | ' + val_str
         with open(data_path, 'a') as f:
-            f.write(full_str)
+            f.write(full_str + '\n')
@@ -0,0 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from threading import Lock
+from time import sleep
+from service import log, ERRORS
+from tracing import tracer
+import random
+
+
+class MeterTransport:
+    """
+    Source of the meter readings
+    concurrency - how many meters can be polled at the same time
+    """
+
+    concurrency = 1
+
+    def is_connected(self, meter_id) -> bool:
+        return False
+
+    def connect(self, meter_id) -> bool:
+        raise NotImplementedError
+
+    def read(self, meter_id, value_type: str) -> float:
+        raise NotImplementedError
+
+
+class GuiMeterTransport(MeterTransport):
+    """Meter readings through the Mercury application window"""
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.connected = None
+
+    def is_connected(self, meter_id) -> bool:
+        return self.connected == meter_id
+
+    def connect(self, meter_id) -> bool:
+        self.connected = meter_id if self.worker.connect_to_meter(meter_id) else None
+        return self.connected is not None
+
+    def read(self, meter_id, value_type: str) -> float:
+        return self.worker.read_value(value_type)
+
+
+class SimulatedMeterBus(MeterTransport):
+    """
+    Meter bus simulation for benchmarks
+    :param readings: {meter_id: {value_type: value}}, meters not in dict fail to connect
+    :param latency: seconds of one connect or read
+    :param fail_rate: probability of a failed connect of an existing meter
+    """
+
+    def __init__(self, readings: dict, latency: float = 0.0, fail_rate: float = 0.0, concurrency: int = 8,
+                 seed: int | None = None):
+        self.readings = readings
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.concurrency = concurrency
+        self.connections = set()
+        self.connects = 0
+        self._random = random.Random(seed)
+        self._lock = Lock()
+
+    def is_connected(self, meter_id) -> bool:
+        return meter_id in self.connections
+
+    def connect(self, meter_id) -> bool:
+        sleep(self.latency)
+        with self._lock:
+            self.connects += 1
+            failed = self._random.random() < self.fail_rate
+        if meter_id not in self.readings or failed:
+            return False
+        self.connections.add(meter_id)
+        return True
+
+    def read(self, meter_id, value_type: str) -> float:
+        sleep(self.latency)
+        return self.readings[meter_id][value_type]
+
+
+class MeterPoller:
+    """
+    Meter polling pipeline, readings of every meter are yielded as soon as they are received.
+    Failed meters are polled again in the next round after the others, the delay before a round
+    grows as backoff * 2 ** (round - 1).
+    With the supervisor the meters whose circuit breaker is open are skipped without the connection
+    """
+
+    def __init__(self, transport: MeterTransport, value_types, attempts: int = 3, backoff: float = 2.0,
+                 supervisor=None):
+        self.transport = transport
+        self.value_types = list(value_types)
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.supervisor = supervisor
+
+    def poll_meter(self, meter_id) -> dict | None:
+        """Readings of one meter, None if the meter is unavailable"""
+
+        key = f'meter.{meter_id}'
+        with tracer.span('meter.poll', meter=meter_id):
+            if self.supervisor and not self.supervisor.allow(key):
+                log.info(ERRORS.get('circuit_skipped').format(key=key))
+                tracer.fail('circuit open')
+                return None
+            values = self.__read_meter(meter_id)
+            if self.supervisor:
+                self.supervisor.outcome(key, values is not None)
+            return values
+
+    def __read_meter(self, meter_id) -> dict | None:
+        """Readings of the meter, a value type that can't be read is missing, None if no value was read"""
+
+        try:
+            if not self.transport.is_connected(meter_id) and not self.transport.connect(meter_id):
+                tracer.fail('not connected')
+                return None
+        except Exception as e:
+            log.exception(f"Can't connect to the meter {meter_id}. Exception: {e}")
+            tracer.fail(repr(e))
+            return None
+
+        values, errors = {}, {}
+        for value_type in self.value_types:
+            try:
+                values[value_type] = float(self.transport.read(meter_id, value_type))
+            except Exception as e:
+                log.exception(f"Can't get {value_type} of the meter {meter_id}. Exception: {e}")
+                errors[value_type] = repr(e)
+        if errors:
+            tracer.annotate(errors=errors)
+        if not values:
+            tracer.fail('no values')
+            return None
+        return values
+
+    def poll(self, meters: list):
+        """
+        Poll all meters
+        :return: generator of (meter_id, readings), readings is None if all attempts failed
+        """
+
+        pending = list(meters)
+        for attempt in range(1, self.attempts + 1):
+            if attempt > 1 and pending:
+                log.info(f'Meters {pending} failed, attempt {attempt} of {self.attempts}')
+                sleep(self.backoff * 2 ** (attempt - 2))
+            failed = []
+            for meter_id, values in self.__poll_round(pending):
+                if values is None and attempt < self.attempts:
+                    failed.append(meter_id)
+                else:
+                    yield meter_id, values
+            pending = failed
+
+    def __poll_round(self, meters: list):
+        if self.transport.concurrency <= 1 or len(meters) < 2:
+            for meter_id in meters:
+                yield meter_id, self.poll_meter(meter_id)
+            return
+
+        with ThreadPoolExecutor(min(self.transport.concurrency, len(meters))) as pool:
+            futures = {pool.submit(copy_context().run, self.poll_meter, meter_id): meter_id for meter_id in meters}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
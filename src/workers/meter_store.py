@@ -0,0 +1,167 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+import mmap
+import json
+import os
+
+COLUMNS = {
+    'dates': 'I',
+    'meters': 'I',
+    'types': 'B',
+    'values': 'd'
+}
+
+
+class MeterStore:
+    """
+    Append-only columnar store of the meter readings, one record per (date, meter, value type).
+    Every column is a raw array file in the store folder, read through mmap.
+    Records are appended in date order, so a date range is found by binary search,
+    the meter index (meter -> record positions) is built once on open
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.types_path = os.path.join(folder, 'types.json')
+        self.value_types = self.__load_types()
+        self.columns = {}
+        self.meter_index = {}
+        self._maps = []
+        self.refresh()
+
+    def __load_types(self) -> dict:
+        try:
+            with open(self.types_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def column_path(self, name: str) -> str:
+        return os.path.join(self.folder, f'{name}.{COLUMNS[name]}')
+
+    def refresh(self):
+        """Map the column files, a torn last append is cut to the shortest column"""
+
+        self.close()
+        sizes = {}
+        for name, code in COLUMNS.items():
+            path = self.column_path(name)
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            sizes[name] = os.path.getsize(path) // array(code).itemsize
+        count = min(sizes.values())
+
+        for name, code in COLUMNS.items():
+            if sizes[name] > count:
+                with open(self.column_path(name), 'r+b') as f:
+                    f.truncate(count * array(code).itemsize)
+            if count == 0:
+                self.columns[name] = array(code)
+                continue
+            with open(self.column_path(name), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(mapped)
+            self.columns[name] = memoryview(mapped).cast(code)
+
+        self.meter_index = {}
+        for position, meter in enumerate(self.columns['meters']):
+            self.meter_index.setdefault(meter, array('I')).append(position)
+
+    def close(self):
+        for column in self.columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self.columns = {}
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+    def __len__(self):
+        return len(self.columns['dates'])
+
+    @property
+    def last_date(self) -> date | None:
+        return date.fromordinal(self.columns['dates'][-1]) if len(self) else None
+
+    def type_code(self, value_type: str) -> int:
+        if value_type not in self.value_types:
+            self.value_types[value_type] = len(self.value_types)
+            with open(self.types_path, 'w', encoding='utf-8') as f:
+                json.dump(self.value_types, f)
+        return self.value_types[value_type]
+
+    def append(self, day: date, readings: dict):
+        """
+        :param day: date of the readings, not earlier than the last stored date
+        :param readings: {meter: {value type: value}}, meters without readings are skipped
+        """
+
+        if self.last_date and day < self.last_date:
+            raise ValueError(f'Readings on {day} are older than the last stored date {self.last_date}')
+
+        records = {name: array(code) for name, code in COLUMNS.items()}
+        for meter, values in readings.items():
+            for value_type, value in (values or {}).items():
+                if value is None:
+                    continue
+                records['dates'].append(day.toordinal())
+                records['meters'].append(int(meter))
+                records['types'].append(self.type_code(value_type))
+                records['values'].append(float(value))
+
+        if not len(records['dates']):
+            return
+        self.close()
+        for name, column in records.items():
+            with open(self.column_path(name), 'ab') as f:
+                column.tofile(f)
+        self.refresh()
+
+    def query(self, start: date | None = None, end: date | None = None, meters=None, value_type: str | None = None):
+        """
+        Readings in the date range [start, end]
+        :return: generator of (date, meter, value type, value)
+        """
+
+        dates = self.columns['dates']
+        low = bisect_left(dates, start.toordinal()) if start else 0
+        high = bisect_right(dates, end.toordinal()) if end else len(dates)
+
+        if meters is None:
+            positions = range(low, high)
+        else:
+            positions = []
+            for meter in meters:
+                meter_positions = self.meter_index.get(int(meter), ())
+                positions.extend(meter_positions[bisect_left(meter_positions, low):bisect_left(meter_positions, high)])
+            positions.sort()
+
+        type_names = {code: name for name, code in self.value_types.items()}
+        type_code = self.value_types.get(value_type) if value_type else None
+        if value_type and type_code is None:
+            return
+        for position in positions:
+            code = self.columns['types'][position]
+            if type_code is not None and code != type_code:
+                continue
+            yield (date.fromordinal(dates[position]), self.columns['meters'][position],
+                   type_names[code], self.columns['values'][position])
+
+    def export_excel(self, data_path: str, start: date | None = None, end: date | None = None):
+        """Export the readings to a workbook: sheet per value type, row per date, column per meter"""
+
+        from .excel_append import write_streaming
+
+        tables = {}
+        for day, meter, value_type, value in self.query(start, end):
+            tables.setdefault(value_type, {}).setdefault(day, {})[meter] = value
+
+        sheets = {}
+        for value_type, rows in tables.items():
+            meters = sorted({meter for values in rows.values() for meter in values})
+            sheets[value_type] = [['date'] + meters] + [
+                [day.strftime('%d.%m.%Y')] + [rows[day].get(meter) for meter in meters] for day in sorted(rows)
+            ]
+        write_streaming(data_path, sheets)
@@ -0,0 +1,87 @@
+from datetime import date
+from service import log
+import json
+import os
+
+
+class PollJournal:
+    """
+    Readings of the day's meter poll, every meter is written to the json-lines journal as soon as it is polled.
+    A run that was interrupted or left failed meters is resumed by the next run of the same day:
+    the meters that weren't polled go first, then the failed ones, the received readings are taken from the journal.
+    The journal of another day is dropped
+    """
+
+    def __init__(self, path: str, day: date | None = None):
+        self.path = path
+        self.day = day or date.today()
+        self.readings = {}
+        self.failed = set()
+        self.stored = set()
+        self.__load()
+        self.resumed = bool(self.readings or self.failed)
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # the last line is torn if the process was killed while writing it
+                log.warning(f'Poll journal {self.path}: broken record {line!r} is skipped')
+
+        if not records or records[0].get('day') != self.day.isoformat():
+            os.remove(self.path)
+            return
+        for record in records[1:]:
+            if 'meter' in record:
+                self.__apply(record['meter'], record['values'])
+            elif 'stored' in record:
+                self.stored.update(record['stored'])
+
+    def __apply(self, meter, values: dict | None):
+        if values is None:
+            self.failed.add(meter)
+        else:
+            self.readings[meter] = values
+            self.failed.discard(meter)
+
+    def __write(self, record: dict):
+        if not os.path.exists(self.path):
+            record = [{'day': self.day.isoformat()}, record]
+        else:
+            record = [record]
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(r) + '\n' for r in record)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def pending(self, meters: list) -> list:
+        """Meters to poll: not polled yet in the given order, then the failed ones"""
+
+        unpolled = [m for m in meters if m not in self.readings and m not in self.failed]
+        return unpolled + [m for m in meters if m in self.failed]
+
+    def record(self, meter, values: dict | None):
+        """:param values: readings of the meter, None if the poll failed"""
+
+        self.__apply(meter, values)
+        self.__write({'meter': meter, 'values': values})
+
+    def unstored(self) -> dict:
+        return {meter: values for meter, values in self.readings.items() if meter not in self.stored}
+
+    def mark_stored(self, meters):
+        if meters := [m for m in meters if m not in self.stored]:
+            self.stored.update(meters)
+            self.__write({'stored': meters})
+
+    def complete(self):
+        """All meters are polled and written, the next run polls them again"""
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
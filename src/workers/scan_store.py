@@ -0,0 +1,267 @@
+"""
+BtcTools scan exports: streaming reader and the local sqlite store of the device records by date.
+Only new or changed export files are ingested, the diff queries compare two scan days
+"""
+from datetime import date, datetime
+from ipaddress import ip_address
+from service import log
+import csv
+import os
+import re
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, day INTEGER, rows INTEGER);
+CREATE TABLE IF NOT EXISTS models (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS scans (
+    day INTEGER, device INTEGER, model INTEGER, hashrate REAL, status TEXT,
+    PRIMARY KEY (day, device)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS scans_device ON scans (device, day);
+"""
+
+# export column names of the normalized fields, compared in lower case
+COLUMNS = {
+    'ip': ('ip', 'ip address', 'ip адрес', 'ip-адрес'),
+    'model': ('type', 'model', 'miner type', 'miner', 'тип', 'модель'),
+    'hashrate': ('ghs av', 'ghs avg', 'hashrate', 'hash rate', 'ghs 5s', 'хешрейт'),
+    'status': ('status', 'state', 'статус')
+}
+
+STATUSES = {'ok': 'online', 'normal': 'online', 'alive': 'online', 'running': 'online', 'mining': 'online',
+            'dead': 'offline', 'timeout': 'offline', 'unreachable': 'offline', 'not found': 'offline'}
+
+# hashrate unit prefixes relative to GH/s
+UNITS = {'': 1.0, 'k': 1e-6, 'm': 1e-3, 'g': 1.0, 't': 1e3, 'p': 1e6}
+HASHRATE = re.compile(r'^\s*([0-9]+(?:[.,][0-9]+)?)\s*([kmgtp]?)(?:h(?:/s)?)?\s*$', re.IGNORECASE)
+
+
+def parse_hashrate(value) -> float | None:
+    """Hashrate in GH/s from a number or a string like '13.5 TH/s', None if it isn't recognized"""
+
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not (match := HASHRATE.match(str(value))):
+        return None
+    return float(match.group(1).replace(',', '.')) * UNITS[match.group(2).lower()]
+
+
+def normalize_status(value, hashrate: float | None) -> str:
+    """'online', 'offline' or the export status in lower case, an empty status is taken from the hashrate"""
+
+    status = str(value or '').strip().lower()
+    if not status:
+        return 'online' if hashrate else 'offline'
+    return STATUSES.get(status, status)
+
+
+def scan_day(path: str) -> date:
+    """Date of the export from its 'scan_dd_mm' name, the year is taken from the file time"""
+
+    modified = datetime.fromtimestamp(os.path.getmtime(path)).date()
+    if match := re.search(r'(\d{2})_(\d{2})(?:\D*)$', os.path.splitext(os.path.basename(path))[0]):
+        day, month = int(match.group(1)), int(match.group(2))
+        try:
+            found = date(modified.year, month, day)
+            return found if found <= modified else found.replace(year=modified.year - 1)
+        except ValueError:
+            pass
+    return modified
+
+
+class ScanReader:
+    """Streams the device records of an exported scan (csv or xlsx) as dicts of the normalized fields"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self):
+        rows = self.__xlsx_rows() if self.path.lower().endswith('.xlsx') else self.__csv_rows()
+        columns = None
+        for row in rows:
+            if columns is None:
+                columns = self.columns(row)
+                if 'ip' not in columns:
+                    raise ValueError(f"{self.path}: IP column wasn't found in the header {row}")
+                continue
+            record = self.normalize(row, columns)
+            if record is not None:
+                yield record
+
+    def __csv_rows(self):
+        with open(self.path, encoding='utf-8-sig', errors='replace', newline='') as f:
+            header = f.readline()
+            delimiter = max(',;\t', key=header.count)
+            f.seek(0)
+            yield from csv.reader(f, delimiter=delimiter)
+
+    def __xlsx_rows(self):
+        import openpyxl
+
+        wb = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            yield from wb.worksheets[0].iter_rows(values_only=True)
+        finally:
+            wb.close()
+
+    @staticmethod
+    def columns(header) -> dict:
+        """{normalized field: column number}"""
+
+        names = [str(name or '').strip().lower() for name in header]
+        columns = {}
+        for field, aliases in COLUMNS.items():
+            for alias in aliases:
+                if alias in names:
+                    columns[field] = names.index(alias)
+                    break
+        return columns
+
+    @staticmethod
+    def normalize(row, columns: dict) -> dict | None:
+        def value(field):
+            column = columns.get(field)
+            return row[column] if column is not None and column < len(row) else None
+
+        try:
+            ip = int(ip_address(str(value('ip')).strip()))
+        except ValueError:
+            return None
+        hashrate = parse_hashrate(value('hashrate'))
+        return {
+            'ip': ip,
+            'model': str(value('model') or '').strip(),
+            'hashrate': hashrate,
+            'status': normalize_status(value('status'), hashrate)
+        }
+
+
+class ScanStore:
+    """
+    Device records of the scans in sqlite, one row per day and device (the IP address as integer).
+    :param path: database file
+    """
+
+    BATCH = 5000
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.models = dict(self.db.execute('SELECT name, id FROM models'))
+
+    def close(self):
+        self.db.close()
+
+    def model_id(self, name: str) -> int:
+        if name not in self.models:
+            self.models[name] = self.db.execute('INSERT INTO models (name) VALUES (?)', (name,)).lastrowid
+        return self.models[name]
+
+    def is_ingested(self, path: str) -> bool:
+        stat = os.stat(path)
+        row = self.db.execute('SELECT size, mtime_ns FROM files WHERE name = ?', (os.path.basename(path),)).fetchone()
+        return row == (stat.st_size, stat.st_mtime_ns)
+
+    def ingest_file(self, path: str, day: date | None = None) -> int:
+        """
+        Replace the records of the scan day by the records of the file
+        :return: number of the device records
+        """
+
+        day = (day or scan_day(path)).toordinal()
+        stat = os.stat(path)
+        try:
+            return self.__ingest(path, day, stat)
+        except Exception:
+            # the models added by the rolled back transaction don't exist
+            self.models = dict(self.db.execute('SELECT name, id FROM models'))
+            raise
+
+    def __ingest(self, path: str, day: int, stat) -> int:
+        count = 0
+        with self.db:
+            self.db.execute('DELETE FROM scans WHERE day = ?', (day,))
+            batch = []
+            for record in ScanReader(path):
+                batch.append((day, record['ip'], self.model_id(record['model']), record['hashrate'], record['status']))
+                if len(batch) >= self.BATCH:
+                    count += self.__insert(batch)
+            count += self.__insert(batch)
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                            (os.path.basename(path), stat.st_size, stat.st_mtime_ns, day, count))
+        return count
+
+    def __insert(self, batch: list) -> int:
+        # the last record of a device listed twice in the export is kept
+        self.db.executemany('INSERT OR REPLACE INTO scans VALUES (?, ?, ?, ?, ?)', batch)
+        count = len(batch)
+        batch.clear()
+        return count
+
+    def ingest_folder(self, folder: str, pattern: str = r'^scan.*\.(csv|xlsx)$') -> dict:
+        """
+        Ingest the new and changed exports of the folder
+        :return: {file name: number of records}
+        """
+
+        ingested = {}
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if not re.match(pattern, name, re.IGNORECASE) or self.is_ingested(path):
+                continue
+            try:
+                ingested[name] = self.ingest_file(path)
+            except Exception as e:
+                log.exception(f'Scan export {name} ingestion exception: {e}')
+        return ingested
+
+    def days(self) -> list[date]:
+        return [date.fromordinal(d) for d, in self.db.execute('SELECT DISTINCT day FROM scans ORDER BY day')]
+
+    def previous_day(self, day: date) -> date | None:
+        row = self.db.execute('SELECT MAX(day) FROM scans WHERE day < ?', (day.toordinal(),)).fetchone()
+        return date.fromordinal(row[0]) if row[0] else None
+
+    def __days(self, day: date | None, previous: date | None) -> tuple:
+        day = day or (self.days() or [date.today()])[-1]
+        previous = previous or self.previous_day(day)
+        return day.toordinal(), previous.toordinal() if previous else None
+
+    def gone_offline(self, day: date | None = None, previous: date | None = None) -> list[dict]:
+        """Devices online at the previous scan, which are offline or missing at the scan of the day"""
+
+        day, previous = self.__days(day, previous)
+        rows = self.db.execute("""
+            SELECT p.device, m.name, p.hashrate, c.status
+            FROM scans p
+            LEFT JOIN scans c ON c.day = ? AND c.device = p.device
+            LEFT JOIN models m ON m.id = p.model
+            WHERE p.day = ? AND p.status = 'online' AND (c.device IS NULL OR c.status != 'online')
+            ORDER BY p.device""", (day, previous))
+        return [{'ip': str(ip_address(device)), 'model': model, 'hashrate': hashrate, 'status': status or 'missing'}
+                for device, model, hashrate, status in rows]
+
+    def hashrate_drops(self, day: date | None = None, previous: date | None = None,
+                       threshold: float = 0.1) -> list[dict]:
+        """Devices whose hashrate fell by more than threshold (a share of the previous hashrate)"""
+
+        day, previous = self.__days(day, previous)
+        rows = self.db.execute("""
+            SELECT c.device, m.name, p.hashrate, c.hashrate
+            FROM scans c
+            JOIN scans p ON p.day = ? AND p.device = c.device
+            LEFT JOIN models m ON m.id = c.model
+            WHERE c.day = ? AND p.hashrate > 0 AND c.hashrate < p.hashrate * (1 - ?)
+            ORDER BY (p.hashrate - c.hashrate) / p.hashrate DESC""", (previous, day, threshold))
+        return [{'ip': str(ip_address(device)), 'model': model, 'previous': before, 'hashrate': after,
+                 'drop': round(1 - after / before, 4)}
+                for device, model, before, after in rows]
+
+    def device_history(self, ip: str) -> list[dict]:
+        rows = self.db.execute("""
+            SELECT s.day, m.name, s.hashrate, s.status FROM scans s LEFT JOIN models m ON m.id = s.model
+            WHERE s.device = ? ORDER BY s.day""", (int(ip_address(ip)),))
+        return [{'day': date.fromordinal(day), 'model': model, 'hashrate': hashrate, 'status': status}
+                for day, model, hashrate, status in rows]
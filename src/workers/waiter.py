@@ -0,0 +1,248 @@
+from threading import Event
+from time import monotonic
+
+
+class WaitTimeout(TimeoutError):
+    pass
+
+
+class WaitCancelled(Exception):
+    pass
+
+
+class WaitStats:
+    """
+    Latency figures of one finished wait
+    detect_latency - time between the completion and its detection. If the completion moment was
+                     reported through Waiter.mark_completed() the value is exact, otherwise it is
+                     the upper bound: time since the last poll that saw the condition unmet
+    """
+
+    def __init__(self, name: str, started: float, detected: float, last_miss: float,
+                 completed: float | None, polls: int, outcome: str):
+        self.name = name
+        self.waited = detected - started
+        self.polls = polls
+        self.outcome = outcome
+        self.exact = completed is not None
+        self.detect_latency = detected - (completed if completed is not None else last_miss)
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'waited': round(self.waited, 3),
+            'detect_latency': round(self.detect_latency, 3),
+            'exact': self.exact,
+            'polls': self.polls,
+            'outcome': self.outcome
+        }
+
+    def __repr__(self):
+        return f'WaitStats({self.as_dict()})'
+
+
+class Waiter:
+    """
+    Wait engine with adaptive backoff polling, deadline and cancellation.
+    The poll interval starts from 'interval' and grows by 'backoff' up to 'max_interval'.
+    Event sources (UI callbacks, other threads) can call notify() to force an immediate re-check
+    and mark_completed() to report the exact completion moment for the latency figures.
+    """
+
+    def __init__(self,
+                 timeout: float | None = None,
+                 interval: float = 0.1,
+                 max_interval: float = 5.0,
+                 backoff: float = 1.5,
+                 clock=monotonic):
+        self.timeout = timeout
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.clock = clock
+        self.history: list[WaitStats] = []
+        self._wake = Event()
+        self._cancelled = Event()
+        self._completed_at = None
+
+    def notify(self):
+        """Hook for event sources: wake the waiting thread to check the condition right now"""
+        self._wake.set()
+
+    def mark_completed(self, at: float | None = None):
+        """Hook for event sources: report the moment the awaited process actually finished"""
+        self._completed_at = self.clock() if at is None else at
+        self._wake.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._wake.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def until(self, condition, name: str = 'wait', timeout: float | None = None):
+        """
+        Poll condition until it returns a truthy value
+        :param condition: callable without arguments
+        :param name: wait name for the latency figures
+        :param timeout: overrides the waiter timeout, None - wait without deadline
+        :return: the truthy value returned by the condition
+        """
+
+        timeout = self.timeout if timeout is None else timeout
+        started = last_miss = self.clock()
+        deadline = started + timeout if timeout is not None else None
+        interval = self.interval
+        polls = 0
+        self._completed_at = None
+
+        while True:
+            if self._cancelled.is_set():
+                self._record(name, started, last_miss, polls, 'cancelled')
+                raise WaitCancelled(f'{name} was cancelled')
+
+            self._wake.clear()
+            polls += 1
+            result = condition()
+            if result:
+                self._record(name, started, last_miss, polls, 'done')
+                return result
+
+            last_miss = self.clock()
+            delay = interval
+            if deadline is not None:
+                if last_miss >= deadline:
+                    self._record(name, started, last_miss, polls, 'timeout')
+                    raise WaitTimeout(f'{name} was not completed in {timeout} s')
+                delay = min(delay, deadline - last_miss)
+
+            self._wake.wait(delay)
+            interval = min(interval * self.backoff, self.max_interval)
+
+    def _record(self, name, started, last_miss, polls, outcome):
+        self.history.append(WaitStats(name, started, self.clock(), last_miss, self._completed_at, polls, outcome))
+
+
+def exists(element):
+    """Condition: the element exists in the dialog"""
+    return lambda: element.exists(timeout=0)
+
+
+def gone(element):
+    """Condition: the element disappeared from the dialog"""
+    return lambda: not element.exists(timeout=0)
+
+
+def enabled(element):
+    """Condition: the element exists and accepts input"""
+
+    def check():
+        try:
+            return element.exists(timeout=0) and element.is_enabled()
+        except Exception:
+            return False
+    return check
+
+
+def text_changed(element, old_text: str | None = None):
+    """
+    Condition: the element text differs from old_text
+    if old_text is None, the text at the moment of the condition creation is used
+    :return: the new text
+    """
+
+    def read():
+        try:
+            return element.window_text()
+        except Exception:
+            return None
+
+    initial = read() if old_text is None else old_text
+
+    def check():
+        text = read()
+        return text if text is not None and text != initial else None
+    return check
+
+
+def any_of(*conditions):
+    """Condition: the first of conditions that is met"""
+
+    def check():
+        for condition in conditions:
+            if result := condition():
+                return result
+        return None
+    return check
+
+
+class WaitSteps:
+    """
+    Declarative 'wait until' layer of one application
+    The timeout of every step can be set in the app section of config.ini as '<step>_timeout'.
+    With the supervisor the durations of the finished steps are kept as '<scope>.<step>' and the steps
+    without the configured timeout are limited by the timeout learned from them.
+    Every wait is recorded, profile() compares the actually waited time with the step timeout
+    """
+
+    def __init__(self, app_conf, waiter: Waiter | None = None, supervisor=None, scope: str = ''):
+        self.app_conf = app_conf
+        self.waiter = waiter or Waiter()
+        self.supervisor = supervisor
+        self.scope = scope
+        self.timeouts = {}
+
+    def step_timeout(self, step: str, default: float | None, key: str | None = None) -> float | None:
+        """
+        The configured '<step>_timeout', otherwise the default shortened to the learned timeout.
+        The learned timeout of the key is used first, then the one of the step
+        """
+
+        if (configured := self.app_conf.getfloat(f'{step}_timeout', fallback=None)) is not None:
+            return configured
+        if self.supervisor is None:
+            return default
+        keys = [f'{self.scope}.{name}' for name in dict.fromkeys([key or step, step])]
+        if (learned := self.supervisor.learned_timeout(*keys)) is None:
+            return default if default is not None else self.supervisor.max_timeout
+        return learned if default is None else min(default, learned)
+
+    def until(self, step: str, condition, timeout: float | None = None, required: bool = True,
+              key: str | None = None, failures: tuple = ()):
+        """
+        Wait until the condition is met
+        :param step: step name, also the config key prefix
+        :param condition: callable without arguments
+        :param timeout: default step timeout in seconds
+        :param required: if False, the step timeout is not an error and None is returned
+        :param key: history key of the step, e.g. the step of one meter, its timeout falls back to the step one
+        :param failures: results of the condition that end the wait as a failure, their durations aren't kept
+        """
+
+        self.timeouts[step] = timeout = self.step_timeout(step, timeout, key)
+        try:
+            result = self.waiter.until(condition, step, timeout)
+        except WaitTimeout:
+            if required:
+                raise
+            return None
+        if self.supervisor is not None and result not in failures:
+            for name in dict.fromkeys([key or step, step]):
+                self.supervisor.record(f'{self.scope}.{name}', self.waiter.history[-1].waited)
+        return result
+
+    def profile(self) -> dict:
+        """Summary of the recorded waits by the step name"""
+
+        summary = {}
+        for stats in self.waiter.history:
+            step = summary.setdefault(stats.name, {
+                'count': 0, 'total': 0.0, 'max': 0.0, 'timeouts': 0, 'timeout': self.timeouts.get(stats.name)
+            })
+            step['count'] += 1
+            step['total'] = round(step['total'] + stats.waited, 3)
+            step['max'] = round(max(step['max'], stats.waited), 3)
+            step['timeouts'] += stats.outcome == 'timeout'
+        return summary
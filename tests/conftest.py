@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules import each other from the src folder, as when the program is run from it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,48 @@
+from service import ConfigError, LazyConfig
+import pytest
+
+CONFIG = """
+[SCHEDULE]
+start_time = 09:00
+sleep_time = 60
+auto_launch = 1
+
+[AUTOMATIONS]
+btctools = 0
+
+[NOTIFICATIONS]
+tg_recipients = [1]
+"""
+
+
+def config(tmp_path, text: str) -> LazyConfig:
+    path = tmp_path / 'config.ini'
+    path.write_text(CONFIG + text, encoding='utf-8')
+    configuration = LazyConfig(str(path))
+    configuration.load()
+    return configuration
+
+
+def test_valid_optional_options(tmp_path):
+    config(tmp_path, '[SCHEDULES]\nbtctools = ["0 9 * * 1-5", "18:30"]\n'
+                     '[EXECUTION]\nparallel = ["btctools"]\n[LOGGING]\nlevels = {"waiter": "DEBUG"}\n').validate()
+
+
+@pytest.mark.parametrize('text, problem', [
+    ('[SCHEDULES]\nbtctools = ["99 99 * * *"]\n', '[SCHEDULES] btctools'),
+    ('[SCHEDULES]\nbtctools = ["0 0 30 2 *"]\n', '[SCHEDULES] btctools'),
+    ('[SCHEDULES]\nbtctools = 09:00\n', '[SCHEDULES] btctools'),
+    ('[EXECUTION]\nparallel = [btctools\n', '[EXECUTION] parallel'),
+    ('[LOGGING]\nlevels = ["DEBUG"]\n', '[LOGGING] levels'),
+])
+def test_broken_optional_options(tmp_path, text, problem):
+    with pytest.raises(ConfigError, match=problem.replace('[', r'\[').replace(']', r'\]')):
+        config(tmp_path, text).validate()
+
+
+def test_broken_change_is_not_applied(tmp_path):
+    configuration = config(tmp_path, '[SCHEDULES]\nbtctools = ["09:00"]\n')
+    path = tmp_path / 'config.ini'
+    path.write_text(CONFIG + '[SCHEDULES]\nbtctools = ["99 99 * * *"]\n', encoding='utf-8')
+    assert not configuration.reload_if_changed()
+    assert configuration.json_list('SCHEDULES', 'btctools') == ['09:00']
@@ -0,0 +1,151 @@
+from workers.excel_append import WorkbookIndex, XlsxAppender
+import openpyxl
+import os
+import re
+import zipfile
+import pytest
+
+MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet2.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/sharedStrings.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{REL}/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+    'xl/workbook.xml':
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><workbook xmlns="{MAIN}" xmlns:r="{REL}"><sheets>'
+        '<sheet name="reset_energy" sheetId="1" r:id="rId1"/><sheet name="previous_day" sheetId="2" r:id="rId2"/>'
+        '</sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{REL}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{REL}/worksheet" Target="worksheets/sheet2.xml"/>'
+        f'<Relationship Id="rId3" Type="{REL}/sharedStrings" Target="sharedStrings.xml"/></Relationships>',
+    'xl/sharedStrings.xml':
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><sst xmlns="{MAIN}" count="3" uniqueCount="3">'
+        '<si><t>date</t></si><si><t>01.01.2026</t></si><si><t>Счётчик</t></si></sst>',
+    # the sheets as Excel writes them: shared strings and an empty sheet data element
+    'xl/worksheets/sheet1.xml':
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><worksheet xmlns="{MAIN}">'
+        '<dimension ref="A1:C2"/><sheetData>'
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1"><v>101</v></c><c r="C1"><v>102</v></c></row>'
+        '<row r="2"><c r="A2" t="s"><v>1</v></c><c r="B2"><v>1.5</v></c><c r="C2" t="s"><v>2</v></c></row>'
+        '</sheetData></worksheet>',
+    'xl/worksheets/sheet2.xml':
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><worksheet xmlns="{MAIN}">'
+        '<dimension ref="A1"/><sheetData/></worksheet>'
+}
+
+
+def excel_workbook(path) -> str:
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, content in PARTS.items():
+            z.writestr(name, content)
+    return str(path)
+
+
+def values(path: str, sheet: str) -> list:
+    wb = openpyxl.load_workbook(path)
+    try:
+        return [list(row) for row in wb[sheet].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+
+def dimension(path: str, part: str) -> str:
+    with zipfile.ZipFile(path) as z:
+        return re.search(r'<dimension ref="([^"]+)"', z.read(part).decode()).group(1)
+
+
+@pytest.mark.parametrize('chunk', [1 << 20, 7])
+def test_append_to_excel_workbook(tmp_path, chunk):
+    path = excel_workbook(tmp_path / 'data.xlsx')
+    appender = XlsxAppender(path)
+    appender.CHUNK = chunk
+    appender.append({
+        'reset_energy': [(3, {1: '02.01.2026', 2: 2.5, 3: 3.0}), (4, {1: '03.01.2026', 2: 3.5, 3: None})],
+        'previous_day': [(2, {1: '03.01.2026', 4: 7})]
+    })
+
+    assert values(path, 'reset_energy') == [['date', 101, 102], ['01.01.2026', 1.5, 'Счётчик'],
+                                           ['02.01.2026', 2.5, 3], ['03.01.2026', 3.5, None]]
+    assert values(path, 'previous_day') == [[None, None, None, None], ['03.01.2026', None, None, 7]]
+    assert dimension(path, 'xl/worksheets/sheet1.xml') == 'A1:C4'
+    assert dimension(path, 'xl/worksheets/sheet2.xml') == 'A1:D2'
+    with zipfile.ZipFile(path) as z:
+        assert z.read('xl/sharedStrings.xml').decode() == PARTS['xl/sharedStrings.xml']
+
+
+def test_append_to_openpyxl_workbook(tmp_path):
+    path = str(tmp_path / 'data.xlsx')
+    wb = openpyxl.Workbook()
+    wb.active.title = 'reset_energy'
+    wb.active.append(['date', 101, 102])
+    wb.active.append(['01.01.2026', 1.0, 2.0])
+    wb.create_sheet('previous_day')
+    wb.save(path)
+
+    XlsxAppender(path).append({'reset_energy': [(3, {1: '02.01.2026', 2: 1.5, 3: 2.5})],
+                               'previous_day': [(1, {1: 'date & time <x>'})]})
+    assert values(path, 'reset_energy')[-1] == ['02.01.2026', 1.5, 2.5]
+    assert values(path, 'previous_day') == [['date & time <x>']]
+    wb = openpyxl.load_workbook(path)
+    assert wb['reset_energy'].dimensions == 'A1:C3'
+
+
+def test_missing_sheet_data_keeps_the_workbook(tmp_path):
+    path = excel_workbook(tmp_path / 'data.xlsx')
+    with zipfile.ZipFile(path) as z:
+        parts = {name: z.read(name) for name in z.namelist()}
+    parts['xl/worksheets/sheet2.xml'] = f'<worksheet xmlns="{MAIN}"><dimension ref="A1"/></worksheet>'.encode()
+    with zipfile.ZipFile(path, 'w') as z:
+        for name, content in parts.items():
+            z.writestr(name, content)
+    before = open(path, 'rb').read()
+
+    with pytest.raises(ValueError):
+        XlsxAppender(path).append({'previous_day': [(1, {1: 'x'})]})
+    assert open(path, 'rb').read() == before
+    assert not os.path.exists(f'{path}.tmp')
+
+
+def test_index_rebuild(tmp_path):
+    path = excel_workbook(tmp_path / 'data.xlsx')
+    index = WorkbookIndex(path)
+    assert not index.loaded
+    index.rebuild(['reset_energy', 'previous_day'], 1, range(2, 4))
+    assert index.sheets['reset_energy'] == {'last_row': 2, 'last_date': '01.01.2026'}
+    assert index.sheets['previous_day'] == {'last_row': 1, 'last_date': None}
+    assert index.headers['reset_energy'].columns == {101: 2, 102: 3}
+
+
+def test_index_is_valid_after_a_touch_by_its_hash(tmp_path):
+    path = excel_workbook(tmp_path / 'data.xlsx')
+    index = WorkbookIndex(path)
+    index.rebuild(['reset_energy'], 1, range(2, 4))
+    index.save()
+    assert WorkbookIndex(path).loaded
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    touched = WorkbookIndex(path)
+    assert touched.loaded
+    assert touched.sheets['reset_energy']['last_date'] == '01.01.2026'
+
+    XlsxAppender(path).append({'reset_energy': [(3, {1: '02.01.2026'})]})
+    assert not WorkbookIndex(path).loaded
@@ -0,0 +1,61 @@
+from service import config, Helper
+from workers import mercury_worker
+from workers.excel_append import PendingRows
+from workers.mercury_worker import ExcelWriter
+import openpyxl
+import pytest
+
+SHEETS = ['previous_day', 'reset_energy']
+METERS = [101, 102]
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / 'data.xlsx')
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for name in SHEETS:
+        wb.create_sheet(name).append(['date'] + METERS)
+    wb.save(path)
+    config.read_dict({'Excel': {'meter_index_row': '1', 'meter_index_col_first': '2', 'meter_index_col_last': '4',
+                                'write_mode': 'append', 'workbook_unlocked_timeout': '0'}})
+    return path
+
+
+def readings(value: float) -> dict:
+    return {meter: {'previous_day': value, 'reset_energy': value * 10} for meter in METERS}
+
+
+def rows(path: str, sheet: str = 'reset_energy') -> list:
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return [list(row) for row in wb[sheet].iter_rows(min_row=2, values_only=True)]
+    finally:
+        wb.close()
+
+
+def test_locked_workbook_keeps_the_rows_pending(workbook, monkeypatch):
+    monkeypatch.setattr(mercury_worker, 'is_locked', lambda path: True)
+    ExcelWriter().write_workbook_data(readings(1.0), workbook)
+    assert list(PendingRows(workbook).load()) == [Helper.get_cur_date('dd.mm.yyyy')]
+    assert rows(workbook) == []
+    # the workbook is still open between the runs
+    assert not ExcelWriter().flush_pending(workbook)
+
+
+def test_pending_rows_are_flushed_when_the_workbook_is_free(workbook, monkeypatch):
+    monkeypatch.setattr(mercury_worker, 'is_locked', lambda path: True)
+    ExcelWriter().write_workbook_data(readings(1.0), workbook)
+    monkeypatch.setattr(mercury_worker, 'is_locked', lambda path: False)
+
+    assert ExcelWriter().flush_pending(workbook)
+    assert rows(workbook) == [[Helper.get_cur_date('dd.mm.yyyy'), 10.0, 10.0]]
+    assert PendingRows(workbook).load() == {}
+    assert not ExcelWriter().flush_pending(workbook)
+
+
+def test_pending_days_are_written_before_today(workbook):
+    PendingRows(workbook).save({'01.01.2026': readings(1.0)})
+    ExcelWriter().write_workbook_data(readings(2.0), workbook)
+    assert rows(workbook) == [['01.01.2026', 10.0, 10.0], [Helper.get_cur_date('dd.mm.yyyy'), 20.0, 20.0]]
+    assert PendingRows(workbook).load() == {}
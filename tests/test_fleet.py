@@ -0,0 +1,196 @@
+from threading import Lock, Thread
+from time import sleep
+from fleet import Agent, Coordinator
+from tracing import tracer
+import pytest
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Run:
+    """Coordinator.execute in a background thread, the test plays the agents"""
+
+    def __init__(self, coordinator: Coordinator, programs: list | None = None, timeout: float | None = None):
+        self.report = None
+        self.thread = Thread(target=self.execute, args=(coordinator, programs, timeout), daemon=True)
+        self.thread.start()
+        for _ in range(500):
+            if coordinator.jobs:
+                return
+            sleep(0.01)
+        raise AssertionError('no jobs are queued')
+
+    def execute(self, coordinator, programs, timeout):
+        self.report = coordinator.execute(programs, timeout)
+
+    def wait(self):
+        self.thread.join(10)
+        assert self.report is not None, 'the run is not finished'
+        return {r['program']: r for r in self.report.results}
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def coordinator(clock: Clock, plants=('p1',), agent_timeout: float = 60.0) -> Coordinator:
+    return Coordinator(plants, results_path=None, agent_timeout=agent_timeout, clock=clock)
+
+
+def programs_of(lease: dict) -> list:
+    return [job['program'] for job in lease['jobs']]
+
+
+def test_jobs_go_to_the_least_loaded_agent(clock):
+    fleet = coordinator(clock)
+    fleet.register('small', 'p1', ['x', 'y', 'z'], capacity=1)
+    fleet.register('big', 'p1', ['x', 'y', 'z'], capacity=2)
+    run = Run(fleet, ['x', 'y', 'z'])
+
+    # after one job the big agent is loaded by half, the idle small agent gets the next one
+    assert programs_of(fleet.lease('big', 2)) == ['x']
+    small = fleet.lease('small', 1)
+    assert programs_of(small) == ['y']
+    assert fleet.lease('small', 1) == {'jobs': []}
+    big = fleet.lease('big', 1)
+    assert programs_of(big) == ['z']
+
+    for agent, lease in (('small', small), ('big', big)):
+        fleet.result(agent, lease['jobs'][0]['id'], True, 1.0)
+    x = [job for job in fleet.jobs.values() if job['program'] == 'x'][0]
+    fleet.result('big', x['id'], True, 1.0)
+    results = run.wait()
+    assert {name: r['agent'] for name, r in results.items()} == {'p1/x': 'big', 'p1/y': 'small', 'p1/z': 'big'}
+    assert run.report.failed == []
+
+
+def test_jobs_of_a_lost_agent_are_queued_again_then_failed(clock):
+    fleet = coordinator(clock, agent_timeout=1.0)
+    fleet.register('a', 'p1', ['x'])
+    fleet.register('b', 'p1', ['x'])
+    run = Run(fleet, ['x'])
+    job = fleet.lease('a', 1)['jobs'][0]
+
+    clock.now = 5.0
+    assert fleet.lease('b', 1)['jobs'] == [job]
+    # b is lost too, the job isn't queued the third time
+    clock.now = 10.0
+    results = run.wait()
+    assert results['p1/x']['result'] is False
+    assert results['p1/x']['error'] == 'agent b is lost'
+
+
+def test_plant_without_live_agents_fails(clock):
+    fleet = coordinator(clock, plants=('p1', 'p2'), agent_timeout=10.0)
+    fleet.register('p2-agent', 'p2', ['x'])
+    clock.now = 20.0
+    fleet.register('p1-agent', 'p1', ['x'])
+    run = Run(fleet)
+    lease = fleet.lease('p1-agent', 1)
+    fleet.result('p1-agent', lease['jobs'][0]['id'], True, 1.0)
+
+    results = run.wait()
+    assert set(results) == {'p1/x', 'p2/*'}
+    assert results['p1/x']['result'] is True
+    assert results['p2/*']['result'] is False
+    assert results['p2/*']['error'] == 'no live agents'
+
+
+def test_round_timeout_fails_the_unfinished_jobs(clock):
+    fleet = coordinator(clock)
+    fleet.register('a', 'p1', ['x', 'y'])
+    run = Run(fleet, ['x', 'y'], timeout=0.5)
+    job = fleet.lease('a', 1)['jobs'][0]
+    clock.now = 1.0
+
+    results = run.wait()
+    assert results[f"p1/{job['program']}"]['error'] == 'timeout in the state leased'
+    assert sorted(run.report.failed) == ['p1/x', 'p1/y']
+    assert fleet.jobs == {}
+
+
+def test_late_result_is_rejected(clock):
+    fleet = coordinator(clock)
+    fleet.register('a', 'p1', ['x'])
+    run = Run(fleet, ['x'], timeout=0.5)
+    job = fleet.lease('a', 1)['jobs'][0]
+    clock.now = 1.0
+    run.wait()
+
+    assert fleet.result('a', job['id'], True, 1.0) == {'accepted': False}
+    assert run.report.failed == ['p1/x']
+
+
+def test_second_result_is_rejected(clock):
+    fleet = coordinator(clock)
+    fleet.register('a', 'p1', ['x'])
+    run = Run(fleet, ['x'])
+    job = fleet.lease('a', 1)['jobs'][0]
+    assert fleet.result('a', job['id'], True, 1.0) == {'accepted': True}
+    assert fleet.result('a', job['id'], False, 1.0) == {'accepted': False}
+    assert run.wait()['p1/x']['result'] is True
+
+
+class Recorder:
+    """Runner of the agent: records the programs running at the same time"""
+
+    def __init__(self, duration: float = 0.1):
+        self.duration = duration
+        self.running = set()
+        self.overlaps = []
+        self._lock = Lock()
+
+    def __call__(self, program: str) -> dict:
+        with tracer.span('program', program=program):
+            with self._lock:
+                self.running.add(program)
+                self.overlaps.append(set(self.running))
+            sleep(self.duration)
+            with self._lock:
+                self.running.discard(program)
+        return {'program': program, 'result': program != 'broken', 'duration': self.duration, 'error': None}
+
+
+def test_agent_runs_only_the_parallel_programs_together(tmp_path):
+    fleet = Coordinator(['p1'], results_path=None)
+    server = fleet.serve('127.0.0.1', 0, token='secret')
+    runner = Recorder()
+    agent = Agent(f'http://127.0.0.1:{server.server_address[1]}', 'a', 'p1', ['alone', 'y', 'z', 'broken'],
+                  capacity=3, poll_interval=0.02, token='secret', runner=runner, parallel=['y', 'z', 'broken'],
+                  run_log=str(tmp_path / 'agent_log.jsonl'))
+    thread = Thread(target=agent.run, daemon=True)
+    thread.start()
+    try:
+        for _ in range(500):
+            if fleet.status()['agents']:
+                break
+            sleep(0.01)
+        spans = []
+        with tracer.run('automation', spans=spans):
+            report = fleet.execute(timeout=30)
+    finally:
+        agent.stop()
+        thread.join(10)
+        server.shutdown()
+        server.server_close()
+
+    assert report.failed == ['p1/broken']
+    assert all(overlap == {'alone'} for overlap in runner.overlaps if 'alone' in overlap)
+    assert max(len(overlap) for overlap in runner.overlaps) > 1
+
+    # the spans of the jobs are written by the agent and added to the run of the coordinator
+    jobs = [span for span in spans if span['name'] == 'fleet.job']
+    assert sorted(span['attrs']['program'] for span in jobs) == ['alone', 'broken', 'y', 'z']
+    assert [span['outcome'] for span in jobs if span['attrs']['program'] == 'broken'] == ['failed']
+    root = [span for span in spans if span['name'] == 'automation'][0]
+    assert {span['parent'] for span in jobs} == {root['id']}
+    assert len([span for span in spans if span['name'] == 'program']) == 4
+    assert (tmp_path / 'agent_log.jsonl').read_text(encoding='utf-8').count('"fleet.job"') == 4
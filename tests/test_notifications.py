@@ -0,0 +1,122 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic
+from notifications import NotificationDispatcher, NotificationQueue, TelegramApi, TgSender
+from service import config
+import json
+import pytest
+
+
+class FakeTelegram:
+    """Local stand-in of the Bot API: replies to sendMessage by the script of every chat, then 200"""
+
+    def __init__(self):
+        self.script = {}
+        self.requests = []
+        self._lock = Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handler(self):
+        telegram = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with telegram._lock:
+                    telegram.requests.append((monotonic(), self.path, body))
+                    replies = telegram.script.get(body['chat_id'], [])
+                    status, data = replies.pop(0) if replies else (200, {'ok': True})
+                content = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def times(self, chat_id) -> list:
+        return [moment for moment, _, body in self.requests if body['chat_id'] == chat_id]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def telegram():
+    server = FakeTelegram()
+    yield server
+    server.close()
+
+
+def dispatcher(telegram: FakeTelegram, queue_path, **kwargs) -> NotificationDispatcher:
+    return NotificationDispatcher(TelegramApi('token', telegram.url, timeout=5), NotificationQueue(str(queue_path)),
+                                  rate=1000, **kwargs)
+
+
+def test_sent_to_all_recipients(telegram, tmp_path):
+    report = dispatcher(telegram, tmp_path / 'queue.jsonl').dispatch('failed', [1, 2, 3])
+    assert report == {'sent': 3, 'rejected': 0, 'queued': 0}
+    assert {body['chat_id'] for _, _, body in telegram.requests} == {1, 2, 3}
+    assert {path for _, path, _ in telegram.requests} == {'/bottoken/sendMessage'}
+
+
+def test_server_errors_are_retried_with_backoff(telegram, tmp_path):
+    telegram.script[1] = [(502, {}), (500, {'description': 'internal'})]
+    report = dispatcher(telegram, tmp_path / 'queue.jsonl', attempts=3, backoff=0.1).dispatch('failed', [1])
+    assert report['sent'] == 1
+    first, second, third = telegram.times(1)
+    assert second - first >= 0.1
+    assert third - second >= 0.2
+
+
+def test_rate_limit_waits_retry_after(telegram, tmp_path):
+    telegram.script[1] = [(429, {'ok': False, 'parameters': {'retry_after': 1}})]
+    report = dispatcher(telegram, tmp_path / 'queue.jsonl', backoff=0.01).dispatch('failed', [1])
+    assert report['sent'] == 1
+    first, second = telegram.times(1)
+    assert second - first >= 1
+
+
+def test_rejected_recipient_does_not_stop_the_others(telegram, tmp_path):
+    telegram.script[2] = [(400, {'ok': False, 'description': 'Bad Request: chat not found'})]
+    queue = tmp_path / 'queue.jsonl'
+    report = dispatcher(telegram, queue, backoff=0.01).dispatch('failed', [1, 2, 3])
+    assert report == {'sent': 2, 'rejected': 1, 'queued': 0}
+    # the rejected message isn't retried and isn't queued
+    assert len(telegram.times(2)) == 1
+    assert not queue.exists()
+
+
+def test_undelivered_messages_are_queued_and_flushed_by_the_next_run(telegram, tmp_path):
+    queue_path = tmp_path / 'queue.jsonl'
+    telegram.script[1] = [(503, {})] * 2
+    report = dispatcher(telegram, queue_path, attempts=2, backoff=0.01).dispatch('failed', [1, 2])
+    assert report == {'sent': 1, 'rejected': 0, 'queued': 1}
+    assert NotificationQueue(str(queue_path)).load() == [{'chat_id': 1, 'text': 'failed'}]
+
+    config.read_dict({'NOTIFICATIONS': {'tg_recipients': '[1, 2]', 'api_url': telegram.url,
+                                        'queue_path': str(queue_path)}})
+    sender = TgSender('token')
+    try:
+        assert sender.flush() == {'sent': 1, 'rejected': 0, 'queued': 0}
+    finally:
+        sender.close()
+    assert not queue_path.exists()
+    assert len(telegram.times(1)) == 3
+    assert sender.flush() == {}
+
+
+def test_connection_error_is_queued(tmp_path):
+    queue_path = tmp_path / 'queue.jsonl'
+    closed = FakeTelegram()
+    closed.close()
+    report = dispatcher(closed, queue_path, attempts=2, backoff=0.01).dispatch('failed', [1])
+    assert report['queued'] == 1
+    assert NotificationQueue(str(queue_path)).load() == [{'chat_id': 1, 'text': 'failed'}]
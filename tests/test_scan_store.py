@@ -0,0 +1,44 @@
+from datetime import date
+from workers import scan_store
+from workers.scan_store import ScanStore
+import os
+
+
+def export(folder, name: str, rows: list) -> str:
+    path = os.path.join(folder, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('IP,Type,GHS av,Status\n')
+        f.writelines(f'{ip},{model},{hashrate},{status}\n' for ip, model, hashrate, status in rows)
+    return path
+
+
+def test_ingest_and_diff(tmp_path):
+    store = ScanStore(str(tmp_path / 'scans.db'))
+    export(tmp_path, 'scan_01_02.csv', [('10.0.0.1', 'S19', '95 TH/s', 'ok'), ('10.0.0.2', 'S19', '90 TH/s', 'ok')])
+    store.ingest_file(str(tmp_path / 'scan_01_02.csv'), date(2026, 2, 1))
+    export(tmp_path, 'scan_02_02.csv', [('10.0.0.1', 'S19', '60 TH/s', 'ok'), ('10.0.0.2', 'S19', '', 'dead')])
+    store.ingest_file(str(tmp_path / 'scan_02_02.csv'), date(2026, 2, 2))
+
+    assert [d['ip'] for d in store.gone_offline()] == ['10.0.0.2']
+    assert [(d['ip'], d['drop']) for d in store.hashrate_drops()] == [('10.0.0.1', 0.3684)]
+    store.close()
+
+
+def test_failed_ingest_forgets_its_models(tmp_path, monkeypatch):
+    store = ScanStore(str(tmp_path / 'scans.db'))
+    path = export(tmp_path, 'scan_01_02.csv', [('10.0.0.1', 'S21', '200', 'ok')])
+    reader = scan_store.ScanReader
+
+    def broken_reader(path):
+        yield from reader(path)
+        raise ValueError('broken export')
+
+    monkeypatch.setattr(scan_store, 'ScanReader', broken_reader)
+    assert store.ingest_folder(str(tmp_path)) == {}
+    monkeypatch.setattr(scan_store, 'ScanReader', reader)
+
+    # the next file of the same store refers to the model row that exists
+    export(tmp_path, 'scan_02_02.csv', [('10.0.0.1', 'S21', '200', 'ok')])
+    assert store.ingest_folder(str(tmp_path)) == {'scan_01_02.csv': 1, 'scan_02_02.csv': 1}
+    assert {row['model'] for row in store.device_history('10.0.0.1')} == {'S21'}
+    store.close()
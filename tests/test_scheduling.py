@@ -0,0 +1,163 @@
+from datetime import datetime
+from scheduling import CronSchedule, FakeClock, RunLock, ScheduleEngine, ScheduleState, parse_schedules
+import pytest
+
+
+def engine(clock: FakeClock, expressions: list, state: ScheduleState | None = None, **kwargs) -> ScheduleEngine:
+    return ScheduleEngine({'job': [CronSchedule(e) for e in expressions]}, state or ScheduleState(None),
+                          clock=clock, **kwargs)
+
+
+def finished_at(moment: datetime) -> ScheduleState:
+    state = ScheduleState(None)
+    state.runs = {'job': {'started': moment.isoformat(), 'finished': moment.isoformat()}}
+    return state
+
+
+@pytest.mark.parametrize('expression, moment, expected', [
+    ('09:00', datetime(2026, 1, 5, 8, 0), datetime(2026, 1, 5, 9, 0)),
+    ('09:00', datetime(2026, 1, 5, 9, 0), datetime(2026, 1, 6, 9, 0)),
+    ('*/15 * * * *', datetime(2026, 1, 5, 10, 7, 30), datetime(2026, 1, 5, 10, 15)),
+    ('5/20 * * * *', datetime(2026, 1, 5, 10, 26), datetime(2026, 1, 5, 10, 45)),
+    ('0 0 * * 7', datetime(2026, 1, 5), datetime(2026, 1, 11)),
+    ('@weekly', datetime(2026, 1, 5), datetime(2026, 1, 11)),
+    ('0 0 31 * *', datetime(2026, 4, 1), datetime(2026, 5, 31)),
+    ('0 0 29 2 *', datetime(2025, 3, 1), datetime(2028, 2, 29)),
+    ('59 23 31 12 *', datetime(2026, 12, 31, 23, 59), datetime(2027, 12, 31, 23, 59)),
+])
+def test_next_after(expression, moment, expected):
+    assert CronSchedule(expression).next_after(moment) == expected
+
+
+def test_day_and_weekday_match_either():
+    # the 13th or Friday, as in cron
+    schedule = CronSchedule('0 12 13 * 5')
+    assert schedule.next_after(datetime(2026, 2, 10)) == datetime(2026, 2, 13, 12, 0)
+    assert schedule.next_after(datetime(2026, 2, 13, 12, 0)) == datetime(2026, 2, 20, 12, 0)
+
+
+@pytest.mark.parametrize('expression', ['24:00', '0 0 * *', '60 * * * *', '0 0 0 * *', '5-1 * * * *', '*/0 * * * *'])
+def test_incorrect_expression(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_schedule_never_runs():
+    with pytest.raises(ValueError):
+        CronSchedule('0 0 30 2 *').next_after(datetime(2026, 1, 1))
+
+
+def test_runs_by_schedule_with_fake_clock():
+    clock = FakeClock(datetime(2026, 1, 5, 8, 0))
+    runs = []
+    engine(clock, ['09:00', '0 18 * * 1-5'], max_sleep=3600).run(lambda names: runs.append(clock.now()),
+                                                                 until=datetime(2026, 1, 7, 8, 0))
+    assert runs == [datetime(2026, 1, 5, 9, 0), datetime(2026, 1, 5, 18, 0),
+                    datetime(2026, 1, 6, 9, 0), datetime(2026, 1, 6, 18, 0)]
+    assert max(clock.sleeps) <= 3600
+
+
+def test_missed_run_is_caught_up_once():
+    clock = FakeClock(datetime(2026, 1, 8, 10, 0))
+    schedules = engine(clock, ['09:00'], finished_at(datetime(2026, 1, 4, 9, 30)))
+    assert schedules.run_pending(lambda names: None) == ['job']
+    # the runs of the 5th-7th are not repeated
+    assert schedules.run_pending(lambda names: None) == []
+    assert schedules.next_due('job') == datetime(2026, 1, 9, 9, 0)
+
+
+def test_missed_run_is_skipped_without_catch_up():
+    clock = FakeClock(datetime(2026, 1, 8, 10, 0))
+    schedules = engine(clock, ['09:00'], finished_at(datetime(2026, 1, 4, 9, 30)), catch_up=False)
+    assert schedules.run_pending(lambda names: None) == []
+    assert schedules.next_due('job') == datetime(2026, 1, 9, 9, 0)
+
+
+def test_times_passed_during_the_run_are_skipped():
+    clock = FakeClock(datetime(2026, 1, 5, 10, 0))
+    schedules = engine(clock, ['@hourly'])
+    clock.advance(hours=1)
+    assert schedules.run_pending(lambda names: clock.advance(hours=2, minutes=30)) == ['job']
+    assert schedules.state.finished('job') == datetime(2026, 1, 5, 13, 30)
+    assert schedules.next_due('job') == datetime(2026, 1, 5, 14, 0)
+
+
+def test_failed_run_is_finished_and_unlocked(tmp_path):
+    clock = FakeClock(datetime(2026, 1, 5, 9, 0))
+    lock = RunLock(str(tmp_path / 'run.lock'))
+    schedules = engine(clock, ['* * * * *'], lock=lock)
+    clock.advance(minutes=1)
+
+    def fail(names):
+        raise RuntimeError('failed')
+
+    assert schedules.run_pending(fail) == ['job']
+    assert not (tmp_path / 'run.lock').exists()
+    assert not schedules.state.interrupted('job')
+
+
+def test_run_lock(tmp_path):
+    path = str(tmp_path / 'run.lock')
+    now = datetime(2026, 1, 5, 9, 0)
+    first, second = RunLock(path, stale_after=3600), RunLock(path, stale_after=3600)
+    assert first.acquire(now)
+    assert not second.acquire(now)
+    first.release()
+    assert second.acquire(now)
+
+
+def test_stale_or_broken_lock_is_taken_over(tmp_path):
+    path = tmp_path / 'run.lock'
+    now = datetime(2026, 1, 5, 9, 0)
+    path.write_text(datetime(2026, 1, 5, 7, 0).isoformat(), encoding='utf-8')
+    assert RunLock(str(path), stale_after=3600).acquire(now)
+    assert path.read_text(encoding='utf-8') == now.isoformat()
+    path.write_text('broken', encoding='utf-8')
+    assert RunLock(str(path), stale_after=3600).acquire(now)
+
+
+def test_locked_run_is_skipped(tmp_path):
+    path = str(tmp_path / 'run.lock')
+    clock = FakeClock(datetime(2026, 1, 5, 8, 0))
+    assert RunLock(path).acquire(clock.now())
+    runs = []
+    schedules = engine(clock, ['09:00'], lock=RunLock(path))
+    clock.advance(hours=1)
+    assert schedules.run_pending(runs.append) == []
+    assert runs == []
+    # the run of another process counts as done
+    assert schedules.next_due('job') == datetime(2026, 1, 6, 9, 0)
+
+
+def test_state_is_kept_between_the_starts(tmp_path):
+    path = str(tmp_path / 'state.json')
+    clock = FakeClock(datetime(2026, 1, 5, 9, 0))
+    state = ScheduleState(path)
+    state.start(['job'], clock.now())
+    assert ScheduleState(path).interrupted('job')
+    state.finish(['job'], clock.now())
+    restored = ScheduleState(path)
+    assert not restored.interrupted('job')
+    assert restored.finished('job') == datetime(2026, 1, 5, 9, 0)
+    assert engine(clock, ['09:00'], restored).next_due('job') == datetime(2026, 1, 6, 9, 0)
+
+
+
+def test_bad_reloaded_schedules_keep_the_current_ones():
+    clock = FakeClock(datetime(2026, 1, 5, 8, 0))
+    runs = []
+    schedules = engine(clock, ['09:00'])
+    # the reload of a config with a broken schedule, as Scheduler.schedule_work does it
+    schedules.run(lambda names: runs.append(clock.now()), until=datetime(2026, 1, 7, 8, 0),
+                  reload=lambda: parse_schedules({'job': ['99 99 * * *']}))
+    assert runs == [datetime(2026, 1, 5, 9, 0), datetime(2026, 1, 6, 9, 0)]
+    assert schedules.schedules['job'][0].expression == '09:00'
+
+
+def test_reloaded_schedules_are_applied():
+    clock = FakeClock(datetime(2026, 1, 5, 8, 0))
+    runs = []
+    reloads = iter([None, parse_schedules({'job': ['10:30']})])
+    engine(clock, ['09:00']).run(lambda names: runs.append(clock.now()), until=datetime(2026, 1, 6, 12, 0),
+                                 reload=lambda: next(reloads, None))
+    assert runs == [datetime(2026, 1, 5, 10, 30), datetime(2026, 1, 6, 10, 30)]
@@ -0,0 +1,75 @@
+from supervisor import CircuitBreaker, Supervisor
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_breaker_opens_after_the_threshold():
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    assert not breaker.failure(0) and not breaker.failure(1)
+    assert breaker.failure(2)
+    assert breaker.state(30) == 'open' and not breaker.allow(30)
+    assert breaker.state(62) == 'half-open'
+
+
+def test_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker(threshold=1, cooldown=60)
+    breaker.failure(0)
+    assert breaker.allow(60)
+    # the other callers wait for the outcome of the trial
+    assert not breaker.allow(61)
+    assert not breaker.allow(100)
+    breaker.success()
+    assert breaker.state(101) == 'closed' and breaker.allow(101)
+
+
+def test_failed_trial_opens_the_breaker_for_longer():
+    breaker = CircuitBreaker(threshold=1, cooldown=60)
+    breaker.failure(0)
+    assert breaker.allow(60)
+    assert breaker.failure(61)
+    assert breaker.cooldown == 120
+    assert not breaker.allow(150)
+    assert breaker.allow(181)
+
+
+def test_trial_without_outcome_is_given_up():
+    breaker = CircuitBreaker(threshold=1, cooldown=60)
+    breaker.failure(0)
+    assert breaker.allow(60)
+    assert not breaker.allow(119)
+    assert breaker.allow(120)
+
+
+def test_supervisor_skips_the_calls_during_the_trial(tmp_path):
+    clock = Clock()
+    supervisor = Supervisor(str(tmp_path / 'supervisor.json'), failure_threshold=2, cooldown=60, clock=clock)
+    supervisor.failure('meter.1')
+    supervisor.failure('meter.1')
+    assert not supervisor.allow('meter.1')
+    clock.now += 60
+    assert [supervisor.allow('meter.1') for _ in range(3)] == [True, False, False]
+    supervisor.outcome('meter.1', True)
+    assert supervisor.allow('meter.1') and supervisor.allow('meter.1')
+    assert supervisor.allow('meter.2')
+
+
+def test_breakers_and_durations_are_kept(tmp_path):
+    path = str(tmp_path / 'supervisor.json')
+    clock = Clock()
+    supervisor = Supervisor(path, min_samples=3, timeout_factor=2, min_timeout=1, failure_threshold=1, clock=clock)
+    for seconds in (1.0, 2.0, 4.0):
+        supervisor.record('app.step', seconds)
+    supervisor.failure('app.mercury')
+    supervisor.save()
+
+    restored = Supervisor(path, min_samples=3, timeout_factor=2, min_timeout=1, failure_threshold=1, clock=clock)
+    assert restored.learned_timeout('app.other', 'app.step') == 8.0
+    assert restored.open_breakers() == ['app.mercury']
+    assert not restored.allow('app.mercury')